@@ -353,8 +353,9 @@ _lazy_import('timer', [
 ])
 
 # IO/Socket handling
-_lazy_import('io', ['IOMonitor', 'WeakIOMonitor', 'IO_READ', 'IO_WRITE', 'IOChannel'])
-_lazy_import('sockets', ['Socket'])
+_lazy_import('io', ['IOMonitor', 'WeakIOMonitor', 'IO_READ', 'IO_WRITE', 'IOChannel', 'RateLimiter', 'io_stats'])
+_lazy_import('sockets', ['Socket', 'DatagramSocket'])
+_lazy_import('asyncfile', ['AsyncFile', 'MappedFile'])
 
 # Event and event handler classes
 _lazy_import('event', ['Event', 'EventHandler', 'WeakEventHandler'])
@@ -370,7 +371,8 @@ _lazy_import('coroutine', [
 _lazy_import('generator', ['Generator', 'generator'])
 
 # process management
-_lazy_import('process', ['Process'])
+_lazy_import('process', ['Process', 'Pipeline', 'ProcessQueue'])
+_lazy_import('procpool', ['ProcessPool', 'ProcessPoolError', 'processed'])
 
 # special gobject thread support
 _lazy_import('gobject', ['GOBJECT', 'gobject_set_threaded'])
@@ -278,6 +278,20 @@ class InProgress(Signal, Object):
         return self._finished
 
 
+    def _exception_handled(self):
+        """
+        Marks the exception thrown to the InProgress as handled, so that it
+        isn't logged.
+        """
+        # _unhandled_exception could be True if the InProgress exception
+        # is being handled synchronously (via the exception callback).  So
+        # check that it's actually a weakref instance before trying to
+        # remove it from the global unhandled exceptions set.
+        if isinstance(self._unhandled_exception, _weakref.ref):
+            _unhandled_exceptions.remove(self._unhandled_exception)
+            self._unhandled_exception = None
+
+
     @property
     def result(self):
         """
@@ -287,13 +301,7 @@ class InProgress(Signal, Object):
         if not self._finished:
             raise RuntimeError('operation not finished')
         if self._exception:
-            # _unhandled_exception could be True if the InProgress exception
-            # is being handled synchronously (via the exception callback).  So
-            # check that it's actually a weakref instance before trying to
-            # remove it from the global unhandled exceptions set.
-            if isinstance(self._unhandled_exception, _weakref.ref):
-                _unhandled_exceptions.remove(self._unhandled_exception)
-                self._unhandled_exception = None
+            self._exception_handled()
             if self._exception[2]:
                 # We have the traceback, so we can raise using it.
                 exc_type, exc_value, exc_tb_or_stack = self._exception
@@ -0,0 +1,656 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# asyncfile.py - Asynchronous and memory mapped access to regular files
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+__all__ = [ 'AsyncFile', 'MappedFile' ]
+
+import os
+import stat
+import mmap
+import logging
+
+from .utils import property
+from .strutils import BYTES_TYPE
+from .core import Object
+from .thread import ThreadPool, ThreadInProgress, get_thread_pool
+from .coroutine import coroutine, NotFinished, POLICY_SYNCHRONIZED
+from .generator import generator
+
+# get logging object
+log = logging.getLogger('kaa.base.asyncfile')
+
+# Filesystems for which page faults may take arbitrarily long, so files on
+# them are never mapped.
+_REMOTE_FS = set(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs',
+                  'coda', '9p', 'ceph', 'glusterfs', 'lustre', 'gfs2',
+                  'ocfs2', 'fuse', 'fuseblk', 'fuse.sshfs'])
+
+# Default thread pool for file operations, kept separate from the default
+# thread pool so that a slow disk cannot starve other threaded tasks.  No
+# threads are started until the first operation.
+_pool = ThreadPool(4)
+
+
+def _is_local(path):
+    """
+    Returns True if the given path is known to reside on a local filesystem.
+    Currently only implemented for Linux; elsewhere, False is returned.
+    """
+    try:
+        mounts = open('/proc/mounts').readlines()
+    except (IOError, OSError):
+        return False
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    for line in mounts:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # Spaces in mount points are escaped as \040.
+        mnt = fields[1].replace('\\040', ' ')
+        if (path == mnt or path.startswith(mnt.rstrip('/') + '/')) and len(mnt) >= len(best):
+            best, fstype = mnt, fields[2]
+    return fstype is not None and fstype not in _REMOTE_FS and not fstype.startswith('fuse.')
+
+
+def _map(fileno):
+    """
+    Maps the given file read-only, returning (mmap, memoryview).  On Python 2,
+    mmap objects don't support memoryview, so the memoryview is None.
+    """
+    mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    try:
+        return mm, memoryview(mm)
+    except TypeError:
+        return mm, None
+
+
+def _view(mm, mv, start, end):
+    """
+    Returns a zero-copy view of the given range of a mapping returned by
+    _map().
+    """
+    if mv is not None:
+        return mv[start:end]
+    return buffer(mm, start, end - start)
+
+
+def _pread(f, offset, size):
+    # Executed in the file's thread pool.  Operations on one AsyncFile are
+    # serialized, so seeking the shared file object is safe.
+    f.seek(offset)
+    return f.read(size)
+
+
+def _pwrite(f, offset, data):
+    # Executed in the file's thread pool.  For files opened in append mode,
+    # the kernel ignores the offset and writes to the end of the file.
+    f.seek(offset)
+    f.write(data)
+    return f.tell()
+
+
+def _seek(f, offset, whence):
+    # Executed in the file's thread pool.
+    f.seek(offset, whence)
+    return f.tell()
+
+
+class AsyncFile(Object):
+    """
+    Reads and writes regular files without blocking the main loop.
+
+    :param file: filename or file object (which should be opened in binary
+                 mode) to operate on
+    :param mode: mode to open *file* with, if it is a filename
+    :type mode: str
+    :param read_ahead: minimum number of bytes read from the file at once;
+                       data beyond what was requested is buffered for
+                       subsequent reads.
+    :type read_ahead: int
+    :param mmap_threshold: files opened read-only that are at least this
+                           large and reside on a local filesystem are
+                           memory mapped.  None disables mapping.
+    :type mmap_threshold: int
+    :param pool: the :class:`~kaa.ThreadPool` (or name of a registered pool)
+                 in which file operations are performed.  If None, a pool
+                 shared by all AsyncFile objects is used.
+
+    Regular files are always reported as readable by the notifier, so an
+    :class:`~kaa.IOChannel` wrapping one performs blocking reads in the main
+    loop, which stalls the application on slow disks or network filesystems.
+    AsyncFile instead performs I/O in a dedicated thread pool, and all
+    operations return :class:`~kaa.InProgress` objects.
+
+    Operations on the same AsyncFile are executed in the order they are
+    called, so it is not necessary to wait for one to finish before
+    issuing the next::
+
+        f = kaa.AsyncFile('/var/log/messages')
+        yield f.seek(-4096, 2)
+        while True:
+            line = yield f.readline()
+            if not line:
+                break
+
+    Reads that can be satisfied from the read-ahead buffer finish immediately
+    without involving a thread.  Memory mapped files are read directly from
+    the mapping, and with ``view=True``, :meth:`read` returns a zero-copy view
+    onto the mapping rather than a copy.  The mapping covers the file as it
+    was when opened; data appended afterward is not visible.
+    """
+    def __init__(self, file, mode='rb', read_ahead=65536, mmap_threshold=4*1024*1024, pool=None):
+        super(AsyncFile, self).__init__()
+        if isinstance(file, basestring):
+            # Reads and writes are buffered here rather than by the file
+            # object, which would otherwise need to be flushed from the pool.
+            file = open(file, mode, 0)
+        self._file = file
+        self._name = getattr(file, 'name', None)
+        self._mode = getattr(file, 'mode', mode)
+        self._read_ahead = read_ahead
+        self._pool = get_thread_pool(pool) if isinstance(pool, basestring) else (pool or _pool)
+        # Logical position in the file, i.e. where the next read or write
+        # starts.  The underlying file object's position is not meaningful.
+        self._pos = file.tell()
+        # Data read ahead of the logical position.
+        self._rbuf = BYTES_TYPE()
+        self._eof = False
+        self._mmap = self._view = None
+
+        if mmap_threshold is not None and not set('wa+') & set(self._mode):
+            st = os.fstat(file.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size >= mmap_threshold and \
+               self._name and _is_local(self._name):
+                self._mmap, self._view = _map(file.fileno())
+
+
+    def __repr__(self):
+        return '<kaa.AsyncFile %r mode=%r at 0x%x>' % (self._name, self._mode, id(self))
+
+
+    @property
+    def name(self):
+        """
+        The name of the file, if known.
+        """
+        return self._name
+
+
+    @property
+    def mode(self):
+        """
+        The mode the file was opened with.
+        """
+        return self._mode
+
+
+    @property
+    def read_ahead(self):
+        """
+        Minimum number of bytes read from the file at once.
+        """
+        return self._read_ahead
+
+
+    @read_ahead.setter
+    def read_ahead(self, value):
+        self._read_ahead = value
+
+
+    @property
+    def mapped(self):
+        """
+        True if the file is memory mapped.
+        """
+        return self._mmap is not None
+
+
+    @property
+    def closed(self):
+        """
+        True if the file has been closed.
+        """
+        return self._file is None
+
+
+    def tell(self):
+        """
+        Returns the current position in the file.
+
+        The position reflects all operations that have finished; operations
+        still pending are not accounted for.
+        """
+        return self._pos
+
+
+    def _check_closed(self):
+        if self._file is None:
+            raise ValueError('I/O operation on closed file')
+
+
+    def _run(self, func, *args):
+        """
+        Performs the given function in the thread pool, passing it the file
+        object and the given arguments.
+        """
+        job = ThreadInProgress(func, self._file, *args)
+        self._pool.enqueue(job)
+        return job
+
+
+    def _slice(self, offset, size, view):
+        """
+        Returns data from the memory mapped file, as a view if requested.
+        """
+        end = min(offset + size, len(self._mmap)) if size >= 0 else len(self._mmap)
+        offset = min(offset, end)
+        if not view:
+            return self._mmap[offset:end]
+        return _view(self._mmap, self._view, offset, end)
+
+
+    def _consume(self, size):
+        """
+        Removes up to size bytes (or all if size is negative) from the
+        read-ahead buffer, advancing the position.
+        """
+        if size < 0 or size >= len(self._rbuf):
+            data, self._rbuf = self._rbuf, BYTES_TYPE()
+        else:
+            data, self._rbuf = self._rbuf[:size], self._rbuf[size:]
+        self._pos += len(data)
+        return data
+
+
+    @coroutine()
+    def _fill(self, size):
+        """
+        Reads at least size bytes (or until end of file if size is negative)
+        into the read-ahead buffer.  Buffers less data only if end of file was
+        reached.  Called only from the synchronized public methods.
+        """
+        chunks = [self._rbuf]
+        have = len(self._rbuf)
+        while (size < 0 or have < size) and not self._eof:
+            want = max(size - have, self._read_ahead) if size >= 0 else -1
+            data = yield self._run(_pread, self._pos + have, want)
+            if not data or (want > 0 and len(data) < want):
+                self._eof = True
+            chunks.append(data)
+            have += len(data)
+        self._rbuf = BYTES_TYPE().join(chunks)
+
+
+    @coroutine(policy=POLICY_SYNCHRONIZED, group='io')
+    def read(self, size=-1, view=False):
+        """
+        Reads from the file.
+
+        :param size: maximum number of bytes to read, or -1 to read until end
+                     of file
+        :type size: int
+        :param view: if True and the file is memory mapped, a zero-copy view
+                     (``memoryview`` or ``buffer``) onto the mapping is
+                     returned instead of a copy of the data.
+        :type view: bool
+        :returns: an :class:`~kaa.InProgress` finished with the data read,
+                  which is shorter than *size* only at end of file.
+        """
+        self._check_closed()
+        if self._mmap is not None:
+            data = self._slice(self._pos, size, view)
+            self._pos += len(data)
+            yield data
+
+        if size < 0 or len(self._rbuf) < size:
+            # Buffer is exhausted: reset the EOF flag so that data appended
+            # to the file since is picked up.
+            self._eof = False
+            yield self._fill(size)
+        yield self._consume(size)
+
+
+    @coroutine(policy=POLICY_SYNCHRONIZED, group='io')
+    def readline(self, size=-1):
+        """
+        Reads one line from the file.
+
+        :param size: maximum number of bytes to read, or -1 for no limit
+        :type size: int
+        :returns: an :class:`~kaa.InProgress` finished with the line,
+                  including the trailing newline, or with an empty string at
+                  end of file.
+        """
+        self._check_closed()
+        if self._mmap is not None:
+            end = self._mmap.find(b'\n', self._pos)
+            end = len(self._mmap) if end < 0 else end + 1
+            if size >= 0:
+                end = min(end, self._pos + size)
+            data = self._mmap[self._pos:end]
+            self._pos += len(data)
+            yield data
+
+        self._eof = False
+        start = 0
+        while True:
+            idx = self._rbuf.find(b'\n', start)
+            if idx >= 0:
+                size = idx + 1 if size < 0 else min(size, idx + 1)
+                break
+            elif self._eof or (size >= 0 and len(self._rbuf) >= size):
+                break
+            # Only scan new data on the next pass.
+            start = len(self._rbuf)
+            yield self._fill(len(self._rbuf) + 1)
+        yield self._consume(size)
+
+
+    @coroutine(policy=POLICY_SYNCHRONIZED, group='io')
+    def write(self, data):
+        """
+        Writes data to the file at the current position.
+
+        :param data: the data to write
+        :type data: bytes
+        :returns: an :class:`~kaa.InProgress` finished with the number of
+                  bytes written.
+        """
+        self._check_closed()
+        if self._mmap is not None:
+            raise IOError('file not open for writing')
+        # Discard read-ahead, which the write may overlap.
+        self._rbuf = BYTES_TYPE()
+        self._pos = yield self._run(_pwrite, self._pos, data)
+        yield len(data)
+
+
+    @coroutine(policy=POLICY_SYNCHRONIZED, group='io')
+    def seek(self, offset, whence=0):
+        """
+        Changes the position in the file.
+
+        :param offset: the new position, relative to *whence*
+        :type offset: int
+        :param whence: 0 (``os.SEEK_SET``) for the start of the file, 1
+                       (``os.SEEK_CUR``) for the current position, or 2
+                       (``os.SEEK_END``) for the end of the file.
+        :returns: an :class:`~kaa.InProgress` finished with the new position.
+
+        Seeking relative to the end of the file is performed in the thread
+        pool (unless the file is memory mapped), as it requires the size of
+        the file.  Other seeks finish immediately, and keep read-ahead data
+        beyond the new position.
+        """
+        self._check_closed()
+        if whence == 1:
+            offset, whence = self._pos + offset, 0
+        elif whence == 2 and self._mmap is not None:
+            offset, whence = len(self._mmap) + offset, 0
+
+        if whence == 0:
+            if offset < 0:
+                raise IOError('invalid seek offset %d' % offset)
+            skip = offset - self._pos
+            if 0 <= skip <= len(self._rbuf):
+                self._rbuf = self._rbuf[skip:]
+            else:
+                self._rbuf = BYTES_TYPE()
+            self._pos = offset
+        else:
+            self._rbuf = BYTES_TYPE()
+            self._pos = yield self._run(_seek, offset, whence)
+        yield self._pos
+
+
+    @coroutine(policy=POLICY_SYNCHRONIZED, group='io')
+    def close(self):
+        """
+        Closes the file once pending operations have finished.
+
+        :returns: an :class:`~kaa.InProgress` finished when the file is
+                  closed.
+        """
+        if self._file is None:
+            yield None
+        if self._mmap is not None:
+            self._view = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views returned by read() are still alive, so the mapping is
+                # released once they are garbage collected.
+                pass
+            self._mmap = None
+        f, self._file = self._file, None
+        self._rbuf = BYTES_TYPE()
+        # close() may block (e.g. flushing to NFS), so do it in the pool.
+        job = ThreadInProgress(f.close)
+        self._pool.enqueue(job)
+        yield job
+
+
+
+class MappedFile(object):
+    """
+    Provides zero-copy access to a file by mapping it into memory.
+
+    :param file: filename or file object to map
+    :param advise: if True and supported by the platform (Python 3.8+), the
+                   kernel is advised of the access pattern during :meth:`scan`,
+                   and pages already scanned are released, keeping resident
+                   memory bounded for files larger than RAM.
+    :type advise: bool
+
+    Unlike reading through an :class:`~kaa.IOChannel`, which copies data into
+    its read queue and again into strings, slicing a MappedFile returns views
+    (``memoryview`` on Python 3, ``buffer`` on Python 2) onto the mapping, so
+    data is only paged in from the page cache as it is accessed::
+
+        mf = kaa.MappedFile('/var/lib/index.dat')
+        header = mf[:16]
+        for start, end in mf.lines(offsets=True):
+            ...
+
+    Page faults block the calling thread, so MappedFile is best suited to
+    local files, or to use from a thread.  From the main loop, :meth:`scan`
+    processes the file in chunks, yielding to the main loop in between.
+
+    The mapping covers the file as it was when opened; the file must not be
+    truncated while mapped.
+    """
+    def __init__(self, file, advise=True):
+        if isinstance(file, basestring):
+            file = open(file, 'rb')
+        self._file = file
+        self._name = getattr(file, 'name', None)
+        if os.fstat(file.fileno()).st_size:
+            self._mmap, self._mv = _map(file.fileno())
+        else:
+            # Empty files can't be mapped.
+            self._mmap, self._mv = BYTES_TYPE(), None
+        self._advise = advise and hasattr(self._mmap, 'madvise')
+
+
+    def __repr__(self):
+        return '<kaa.MappedFile %r size=%d at 0x%x>' % (self._name, len(self), id(self))
+
+
+    def __len__(self):
+        return len(self._mmap)
+
+
+    def __getitem__(self, key):
+        """
+        Returns a view of a slice of the file, or the byte at an index.
+        """
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self._mmap))
+            if step != 1:
+                raise ValueError('MappedFile slices must be contiguous')
+            return self.view(start, end)
+        return self._mmap[key]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    @property
+    def name(self):
+        """
+        The name of the file, if known.
+        """
+        return self._name
+
+
+    @property
+    def closed(self):
+        """
+        True if the file has been closed.
+        """
+        return self._file is None
+
+
+    def view(self, start=0, end=None):
+        """
+        Returns a zero-copy view of part of the file.
+
+        :param start: offset of the first byte
+        :param end: offset one past the last byte, or None for end of file
+        """
+        if self._file is None:
+            raise ValueError('I/O operation on closed file')
+        size = len(self._mmap)
+        end = size if end is None else max(0, min(end, size))
+        start = max(0, min(start, end))
+        if isinstance(self._mmap, BYTES_TYPE):
+            return self._mmap[start:end]
+        return _view(self._mmap, self._mv, start, end)
+
+
+    def find(self, sub, start=0, end=None):
+        """
+        Returns the lowest offset at which *sub* is found within the given
+        range, or -1 if not found.
+        """
+        return self._mmap.find(sub, start, len(self._mmap) if end is None else end)
+
+
+    def lines(self, start=0, end=None, offsets=False):
+        """
+        Iterates over lines in the file without copying them.
+
+        :param start: offset to start at, which should be at the start of a line
+        :param end: offset to stop at, or None for end of file
+        :param offsets: if True, (start, end) offset tuples are yielded
+                        instead of views
+        :type offsets: bool
+
+        Lines include their trailing newline, except possibly the last one.
+        """
+        end = len(self._mmap) if end is None else min(end, len(self._mmap))
+        find = self._mmap.find
+        while start < end:
+            eol = find(b'\n', start, end)
+            eol = end if eol < 0 else eol + 1
+            yield (start, eol) if offsets else self.view(start, eol)
+            start = eol
+
+
+    def _release(self, start, end):
+        """
+        Advises the kernel that the pages in the given range are no longer
+        needed, so they don't count against resident memory.  The data is
+        paged in again from the file if accessed.
+        """
+        page = mmap.PAGESIZE
+        start = start // page * page
+        end = end // page * page
+        if self._advise and end > start:
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+    @generator()
+    @coroutine()
+    def scan(self, chunk=4*1024*1024, offsets=False):
+        """
+        Iterates over lines in the file from the main loop, yielding to the
+        main loop after every chunk.
+
+        :param chunk: approximate number of bytes processed before yielding
+                      to the main loop
+        :type chunk: int
+        :param offsets: if True, (start, end) offset tuples are produced
+                        instead of views
+        :type offsets: bool
+        :returns: a :class:`~kaa.Generator` producing lists of lines, one list
+                  per chunk.
+
+        This is used from a coroutine as follows::
+
+            for batch in (yield mf.scan()):
+                for line in (yield batch):
+                    process(line)
+        """
+        if self._advise:
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        size = len(self._mmap)
+        start = 0
+        while start < size:
+            # Extend the chunk to the end of a line.
+            end = self._mmap.find(b'\n', min(start + chunk, size) - 1)
+            end = size if end < 0 else end + 1
+            yield list(self.lines(start, end, offsets))
+            yield NotFinished
+            # Views of released pages remain valid; they are paged in again
+            # if accessed.
+            self._release(start, end)
+            start = end
+
+
+    def close(self):
+        """
+        Unmaps and closes the file.
+
+        On Python 3, the mapping is only released once all views returned
+        by this object have been garbage collected.
+        """
+        if self._file is None:
+            return
+        if not isinstance(self._mmap, BYTES_TYPE):
+            self._mv = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        self._mmap = BYTES_TYPE()
+        self._file.close()
+        self._file = None
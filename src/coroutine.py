@@ -629,6 +629,7 @@ class CoroutineInProgress(InProgress):
             self._prerequisite_ip = None
             if prereq._exception:
                 tp, exc, tb = prereq._exception
+                prereq._exception_handled()
                 prereq._unhandled_exception = None
                 if isinstance(exc, InProgressAborted):
                     # Exception being raised inside the generator is an InProgressAborted.
@@ -24,7 +24,7 @@
 # -----------------------------------------------------------------------------
 from __future__ import absolute_import
 
-__all__ = [ 'IO_READ', 'IO_WRITE', 'IO_EXCEPT', 'IOMonitor', 'WeakIOMonitor', 'IOChannel' ]
+__all__ = [ 'IO_READ', 'IO_WRITE', 'IO_EXCEPT', 'IOMonitor', 'WeakIOMonitor', 'IOChannel', 'RateLimiter', 'io_stats' ]
 
 import sys
 import os
@@ -35,6 +35,8 @@ import fcntl
 import re
 import errno
 import threading
+import collections
+import weakref
 try:
     from io import BytesIO
 except ImportError:
@@ -47,6 +49,7 @@ from .callable import WeakCallable
 from .core import Object, Signal, CoreThreading
 from .thread import MainThreadCallable, threaded, MAINTHREAD
 from .async import InProgress, inprogress
+from .timer import OneShotTimer
 from . import main
 
 # get logging object
@@ -120,6 +123,241 @@ class WeakIOMonitor(notifier.WeakNotifierCallback, IOMonitor):
     pass
 
 
+# Names of counters in IOChannel.stats that are maxima rather than totals.
+_STATS_MAX = ('read_queue_hwm', 'write_queue_hwm', 'drain_time_max')
+
+# Maps id(channel) -> (weakref, class name, stats dict) for all channels, so
+# the stats of live channels can be aggregated without holding references
+# to them.
+_stats_live = {}
+# Maps class name -> aggregated stats of channels that no longer exist.
+_stats_retired = {}
+
+
+def _new_stats(channel):
+    """
+    Creates the stats dict for a new channel and adds it to the registry.
+    """
+    stats = dict.fromkeys(('bytes_read', 'bytes_written', 'reads', 'writes', 'eagain_read',
+                           'eagain_write', 'read_queue_hwm', 'write_queue_hwm', 'drain_time',
+                           'drain_time_max'), 0)
+    key = id(channel)
+    def retire(ref):
+        ref, name, stats = _stats_live.pop(key)
+        _merge_stats(_stats_retired.setdefault(name, {'channels': 0}), stats)
+    _stats_live[key] = weakref.ref(channel, retire), channel.__class__.__name__, stats
+    return stats
+
+
+def _merge_stats(totals, stats):
+    totals['channels'] = totals.get('channels', 0) + 1
+    for name, value in stats.items():
+        if name == 'drain_time':
+            continue
+        elif name in _STATS_MAX:
+            totals[name] = max(totals.get(name, 0), value)
+        else:
+            totals[name] = totals.get(name, 0) + value
+
+
+def io_stats(live_only=False):
+    """
+    Returns I/O statistics aggregated by channel class.
+
+    :param live_only: if True, only channels which currently exist are
+                      counted; otherwise channels which have since been
+                      destroyed are included too.
+    :type live_only: bool
+    :returns: a dict keyed on class name (e.g. ``Socket``), whose values are
+              dicts with the same keys as :attr:`kaa.IOChannel.stats`, where
+              counters are summed and high-water marks are maxima over all
+              channels of that class, plus a *channels* key holding the number
+              of channels.
+
+    This is useful to find which kinds of channels (and from there, with
+    :attr:`~kaa.IOChannel.stats`, which channels) are responsible for most
+    I/O.
+    """
+    totals = {}
+    if not live_only:
+        for name, stats in _stats_retired.items():
+            totals[name] = stats.copy()
+    for ref, name, stats in _stats_live.values():
+        _merge_stats(totals.setdefault(name, {'channels': 0}), stats)
+    return totals
+
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of data transferred over one or more
+    :class:`~kaa.IOChannel` objects using a token bucket.
+
+    :param rate: the sustained rate in bytes per second
+    :type rate: int
+    :param burst: the size of the bucket in bytes, which is the amount of
+                  data that may be transferred at once after the channels
+                  have been idle; if None, one second's worth (*rate*).
+    :type burst: int
+
+    A limiter is attached to a channel via its :attr:`~kaa.IOChannel.read_limiter`
+    or :attr:`~kaa.IOChannel.write_limiter` property.  The same limiter may
+    be attached to many channels (in either direction) to cap their
+    aggregate rate, and a channel may have its own limiter in addition to
+    sharing one through a wrapper, e.g. a per-connection limit for bulk
+    transfers while interactive traffic is left unlimited.
+
+    When the bucket is empty, channels stop monitoring their file
+    descriptors and a timer wakes them once enough tokens have accumulated,
+    so throttled channels consume no CPU.  Wakeups are batched so that data
+    is transferred in quanta of at least 1/20th of a second's worth (or the
+    burst size if smaller) rather than a few bytes at a time.
+    """
+    # Number of seconds over which the achieved rate is measured.
+    window = 5.0
+
+    def __init__(self, rate, burst=None):
+        self._rate = float(rate)
+        self._burst = burst or rate
+        self._tokens = float(self._burst)
+        self._updated = time.time()
+        # Callbacks waiting for tokens to become available.
+        self._waiting = []
+        self._timer = OneShotTimer(self._wakeup)
+        self._created = time.time()
+        self._total = 0
+        self._throttled = 0
+        # (time, nbytes) of recent transfers, for the achieved rate.
+        self._history = collections.deque()
+
+
+    @property
+    def rate(self):
+        """
+        The sustained rate in bytes per second.
+        """
+        return self._rate
+
+
+    @rate.setter
+    def rate(self, value):
+        self._refill()
+        self._rate = float(value)
+        if self._timer.active:
+            self._schedule()
+
+
+    @property
+    def burst(self):
+        """
+        The size of the token bucket in bytes.
+        """
+        return self._burst
+
+
+    @burst.setter
+    def burst(self, value):
+        self._burst = value
+        self._tokens = min(self._tokens, value)
+
+
+    @property
+    def stats(self):
+        """
+        A dict of metrics for the limiter:
+
+            * *bytes*: total number of bytes transferred
+            * *rate*: the achieved rate in bytes per second over the last
+              :attr:`window` seconds
+            * *average*: the average rate since the limiter was created
+            * *throttled*: number of times a channel had to wait for tokens
+            * *waiting*: number of channels currently waiting for tokens
+        """
+        now = time.time()
+        self._expire(now)
+        elapsed = min(self.window, now - self._created) or 1
+        return {
+            'bytes': self._total,
+            'rate': sum(n for t, n in self._history) / elapsed,
+            'average': self._total / ((now - self._created) or 1),
+            'throttled': self._throttled,
+            'waiting': len(self._waiting)
+        }
+
+
+    @property
+    def _quantum(self):
+        return min(self._burst, max(4096, self._rate / 20))
+
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+    def _expire(self, now):
+        while self._history and self._history[0][0] < now - self.window:
+            self._history.popleft()
+
+
+    def allowance(self, nbytes):
+        """
+        Returns the number of bytes (up to nbytes) that may be transferred
+        now, or 0 if the caller should wait (see :meth:`wait`).
+
+        To avoid transferring data a few bytes at a time as tokens trickle
+        in, 0 is returned unless either all nbytes or a reasonably sized
+        quantum may be transferred.
+        """
+        if self._waiting:
+            # Others are already waiting; don't let new arrivals jump ahead.
+            return 0
+        self._refill()
+        if self._tokens < min(nbytes, self._quantum):
+            return 0
+        return min(nbytes, int(self._tokens))
+
+
+    def consume(self, nbytes):
+        """
+        Accounts for nbytes having been transferred.
+        """
+        if nbytes <= 0:
+            return
+        now = time.time()
+        self._tokens -= nbytes
+        self._total += nbytes
+        self._history.append((now, nbytes))
+        self._expire(now)
+
+
+    def wait(self, callback):
+        """
+        Invokes the given callback (once) when tokens become available.
+        """
+        self._throttled += 1
+        if callback not in self._waiting:
+            self._waiting.append(callback)
+        if not self._timer.active:
+            self._schedule()
+
+
+    def _schedule(self):
+        self._refill()
+        needed = self._quantum - self._tokens
+        # Timers have millisecond resolution; round up so we don't wake
+        # just short of the quantum.
+        self._timer.start(max(0, needed / self._rate) + 0.001)
+
+
+    def _wakeup(self):
+        waiting, self._waiting = self._waiting, []
+        for callback in waiting:
+            callback()
+
+
+
 class IOChannel(Object):
     """
     Base class for read-only, write-only or read-write stream-based
@@ -136,6 +374,10 @@ class IOChannel(Object):
     :type mode: bitmask of kaa.IO_READ and/or kaa.IO_WRITE
     :param chunk_size: maximum number of bytes to be read in from the channel
                        at a time; defaults to 1M.
+    :param read_budget: if set, the channel is drained on each read
+                        notification until no more data is available or
+                        this many bytes have been read; see
+                        :attr:`~kaa.IOChannel.read_budget`.
     :param delimiter: string used to split data for use with readline; defaults
                       to '\\\\n'.
 
@@ -157,7 +399,9 @@ class IOChannel(Object):
     It is not possible to use both approaches with readline.  (That is, it
     is not permitted to connect a callback to the *readline* signal and
     subsequently invoke the :meth:`~kaa.IOChannel.readline` method when the
-    callback is still connected.)
+    callback is still connected.)  The same applies to the batched
+    :attr:`~kaa.IOChannel.signals.readlines` signal and
+    :meth:`~kaa.IOChannel.readlines` method.
 
     However, :meth:`~kaa.IOChannel.read` and :meth:`~kaa.IOChannel.readline`
     will work predictably when a callback is connected to the *read* signal.
@@ -187,6 +431,9 @@ class IOChannel(Object):
             '''
             Emitted for each chunk of data read from the channel.
 
+            When :attr:`~kaa.IOChannel.read_budget` is set, all data read
+            during one read notification is emitted as a single chunk.
+
             .. describe:: def callback(chunk, ...)
 
                :param chunk: data read from the channel
@@ -216,6 +463,26 @@ class IOChannel(Object):
             Refer to :meth:`~kaa.IOChannel.readline` for more details.
             ''',
 
+        'readlines':
+            '''
+            Emitted with all complete lines read from the channel in one chunk.
+
+            .. describe:: def callback(lines, ...)
+
+               :param lines: lines read from the channel
+               :type lines: list of str
+
+            This is a batched alternative to the *readline* signal, which
+            avoids the overhead of a signal emission per line for channels
+            with high line rates.  Lines are split using the same
+            :attr:`~kaa.IOChannel.delimiter` and are subject to the same
+            :attr:`~kaa.IOChannel.queue_size` limit as with *readline*.
+
+            It is not allowed to have a callback connected to the *readlines*
+            signal and simultaneously use the :meth:`~kaa.IOChannel.readline`
+            or :meth:`~kaa.IOChannel.readlines` methods.
+            ''',
+
         'closed':
             '''
             Emitted when the channel is closed.
@@ -228,7 +495,8 @@ class IOChannel(Object):
             '''
     }
 
-    def __init__(self, channel=None, mode=IO_READ|IO_WRITE, chunk_size=1024*1024, delimiter='\n'):
+    def __init__(self, channel=None, mode=IO_READ|IO_WRITE, chunk_size=1024*1024, delimiter='\n',
+                 read_budget=None):
         super(IOChannel, self).__init__()
         self.delimiter = delimiter
         self._write_queue = []
@@ -238,10 +506,25 @@ class IOChannel(Object):
         # Number of bytes each queue (read and write) are limited to.
         self._queue_size = 1024*1024
         self._chunk_size = chunk_size
+        # Per-wakeup byte budget for drain-mode reads (None disables drain mode)
+        self._read_budget = read_budget
+        # Current read size when adaptive chunk sizing is enabled, and the
+        # number of consecutive small reads seen at that size.
+        self._adaptive_chunk_size = False
+        self._read_size = chunk_size
+        self._read_size_small = 0
+        # Size requested by the last read, before it was tuned.
+        self._read_requested = 0
         self._queue_close = False
         self._close_inprogress = None
         self._close_on_eof = True
         self._eof = False
+        # RateLimiter objects for reads and writes, or None if unlimited.
+        self._read_limiter = None
+        self._write_limiter = None
+        self._stats = _new_stats(self)
+        # Time the write queue last went from empty to non-empty.
+        self._write_queued_time = None
 
         # Internal signals for read() and readline()  (these are different from
         # the same-named public signals as they get emitted even when data is
@@ -251,8 +534,10 @@ class IOChannel(Object):
         cb = WeakCallable(self._update_read_monitor)
         self._read_signal = Signal(cb)
         self._readline_signal = Signal(cb)
+        self._readlines_signal = Signal(cb)
         self.signals['read'].changed_cb = cb
         self.signals['readline'].changed_cb = cb
+        self.signals['readlines'].changed_cb = cb
 
         # These variables hold the IOMonitors for monitoring; we only allocate
         # a monitor when the channel is connected to avoid a ref cycle so that
@@ -355,6 +640,120 @@ class IOChannel(Object):
     @chunk_size.setter
     def chunk_size(self, size):
         self._chunk_size = size
+        self._read_size = size
+        self._read_size_small = 0
+
+
+    @property
+    def read_budget(self):
+        """
+        Maximum number of bytes to read from the channel per read notification,
+        or None (default) to read only a single chunk.
+
+        By default, at most :attr:`chunk_size` bytes are read each time the
+        mainloop reports the channel as readable, and control then returns to
+        the mainloop.  When a budget is set, the channel is instead drained
+        until no more data is immediately available (or this many bytes have
+        been read), and all data is delivered in one combined *read* signal
+        emission (or read() result).  This roughly halves the number of
+        system calls for bulk transfers over fast links.
+
+        Because a single emission may then be larger than :attr:`chunk_size`,
+        the read queue may grow up to :attr:`queue_size` plus the budget.
+        """
+        return self._read_budget
+
+
+    @read_budget.setter
+    def read_budget(self, value):
+        self._read_budget = value
+
+
+    @property
+    def adaptive_chunk_size(self):
+        """
+        If True, the number of bytes requested from the channel per read is
+        tuned based on observed read sizes, staying within :attr:`chunk_size`.
+
+        Requesting far more than the channel typically delivers wastes time
+        allocating (and then shrinking) large buffers, while requesting too
+        little causes needless system calls.  When enabled, the read size
+        doubles whenever a read fills it completely, and is halved after
+        several consecutive reads that use less than a quarter of it.  The
+        default is False.
+        """
+        return self._adaptive_chunk_size
+
+
+    @adaptive_chunk_size.setter
+    def adaptive_chunk_size(self, value):
+        self._adaptive_chunk_size = value
+        self._read_size = self._chunk_size
+        self._read_size_small = 0
+
+
+    @property
+    def stats(self):
+        """
+        A dict of I/O counters for the channel:
+
+            * *bytes_read*, *bytes_written*: number of bytes transferred
+            * *reads*, *writes*: number of read and write system calls
+            * *eagain_read*, *eagain_write*: number of reads and writes that
+              failed because the channel was not ready (EAGAIN)
+            * *read_queue_hwm*, *write_queue_hwm*: the largest number of bytes
+              held in the read and write queues
+            * *drain_time*: seconds it took for the write queue to become empty
+              after data was last written to an empty queue; a large value
+              means the remote end or the kernel is not keeping up.
+            * *drain_time_max*: the largest *drain_time* seen
+
+        Many small reads relative to *bytes_read* suggest a larger
+        :attr:`chunk_size` (or a :attr:`read_budget`) would help, while a
+        *write_queue_hwm* approaching :attr:`queue_size` means writers should
+        wait on their write() InProgress more often.  Counters accumulate
+        over the life of the object, and the values are also aggregated by
+        :func:`kaa.io_stats`.
+        """
+        return self._stats.copy()
+
+
+    @property
+    def read_limiter(self):
+        """
+        A :class:`~kaa.RateLimiter` that limits the rate at which data is
+        read from the channel, or None (default) for no limit.
+
+        While the limit is reached, the channel stops reading, so that data
+        stays in the kernel (which, for sockets, causes the remote end to
+        slow down through normal TCP flow control).
+        """
+        return self._read_limiter
+
+
+    @read_limiter.setter
+    def read_limiter(self, limiter):
+        self._read_limiter = limiter
+        self._update_read_monitor()
+
+
+    @property
+    def write_limiter(self):
+        """
+        A :class:`~kaa.RateLimiter` that limits the rate at which queued data
+        is written to the channel, or None (default) for no limit.
+
+        Writes are still queued immediately, but the InProgress returned by
+        :meth:`write` finishes only as the data is written at the permitted
+        rate.
+        """
+        return self._write_limiter
+
+
+    @write_limiter.setter
+    def write_limiter(self, limiter):
+        self._write_limiter = limiter
+        self._resume_write()
 
 
     @property
@@ -463,7 +862,8 @@ class IOChannel(Object):
         """
         Returns True if an outside caller is interested in readlines (not reads).
         """
-        return not len(self._readline_signal) == len(self.signals['readline']) == 0
+        return not len(self._readline_signal) == len(self.signals['readline']) == \
+                   len(self._readlines_signal) == len(self.signals['readlines']) == 0
 
 
     def _update_read_monitor(self, signal=None, action=None):
@@ -637,6 +1037,38 @@ class IOChannel(Object):
             return s[:idx]
 
 
+    def _split_lines(self, buf):
+        """
+        Splits buf into a list of lines (each including its delimiter) and
+        returns (lines, remainder), where remainder is the trailing data
+        following the last delimiter.
+        """
+        lines, last, idx = [], 0, self._find_delim(buf)
+        while idx is not None:
+            lines.append(buf[last:idx])
+            last = idx
+            idx = self._find_delim(buf, last)
+        return lines, buf[last:]
+
+
+    def _pop_lines_from_read_queue(self):
+        """
+        Pops all complete lines (plus delimiters) from the read queue.  If the
+        channel is closed or EOF, any trailing data without a delimiter is
+        returned as the last line.  Returns an empty list if no line is
+        available.
+        """
+        with self._read_queue_lock:
+            lines, remainder = self._split_lines(self._read_queue.getvalue())
+            self._clear_read_queue()
+            if remainder:
+                if not self._channel or self._eof:
+                    lines.append(remainder)
+                else:
+                    self._read_queue.write(remainder)
+            return lines
+
+
     def _abort_read_inprogress(self, exc, signal, ip):
         signal.disconnect(ip)
         self._update_read_monitor()
@@ -731,6 +1163,40 @@ class IOChannel(Object):
         return self._async_read(self._readline_signal)
 
 
+    def readlines(self):
+        """
+        Reads all complete lines currently available from the channel.
+
+        :returns: An :class:`~kaa.InProgress` object, finished with a list of
+                  lines (each including the delimiter).  If the InProgress is
+                  finished with the empty list, it means that no data was
+                  collected and the channel was closed.
+
+        This behaves like :meth:`readline`, except that all lines available
+        from the read queue or the next chunk read from the channel are
+        returned at once, which is considerably cheaper than calling
+        :meth:`readline` for each line when line rates are high.  The same
+        :attr:`delimiter` and :attr:`queue_size` rules apply: if the read queue
+        exceeds the queue limit before a delimiter is found, its contents are
+        returned as a (delimiter-less) line.
+
+        This method may not be called when a callback is connected to the
+        IOChannel's readline or readlines signals, or while a :meth:`readline`
+        call is in progress.
+        """
+        if self._is_readline_connected() and len(self._readlines_signal) == 0:
+            raise RuntimeError('Callback currently connected to readline signal')
+
+        lines = self._pop_lines_from_read_queue()
+        if lines:
+            return InProgress().finish(lines)
+        elif self._channel and not self.readable:
+            # Finish with the empty list rather than None (as _async_read
+            # would) for consistency with the non-empty case.
+            return InProgress().finish([])
+        return self._async_read(self._readlines_signal)
+
+
     def _read(self, size):
         """
         Low-level call to read from channel.  Can be overridden by subclasses.
@@ -743,6 +1209,76 @@ class IOChannel(Object):
             return os.read(self.fileno, size)
 
 
+    def _tune_read_size(self, nbytes):
+        """
+        Adjusts the adaptive read size based on a read that returned nbytes.
+        """
+        size = self._read_size
+        if nbytes >= size:
+            self._read_size = min(size * 2, self._chunk_size)
+            self._read_size_small = 0
+        elif nbytes < size // 4:
+            self._read_size_small += 1
+            if self._read_size_small >= 8:
+                self._read_size = max(size // 2, min(4096, self._chunk_size))
+                self._read_size_small = 0
+        else:
+            self._read_size_small = 0
+
+
+    def _read_chunk(self, limit=None):
+        """
+        Reads one chunk from the channel (honoring adaptive chunk sizing), of
+        at most limit bytes if given.
+        """
+        size = self._read_size if self._adaptive_chunk_size else self._chunk_size
+        size = self._read_requested = min(size, limit or size)
+        try:
+            data = self._read(size)
+        except (IOError, socket.error), e:
+            if e.args and e.args[0] == errno.EAGAIN:
+                self._stats['eagain_read'] += 1
+            raise
+        self._stats['reads'] += 1
+        if data:
+            self._stats['bytes_read'] += len(data)
+        if self._adaptive_chunk_size:
+            self._tune_read_size(len(data) if data else 0)
+        return data
+
+
+    def _read_drain(self, limit=None):
+        """
+        Reads chunks from the channel until no more data is available or the
+        read budget (or limit, if smaller) is exhausted, and returns them
+        joined together.
+
+        Errors and EOF encountered after some data was read are not raised
+        here; the channel remains readable so they are seen on the next
+        notification, after the data already read has been delivered.
+        """
+        chunks = []
+        remaining = min(self._read_budget, limit or self._read_budget)
+        while remaining > 0:
+            try:
+                chunk = self._read_chunk(remaining)
+            except (IOError, socket.error):
+                if chunks:
+                    break
+                raise
+            if not chunk:
+                if chunks:
+                    break
+                return chunk
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            if len(chunk) < self._read_requested:
+                # Short read: the kernel buffer is empty, so save a syscall
+                # that would only return EAGAIN.
+                break
+        return chunks[0] if len(chunks) == 1 else bl('').join(chunks)
+
+
     def _handle_read(self):
         """
         IOMonitor callback when there is data to be read from the channel.
@@ -751,9 +1287,21 @@ class IOChannel(Object):
         reading data (by connecting to the read or readline signals, or calling
         read() or readline()).  This is necessary for flow control.
         """
+        limit = None
+        if self._read_limiter:
+            limit = self._read_limiter.allowance(self._read_budget or self._chunk_size)
+            if not limit:
+                # Over the rate limit.  Stop monitoring the channel until
+                # the limiter has tokens for us again.
+                self._rmon.unregister()
+                self._read_limiter.wait(WeakCallable(self._update_read_monitor))
+                return
+
         exc = None
         try:
-            data = self._read(self._chunk_size)
+            data = self._read_drain(limit) if self._read_budget else self._read_chunk(limit)
+            if limit and data:
+                self._read_limiter.consume(len(data))
         except (IOError, socket.error) as e:
             exc = sys.exc_info()
             if len(e.args) != 2:
@@ -817,27 +1365,52 @@ class IOChannel(Object):
                     else:
                         # EOF with a readline() waiting.  Send it the empty string.
                         self._readline_signal.emit('')
-            elif len(self.signals['readline']):
-                # Handle global readline signal by looping through read queue and
-                # emit all lines individually.
-                queue = self._read_queue.getvalue() + data
-                self._clear_read_queue()
-
-                lines, last, idx = [], 0, self._find_delim(queue)
-                while True:
-                    # If idx is None, it will slice to the end.
-                    lines.append(queue[last:idx])
-                    if idx is None:
-                        break
-                    last = idx
-                    idx = self._find_delim(queue, last)
+            elif len(self._readlines_signal):
+                # Handle a readlines() call.  Same queue limit semantics as
+                # readline() above, except that any lines in the new chunk
+                # are returned too.
+                lines = []
+                if self.read_queue_used + len(data) > self._queue_size:
+                    overflow = self._read_queue.getvalue()
+                    self._clear_read_queue()
+                    if overflow:
+                        lines.append(overflow)
+                self._read_queue.write(data)
+                lines.extend(self._pop_lines_from_read_queue())
 
-                if self._find_delim(lines[-1]) is None:
-                    # Queue did not end with delimiter, so push the remainder back.
-                    self._read_queue.write(lines.pop())
+                if lines:
+                    self._readlines_signal.emit(lines)
+                elif self._eof:
+                    if exc:
+                        self._readlines_signal.throw(*exc)
+                    else:
+                        self._readlines_signal.emit([])
+            elif self._is_readline_connected():
+                # Handle global readline and readlines signals by splitting the
+                # read queue into lines, and emitting them individually (for
+                # readline) and together (for readlines).  Subclasses may have
+                # internal connections to these signals, so only queue partial
+                # lines if someone is really listening, otherwise data already
+                # passed to read() would be returned again by the next read().
+                lines, remainder = self._split_lines(self._read_queue.getvalue() + data)
+                self._clear_read_queue()
+                if remainder:
+                    if len(remainder) > self._queue_size:
+                        # Partial line exceeds the queue limit, so emit what
+                        # we have, as readline() would.
+                        lines.append(remainder)
+                    else:
+                        # Queue did not end with delimiter, so push the remainder back.
+                        self._read_queue.write(remainder)
 
                 for line in lines:
                     self.signals['readline'].emit(line)
+                if lines:
+                    self.signals['readlines'].emit(lines)
+
+            used = self._read_queue.tell()
+            if used > self._stats['read_queue_hwm']:
+                self._stats['read_queue_hwm'] = used
 
 
         # Update read monitor if necessary.  If there are no longer any
@@ -896,7 +1469,8 @@ class IOChannel(Object):
             raise IOError(9, 'Cannot write to a read-only channel')
         elif not self.writable:
             raise IOError(9, 'Channel is not writable')
-        elif self.write_queue_used + len(data) > self._queue_size:
+        used = self.write_queue_used + len(data)
+        if used > self._queue_size:
             raise ValueError('Data would exceed write queue limit')
         elif not isinstance(data, BYTES_TYPE):
             raise ValueError('data must be bytes, not unicode')
@@ -904,7 +1478,11 @@ class IOChannel(Object):
         ip = InProgress()
         if data:
             ip.signals['abort'].connect(self._abort_write_inprogress, data, ip)
+            if not self._write_queue:
+                self._write_queued_time = time.time()
             self._write_queue.append((data, ip))
+            if used > self._stats['write_queue_hwm']:
+                self._stats['write_queue_hwm'] = used
             if self._channel and self._wmon and not self._wmon.active:
                 self._wmon.register(self.fileno, IO_WRITE)
         else:
@@ -914,6 +1492,15 @@ class IOChannel(Object):
         return ip
 
 
+    def _resume_write(self):
+        """
+        Registers the write IOMonitor if there is data queued, such as after
+        a rate limiter permits writing again.
+        """
+        if self._write_queue and self._channel and self._wmon and not self._wmon.active:
+            self._wmon.register(self.fileno, IO_WRITE)
+
+
     def _handle_write(self):
         """
         IOMonitor callback when the channel is writable.  This callback is not
@@ -927,7 +1514,24 @@ class IOChannel(Object):
         try:
             while self._write_queue:
                 data, inprogress = self._write_queue.pop(0)
-                sent = self._write(data)
+                chunk = data
+                if self._write_limiter:
+                    allowed = self._write_limiter.allowance(len(data))
+                    if not allowed:
+                        # Over the rate limit.  Stop monitoring the channel
+                        # until the limiter has tokens for us again.
+                        self._write_queue.insert(0, (data, inprogress))
+                        self._wmon.unregister()
+                        self._write_limiter.wait(WeakCallable(self._resume_write))
+                        return
+                    if allowed < len(data):
+                        chunk = data[:allowed]
+                sent = self._write(chunk)
+                self._stats['writes'] += 1
+                if sent > 0:
+                    self._stats['bytes_written'] += sent
+                    if self._write_limiter:
+                        self._write_limiter.consume(sent)
                 log.debug2('IOChannel write data: channel=%s fd=%s len=%d (of %d)',
                            self._channel, self.fileno, sent, len(data))
                 if sent != len(data):
@@ -941,6 +1545,12 @@ class IOChannel(Object):
                     inprogress.finish(sent)
 
             if not self._write_queue:
+                if self._write_queued_time:
+                    drain_time = time.time() - self._write_queued_time
+                    self._stats['drain_time'] = drain_time
+                    if drain_time > self._stats['drain_time_max']:
+                        self._stats['drain_time_max'] = drain_time
+                    self._write_queued_time = None
                 if self._queue_close:
                     return self.close(immediate=True)
                 self._wmon.unregister()
@@ -949,6 +1559,7 @@ class IOChannel(Object):
             tp, exc, tb = sys.exc_info()
             if tp in (OSError, IOError, socket.error):
                 if e.args[0] == 11:
+                    self._stats['eagain_write'] += 1
                     # Resource temporarily unavailable -- we are trying to write
                     # data to a socket which is not ready.  To prevent a busy loop
                     # (mainloop will keep calling us back) we sleep a tiny
@@ -1037,6 +1648,8 @@ class IOChannel(Object):
                 line = self._pop_line_from_read_queue()
                 if line:
                     self._readline_signal.emit(line)
+            if len(self._readlines_signal):
+                self._readlines_signal.emit(self._pop_lines_from_read_queue())
 
         # Throw IOError to any pending InProgress in the write queue
         for data, inprogress in self._write_queue:
@@ -1104,6 +1717,12 @@ class IOChannel(Object):
         self._read_queue = channel._read_queue
         self._queue_size = channel._queue_size
         self._chunk_size = channel._chunk_size
+        self._read_budget = channel._read_budget
+        self._adaptive_chunk_size = channel._adaptive_chunk_size
+        self._read_size = channel._read_size
+        self._read_size_small = channel._read_size_small
+        self._read_limiter = channel._read_limiter
+        self._write_limiter = channel._write_limiter
         self._queue_close = channel._queue_close
 
         # Generate new queues on the channel object whose fd we are stealing, since
@@ -1119,7 +1738,9 @@ class IOChannel(Object):
 
         clone(channel._read_signal, self._read_signal)
         clone(channel._readline_signal, self._readline_signal)
+        clone(channel._readlines_signal, self._readlines_signal)
         clone(channel.signals['read'], self.signals['read'])
         clone(channel.signals['readline'], self.signals['readline'])
+        clone(channel.signals['readlines'], self.signals['readlines'])
 
         return self
@@ -141,6 +141,10 @@ def init(module=None, reset=False, **options):
         if module and module.startswith('twisted'):
             from twisted.internet.process import reapAllProcesses
             signals['sigchld'].connect(reapAllProcesses)
+            # Twisted reaps its own children, so we mustn't reap them
+            # with waitpid(-1).
+            from .process import supervisor
+            supervisor.reap_all = False
 
     CoreThreading.init(signals, reset)
     signals['init'].emit()
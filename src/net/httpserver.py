@@ -141,11 +141,21 @@ class HTTPServer(SocketServer.ThreadingTCPServer):
     def __init__(self, server_address, RequestHandlerClass=ThreadedHTTPRequestHandler,
                  bind_and_activate=True):
         """
-        Create the HTTPServer
+        Create the HTTPServer.  server_address may also be a bound and
+        listening socket object, e.g. one shared between worker processes by
+        kaa.net.PreforkServer.
         """
         self._get_handler = []
         self._static = {}
         self._directories = []
+        if isinstance(server_address, socket.socket):
+            sock = server_address
+            self.address_family = sock.family
+            SocketServer.ThreadingTCPServer.__init__(
+                self, sock.getsockname(), RequestHandlerClass, False)
+            self.socket.close()
+            self.socket = sock
+            return
         SocketServer.ThreadingTCPServer.__init__(
             self, server_address, RequestHandlerClass, bind_and_activate)
 
@@ -0,0 +1,488 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# pool.py - Keyed pool of reusable connections
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'ConnectionPool' ]
+
+# python imports
+import sys
+import time
+import logging
+
+# kaa imports
+import kaa
+from kaa.utils import property
+
+# get logging object
+log = logging.getLogger('kaa.base.net.pool')
+
+
+class _Bucket(object):
+    """
+    Per-key state of a ConnectionPool.
+    """
+    def __init__(self, args, kwargs):
+        # Arguments passed to the factory for new connections.
+        self.args = args
+        self.kwargs = kwargs
+        # List of (idle since, connection), most recently checked in last.
+        self.idle = []
+        # Number of connections checked out or being created.
+        self.busy = 0
+        # InProgress objects waiting for a connection to become available.
+        self.waiting = []
+
+
+class ConnectionPool(kaa.Object):
+    """
+    Keeps connections to remote ends open for reuse, avoiding the cost of
+    connecting (and any handshaking, such as TLS or authentication) for each
+    request.
+
+    :param factory: callable invoked with the arguments passed to
+                    :meth:`checkout` to create a new connection; may return
+                    the connection or an :class:`~kaa.InProgress` finished
+                    with it.  If None, :meth:`_create` is used, which connects
+                    a :class:`~kaa.Socket`.
+    :param check: callable invoked with an idle connection before it is
+                  reused, returning True (or an InProgress finished with True)
+                  if the connection is still usable.  It is also invoked when
+                  connections are checked in and while they are idle, where
+                  an InProgress is not waited for.  If None, :meth:`_check`
+                  is used.
+    :param max_size: maximum number of connections per key, both idle and
+                     checked out; checkouts beyond this wait until a
+                     connection is checked in.  None means unlimited.
+    :type max_size: int
+    :param min_idle: number of idle connections per key kept open even if
+                     they exceed *idle_timeout*.
+    :type min_idle: int
+    :param max_idle: maximum number of idle connections per key; connections
+                     checked in beyond this are closed.
+    :type max_idle: int
+    :param idle_timeout: seconds after which an idle connection is closed.
+    :type idle_timeout: float
+
+    Connections are keyed by the arguments passed to :meth:`checkout`, so
+    the key should include anything that distinguishes one connection from
+    another, such as TLS or authentication parameters.  Connections of
+    different keys are never shared.
+
+    Connections are closed by calling their ``close()`` method.
+    """
+    __kaasignals__ = {
+        'created':
+            '''
+            Emitted when a new connection is created for the pool.
+
+            .. describe:: def callback(conn, ...)
+
+               :param conn: the newly created connection
+            ''',
+
+        'evicted':
+            '''
+            Emitted when a connection is closed by the pool.
+
+            .. describe:: def callback(conn, ...)
+
+               :param conn: the connection that was closed
+            '''
+    }
+
+    def __init__(self, factory=None, check=None, max_size=None, min_idle=0, max_idle=4, idle_timeout=60):
+        super(ConnectionPool, self).__init__()
+        self._factory = factory or self._create
+        self._check_cb = check or self._check
+        self._max_size = max_size
+        self._min_idle = min_idle
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        # Maps key -> _Bucket
+        self._buckets = {}
+        # Maps id(conn) -> (key, conn) for connections currently checked out.
+        self._checked_out = {}
+        self._evict_timer = kaa.WeakTimer(self._evict_idle)
+        self._stats = {'created': 0, 'reused': 0, 'evicted': 0, 'failed': 0,
+                       'unhealthy': 0, 'waited': 0}
+
+
+    @property
+    def max_size(self):
+        """
+        Maximum number of connections per key, or None if unlimited.
+        """
+        return self._max_size
+
+
+    @max_size.setter
+    def max_size(self, value):
+        self._max_size = value
+
+
+    @property
+    def min_idle(self):
+        """
+        Number of idle connections per key exempt from idle eviction.
+        """
+        return self._min_idle
+
+
+    @min_idle.setter
+    def min_idle(self, value):
+        self._min_idle = value
+
+
+    @property
+    def max_idle(self):
+        """
+        Maximum number of idle connections kept per key.
+        """
+        return self._max_idle
+
+
+    @max_idle.setter
+    def max_idle(self, value):
+        self._max_idle = value
+
+
+    @property
+    def idle_timeout(self):
+        """
+        Number of seconds after which an idle connection is closed.
+        """
+        return self._idle_timeout
+
+
+    @idle_timeout.setter
+    def idle_timeout(self, value):
+        self._idle_timeout = value
+        if self._evict_timer.active:
+            self._evict_timer.start(self._evict_interval)
+
+
+    @property
+    def stats(self):
+        """
+        A dict of metrics for the pool:
+
+            * *created*: number of connections created
+            * *reused*: number of checkouts served by an idle connection
+            * *evicted*: number of connections closed by the pool
+            * *failed*: number of connection attempts that failed
+            * *unhealthy*: number of idle connections that failed the health check
+            * *waited*: number of checkouts that had to wait because
+              *max_size* was reached
+            * *idle*: number of idle connections currently in the pool
+            * *checked_out*: number of connections currently checked out
+        """
+        stats = self._stats.copy()
+        stats['idle'] = sum(len(b.idle) for b in self._buckets.values())
+        stats['checked_out'] = len(self._checked_out)
+        return stats
+
+
+    @property
+    def _evict_interval(self):
+        return max(1, self._idle_timeout / 2.0)
+
+
+    def _make_key(self, args, kwargs):
+        return args + tuple(sorted(kwargs.items()))
+
+
+    @kaa.coroutine()
+    def _create(self, address, buffer_size=None):
+        """
+        Default factory: connects a :class:`~kaa.Socket` to the given
+        address.
+        """
+        sock = kaa.Socket(buffer_size)
+        yield sock.connect(address)
+        yield sock
+
+
+    def _check(self, conn):
+        """
+        Default health check: a connection is usable if it is still
+        connected (or alive, for objects without a *connected* attribute).
+        """
+        if hasattr(conn, 'connected'):
+            return conn.connected
+        return getattr(conn, 'alive', True)
+
+
+    def _healthy(self, conn):
+        """
+        Runs the health check on a connection being checked in or kept idle,
+        where it can't be waited for: a check returning an unfinished
+        InProgress is only waited for when the connection is reused.
+        """
+        try:
+            healthy = self._check_cb(conn)
+            if isinstance(healthy, kaa.InProgress):
+                return not healthy.finished or healthy.result
+            return healthy
+        except Exception:
+            return False
+
+
+    def _close(self, conn):
+        """
+        Closes a connection removed from the pool.
+        """
+        self._stats['evicted'] += 1
+        try:
+            conn.close()
+        except Exception:
+            log.exception('Error closing pooled connection %s', conn)
+        self.signals['evicted'].emit(conn)
+
+
+    @kaa.coroutine()
+    def checkout(self, *args, **kwargs):
+        """
+        Gets a connection from the pool, creating a new one if no idle
+        connection is available.
+
+        The arguments are passed to the factory when a new connection needs
+        to be created, and together form the key for the connection.
+
+        :returns: an :class:`~kaa.InProgress` finished with the connection.
+                  The connection must be returned to the pool with
+                  :meth:`checkin` (or removed with :meth:`discard`) once the
+                  caller is done with it.
+        """
+        key = self._make_key(args, kwargs)
+        bucket = self._buckets.get(key)
+        if not bucket:
+            bucket = self._buckets[key] = _Bucket(args, kwargs)
+
+        while bucket.idle:
+            conn = bucket.idle.pop()[1]
+            bucket.busy += 1
+            try:
+                healthy = self._check_cb(conn)
+                if isinstance(healthy, kaa.InProgress):
+                    healthy = yield healthy
+            except Exception:
+                healthy = False
+            if healthy:
+                self._stats['reused'] += 1
+                self._checked_out[id(conn)] = key, conn
+                yield conn
+            bucket.busy -= 1
+            self._stats['unhealthy'] += 1
+            self._close(conn)
+
+        if self._max_size is not None and bucket.busy >= self._max_size:
+            # Pool is exhausted for this key; wait for a connection to be
+            # checked in (or discarded, in which case we are given None).
+            self._stats['waited'] += 1
+            ip = kaa.InProgress()
+            bucket.waiting.append(ip)
+            conn = yield ip
+            if conn is not None:
+                self._checked_out[id(conn)] = key, conn
+                yield conn
+
+        bucket.busy += 1
+        try:
+            conn = self._factory(*args, **kwargs)
+            if isinstance(conn, kaa.InProgress):
+                conn = yield conn
+        except Exception:
+            bucket.busy -= 1
+            self._stats['failed'] += 1
+            self._wakeup(key, bucket)
+            raise
+        self._stats['created'] += 1
+        self._checked_out[id(conn)] = key, conn
+        self.signals['created'].emit(conn)
+        yield conn
+
+
+    def _wakeup(self, key, bucket):
+        """
+        Invoked when a slot in the given bucket frees up, letting the oldest
+        waiting checkout create a new connection.
+        """
+        while bucket.waiting:
+            ip = bucket.waiting.pop(0)
+            if not ip.finished:
+                # Slot is free, so let the waiter create a connection.
+                ip.finish(None)
+                return
+
+
+    def checkin(self, conn):
+        """
+        Returns a connection obtained from :meth:`checkout` to the pool.
+
+        If the connection is no longer usable, or the pool already holds
+        *max_idle* idle connections for its key, it is closed.
+        """
+        key, conn = self._checked_out.pop(id(conn), (None, conn))
+        bucket = self._buckets.get(key)
+        if not bucket:
+            # Not ours (or the pool was closed in the meantime).
+            return self._close(conn)
+
+        if not self._healthy(conn):
+            bucket.busy -= 1
+            self._wakeup(key, bucket)
+            return self._close(conn)
+
+        self._make_idle(key, bucket, conn)
+
+
+    def _make_idle(self, key, bucket, conn):
+        """
+        Hands a busy connection to a waiting checkout, or else moves it to
+        the idle list of its bucket, closing it instead if the bucket is full
+        (or no longer part of the pool).
+        """
+        while bucket.waiting:
+            ip = bucket.waiting.pop(0)
+            if not ip.finished:
+                # Hand the connection directly to a waiting checkout.
+                self._stats['reused'] += 1
+                ip.finish(conn)
+                return
+
+        bucket.busy -= 1
+        if self._buckets.get(key) is not bucket or len(bucket.idle) >= self._max_idle:
+            return self._close(conn)
+        bucket.idle.append((time.time(), conn))
+        if not self._evict_timer.active and self._idle_timeout:
+            self._evict_timer.start(self._evict_interval)
+
+
+    def discard(self, conn):
+        """
+        Closes a connection obtained from :meth:`checkout` rather than
+        returning it to the pool, such as after a protocol error.
+        """
+        key, conn = self._checked_out.pop(id(conn), (None, conn))
+        bucket = self._buckets.get(key)
+        if bucket:
+            bucket.busy -= 1
+            self._wakeup(key, bucket)
+        self._close(conn)
+
+
+    def _evict_idle(self):
+        """
+        Timer callback to close connections that have been idle longer than
+        idle_timeout, keeping at least min_idle per key.
+        """
+        expired = time.time() - self._idle_timeout
+        for key, bucket in self._buckets.items():
+            # Connections are appended at checkin, so the oldest are first.
+            while len(bucket.idle) > self._min_idle and bucket.idle[0][0] <= expired:
+                self._close(bucket.idle.pop(0)[1])
+            # Also drop idle connections closed by the remote end.
+            for entry in bucket.idle[:]:
+                if not self._healthy(entry[1]):
+                    bucket.idle.remove(entry)
+                    self._close(entry[1])
+            if len(bucket.idle) < self._min_idle and not bucket.busy:
+                # Replenish connections lost to the remote end.
+                self.prefill(*bucket.args, **bucket.kwargs).exception.connect(self._prefill_failed, bucket)
+            elif not bucket.idle and not bucket.busy and not bucket.waiting:
+                del self._buckets[key]
+        if not self._buckets:
+            return False
+
+
+    def _prefill_failed(self, tp, exc, tb, bucket):
+        # Only log the address, as the rest of the key may hold credentials.
+        address = bucket.args[0] if bucket.args else bucket.kwargs.get('address')
+        log.warning('Unable to replenish idle connections for %s: %s', address, exc)
+        return False
+
+
+    @kaa.coroutine()
+    def prefill(self, *args, **kwargs):
+        """
+        Opens connections for the given key until *min_idle* idle connections
+        are available.
+
+        :returns: an :class:`~kaa.InProgress` finished when the connections
+                  have been created.
+        """
+        key = self._make_key(args, kwargs)
+        bucket = self._buckets.get(key)
+        if not bucket:
+            bucket = self._buckets[key] = _Bucket(args, kwargs)
+        missing = self._min_idle - len(bucket.idle)
+        if missing <= 0:
+            return
+
+        # Call the factory directly: checkout() would just hand out the idle
+        # connections we already have.  New connections count as busy until
+        # they are created.
+        bucket.busy += missing
+        pending = []
+        error = None
+        for i in range(missing):
+            try:
+                pending.append(self._factory(*args, **kwargs))
+            except Exception:
+                bucket.busy -= 1
+                self._stats['failed'] += 1
+                self._wakeup(key, bucket)
+                error = error or sys.exc_info()
+
+        for conn in pending:
+            try:
+                if isinstance(conn, kaa.InProgress):
+                    conn = yield conn
+            except Exception:
+                bucket.busy -= 1
+                self._stats['failed'] += 1
+                self._wakeup(key, bucket)
+                error = error or sys.exc_info()
+                continue
+            self._stats['created'] += 1
+            self.signals['created'].emit(conn)
+            self._make_idle(key, bucket, conn)
+
+        if error:
+            raise error[0], error[1], error[2]
+
+
+    def close(self):
+        """
+        Closes all idle connections.  Connections currently checked out are
+        closed when they are checked in.
+        """
+        self._evict_timer.stop()
+        for bucket in self._buckets.values():
+            for t, conn in bucket.idle:
+                self._close(conn)
+            for ip in bucket.waiting:
+                if not ip.finished:
+                    ip.throw(IOError, IOError('connection pool closed'), None)
+        self._buckets = {}
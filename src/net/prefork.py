@@ -0,0 +1,543 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# prefork.py - Pre-forking multi-process server
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'PreforkServer' ]
+
+# python imports
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import logging
+
+# kaa imports
+import kaa
+from kaa.utils import property
+from kaa.process import supervisor
+from kaa import nf_wrapper as notifier
+
+# get logging object
+log = logging.getLogger('kaa.base.net.prefork')
+
+
+def _cpu_count():
+    try:
+        return os.sysconf('SC_NPROCESSORS_ONLN')
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+
+class _Worker(object):
+    """
+    A forked worker process, monitored by the process supervisor.
+
+    The supervisor only requires _check_dead(), _reaped(), stop() and the
+    InProgress protocol, so workers are registered alongside kaa.Process
+    objects and are reaped the same way.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.pid = None
+        self.started = time.time()
+        self.stopping = False
+        self.exitcode = None
+        self._dead = kaa.InProgress()
+        self._kill_timer = kaa.OneShotTimer(self._kill)
+
+
+    def __inprogress__(self):
+        return self._dead
+
+
+    def __repr__(self):
+        return '<PreforkServer worker pid=%s>' % self.pid
+
+
+    def _check_dead(self, expected=None):
+        if not self.pid or self._dead.finished:
+            return
+        try:
+            pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        except OSError, e:
+            if e.errno != errno.ECHILD:
+                raise
+            # Already reaped by someone else; exit status is lost.
+            pid, status, rusage = self.pid, None, None
+        if pid:
+            if rusage:
+                # Reaped by us rather than the supervisor, so count it in
+                # the supervisor's usage() ourselves.
+                supervisor._account(rusage)
+            self._reaped(status, rusage)
+
+
+    def _reaped(self, status, rusage=None):
+        """
+        Invoked with the worker's exit status once it has been reaped, by us
+        or by the supervisor.
+        """
+        if self._dead.finished:
+            return
+        supervisor.unregister(self)
+        self._kill_timer.stop()
+        if status is None:
+            self.exitcode = None
+        elif os.WIFSIGNALED(status):
+            # Follow subprocess convention: negative signal number.
+            self.exitcode = -os.WTERMSIG(status)
+        else:
+            self.exitcode = os.WEXITSTATUS(status)
+        self._dead.finish(self.exitcode)
+        self.server._worker_exited(self)
+
+
+    def _signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+    def _kill(self):
+        log.warning('%s did not exit within %s seconds, killing', self, self.server.grace)
+        self._signal(signal.SIGKILL)
+
+
+    def stop(self):
+        """
+        Asks the worker to exit, killing it if it is still running after the
+        server's grace period.
+        """
+        if self.pid and not self._dead.finished and not self.stopping:
+            self.stopping = True
+            self._signal(signal.SIGTERM)
+            self._kill_timer.start(self.server.grace)
+        return self._dead
+
+
+
+class PreforkServer(kaa.Object):
+    """
+    Distributes incoming connections on a listening socket over several
+    worker processes, each running its own main loop.
+
+    :param workers: number of worker processes; if None, the number of
+                    online CPUs is used.
+    :type workers: int
+    :param reuse_port: if False, the listening socket is bound once by the
+                       parent and inherited by the workers.  If True, each
+                       worker binds its own socket with ``SO_REUSEPORT`` and
+                       the kernel balances connections between them (Linux
+                       3.9 or later).
+    :type reuse_port: bool
+    :param grace: number of seconds a worker is given to exit after being
+                  asked to stop before it is killed.
+    :type grace: float
+
+    Typical usage, with a :class:`kaa.rpc.Server` in each worker::
+
+        def init(sock):
+            server = kaa.rpc.Server(sock, 'secret')
+            server.register(MyObject())
+
+        prefork = kaa.net.PreforkServer(workers=4)
+        prefork.listen(('', 8000))
+        prefork.start(init)
+        kaa.main.run()
+
+    *init* is invoked in each worker with a bound, listening low-level socket, which can be
+    passed to :meth:`kaa.Socket.listen`, :class:`kaa.rpc.Server` or
+    :class:`kaa.net.httpserver.HTTPServer`.  After *init* returns, the worker
+    runs a main loop of its own until it is stopped, and then exits: it never
+    returns to the code that forked it, and nothing pending in the parent's
+    main loop (timers, coroutines, I/O callbacks) is carried over to it.
+    Everything the worker does must therefore be set up by *init*.
+
+    Workers are monitored by the same supervisor that reaps
+    :class:`kaa.Process` children, and are restarted when they die
+    unexpectedly.  They are stopped when the parent's main loop terminates.
+
+    When a worker is asked to stop, the :attr:`~kaa.net.PreforkServer.signals.stopping`
+    signal is emitted in the worker.  If no callbacks are connected, the
+    worker exits immediately.  Otherwise it exits once a callback calls
+    :meth:`stop`, or the grace period expires.
+
+    .. note::
+
+       Only the generic main loop can be emptied after forking.  With other
+       main loop integrations (gtk, twisted), callbacks registered by the
+       parent remain registered in workers.
+    """
+    __kaasignals__ = {
+        'worker-started':
+            '''
+            Emitted in the parent when a worker process is started.
+
+            .. describe:: def callback(pid, ...)
+
+               :param pid: the process id of the new worker
+            ''',
+
+        'worker-exited':
+            '''
+            Emitted in the parent when a worker process exits.
+
+            .. describe:: def callback(pid, exitcode, ...)
+
+               :param pid: the process id of the worker
+               :param exitcode: the worker's exit code, or the negated signal
+                                number if it was killed by a signal.
+            ''',
+
+        'stopping':
+            '''
+            Emitted in a worker when it has been asked to exit, for example
+            during a :meth:`~kaa.net.PreforkServer.reload`.
+
+            .. describe:: def callback(...)
+
+            Callbacks should stop accepting new connections, finish
+            outstanding work, and then call :meth:`~kaa.net.PreforkServer.stop`.
+            '''
+    }
+
+    # Workers dying within this many seconds after being started are
+    # restarted after a delay, to avoid a fork loop when workers crash on
+    # startup.
+    restart_delay = 1.0
+
+    def __init__(self, workers=None, reuse_port=False, grace=10):
+        super(PreforkServer, self).__init__()
+        self._num_workers = workers or _cpu_count()
+        self._reuse_port = reuse_port
+        self._grace = grace
+        self._addr = None
+        self._backlog = None
+        self._listener = None
+        self._init = None
+        self._workers = []
+        self._is_worker = False
+        self._running = False
+        self._stopped = kaa.InProgress()
+        self._restart_timer = kaa.WeakOneShotTimer(self._spawn_missing)
+
+
+    @property
+    def is_worker(self):
+        """
+        True if the current process is a worker.
+        """
+        return self._is_worker
+
+
+    @property
+    def workers(self):
+        """
+        List of process ids of running workers (in the parent).
+        """
+        return [w.pid for w in self._workers if not w.stopping]
+
+
+    @property
+    def num_workers(self):
+        """
+        Number of worker processes to keep running.
+
+        Changing this value while the server is running starts or stops
+        workers accordingly.
+        """
+        return self._num_workers
+
+
+    @num_workers.setter
+    def num_workers(self, value):
+        self._num_workers = value
+        if self._running and not self._is_worker:
+            for w in [w for w in self._workers if not w.stopping][value:]:
+                w.stop()
+            self._spawn_missing()
+
+
+    @property
+    def grace(self):
+        """
+        Number of seconds a worker is given to exit after being asked to
+        stop before it is killed.
+        """
+        return self._grace
+
+
+    @grace.setter
+    def grace(self, value):
+        self._grace = value
+
+
+    @property
+    def listener(self):
+        """
+        The bound, listening low-level socket object.  In the parent, this is
+        None when *reuse_port* is True.
+        """
+        return self._listener
+
+
+    def listen(self, addr, backlog=None):
+        """
+        Sets the address workers accept connections on.
+
+        :param addr: address to bind to, in any form accepted by
+                     :meth:`kaa.Socket.listen`
+        :param backlog: the maximum length of the queue of pending
+                        connections; if None, ``socket.SOMAXCONN`` is used.
+
+        Unless *reuse_port* was given, the socket is bound immediately, so
+        that errors (such as the address being in use) are raised here in
+        the parent.
+        """
+        self._addr = addr
+        self._backlog = backlog or socket.SOMAXCONN
+        if not self._reuse_port:
+            self._listener = self._bind()
+
+
+    def _bind(self):
+        sock = kaa.Socket.create_connection(source_address=self._addr, overwrite=True,
+                                            reuse_port=self._reuse_port)
+        sock.listen(self._backlog)
+        # All workers wake up for a new connection but only one gets it, so
+        # accept() must not block for the others.
+        sock.setblocking(False)
+        return sock
+
+
+    def start(self, init, *args, **kwargs):
+        """
+        Forks the worker processes.
+
+        :param init: callable invoked in each worker with the listening
+                     socket, followed by *args* and *kwargs*.
+
+        Returns once all workers have been forked.  Workers don't return;
+        they exit when their main loop is stopped.
+        """
+        if self._addr is None:
+            raise ValueError('listen() must be called before start()')
+        if self._running:
+            raise RuntimeError('PreforkServer already started')
+        self._init = init, args, kwargs
+        self._running = True
+        self._stopped = kaa.InProgress()
+        kaa.main.signals['shutdown'].connect_weak(self.stop)
+        self._spawn_missing()
+
+
+    def _spawn_missing(self):
+        """
+        Forks workers until num_workers are running.
+        """
+        while not self._is_worker and self._running and len(self.workers) < self._num_workers:
+            self._spawn()
+
+
+    def _spawn(self):
+        worker = _Worker(self)
+        # Register before forking to avoid missing the SIGCHLD of a worker
+        # that dies immediately.
+        supervisor.register(worker)
+        try:
+            pid = os.fork()
+        except OSError:
+            supervisor.unregister(worker)
+            raise
+
+        if pid:
+            worker.pid = pid
+            # Now that the pid is known.
+            supervisor.register(worker)
+            self._workers.append(worker)
+            log.info('Started worker %d', pid)
+            self.signals['worker-started'].emit(pid)
+            # In case it has already exited.
+            worker._check_dead()
+            return
+        self._become_worker()
+
+
+    def _become_worker(self):
+        """
+        Invoked in the child after forking.  Runs the worker and exits, never
+        returning to the parent's call stack.
+        """
+        try:
+            self._setup_worker()
+            init, args, kwargs = self._init
+            init(self._listener, *args, **kwargs)
+        except Exception:
+            log.exception('Worker initialization failed')
+            self._exit(1)
+        try:
+            if kaa.main.is_running():
+                # Forked from a callback of the parent's main loop, so run
+                # ours nested within it.
+                kaa.main.loop(True)
+            else:
+                kaa.main.run()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except Exception:
+            log.exception('Worker main loop failed')
+            self._exit(1)
+        if kaa.main.is_running():
+            # As run() does when the loop terminates.
+            kaa.main._set_running(False)
+            kaa.main._stop()
+        self._exit(0)
+
+
+    def _setup_worker(self):
+        """
+        Forgets the parent's state in the child: its children, and everything
+        registered with its main loop.
+        """
+        self._is_worker = True
+        # The parent's children are not our children.  This must happen
+        # before reinitializing the main loop below, which reaps children.
+        for process in supervisor.processes.keys():
+            supervisor.unregister(process)
+            if isinstance(process, _Worker):
+                process._kill_timer.stop()
+                process.pid = None
+        self._workers = []
+        self._restart_timer.stop()
+        if not notifier.reset():
+            log.warning('Main loop cannot be reset; worker inherits callbacks of the parent')
+        # As with kaa.utils.fork(), replace the thread notifier pipe,
+        # otherwise we'll be listening to our parent's.  Also done if the
+        # main loop isn't initialized yet, so that running it doesn't
+        # replace our SIGTERM handler below.
+        kaa.main.init(reset=True)
+        kaa.main.signals['shutdown'].disconnect(self.stop)
+        # Disconnect signals only meaningful in the parent.
+        self.signals['worker-started'].disconnect_all()
+        self.signals['worker-exited'].disconnect_all()
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        if self._reuse_port:
+            self._listener = self._bind()
+
+
+    def _exit(self, code):
+        # Skip the parent's atexit handlers and the rest of its call stack.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+    def _handle_sigterm(self, signum, frame):
+        # Invoked asynchronously, so defer the real work to the main loop.
+        kaa.OneShotTimer(self._worker_stopping).start(0)
+
+
+    def _worker_stopping(self):
+        if not len(self.signals['stopping']):
+            return self.stop()
+        log.info('Worker %d stopping', os.getpid())
+        kaa.OneShotTimer(self.stop).start(self._grace)
+        self.signals['stopping'].emit()
+
+
+    def _worker_exited(self, worker):
+        """
+        Invoked by _Worker when the worker process has been reaped.
+        """
+        if worker in self._workers:
+            self._workers.remove(worker)
+        log.info('Worker %d exited with code %s', worker.pid, worker.exitcode)
+        self.signals['worker-exited'].emit(worker.pid, worker.exitcode)
+        if not self._workers and not self._running:
+            self._stopped.finish(None)
+        if worker.stopping or not self._running:
+            return
+        if time.time() - worker.started < self.restart_delay:
+            # Died quickly after being started; wait before restarting.
+            if not self._restart_timer.active:
+                self._restart_timer.start(self.restart_delay)
+        else:
+            self._spawn_missing()
+
+
+    def reload(self):
+        """
+        Gracefully replaces all workers.
+
+        A new set of workers is started first, and then the old workers are
+        asked to stop, so that connections continue to be accepted throughout.
+        This is typically invoked from a SIGHUP handler in the parent after
+        the application's configuration has changed.  Workers are forked from
+        the parent, so modules the parent has already imported are not
+        reloaded.
+
+        :returns: an :class:`~kaa.InProgress` finished when all old workers
+                  have exited.
+        """
+        if self._is_worker or not self._running:
+            raise RuntimeError('reload() must be called in the parent of a running server')
+        old = self._workers[:]
+        for w in old:
+            # Hide the old workers from _spawn_missing()
+            w.stopping = True
+        self._spawn_missing()
+        for w in old:
+            w.stopping = False
+            w.stop()
+        return kaa.InProgressAll(*[kaa.inprogress(w) for w in old])
+
+
+    def stop(self):
+        """
+        Stops the server.
+
+        In the parent, all workers are asked to exit and are not restarted.
+        In a worker, the worker's main loop is stopped.
+
+        :returns: in the parent, an :class:`~kaa.InProgress` finished when all
+                  workers have exited.
+        """
+        if self._is_worker:
+            kaa.main.stop()
+            return
+        self._running = False
+        self._restart_timer.stop()
+        if self._listener:
+            self._listener.close()
+            self._listener = None
+        for w in self._workers:
+            w.stop()
+        if not self._workers and not self._stopped.finished:
+            self._stopped.finish(None)
+        return self._stopped
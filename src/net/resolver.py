@@ -0,0 +1,285 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# resolver.py - Asynchronous caching hostname resolver
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Resolver', 'resolve', 'get_resolver' ]
+
+# python imports
+import sys
+import time
+import socket
+import logging
+import threading
+
+# kaa imports
+import kaa
+from kaa.utils import property
+
+# get logging object
+log = logging.getLogger('kaa.base.net.resolver')
+
+
+class Resolver(object):
+    """
+    Resolves hostnames asynchronously, caching the results.
+
+    :param size: maximum number of concurrent lookups (threads)
+    :type size: int
+    :param ttl: number of seconds successful lookups are cached
+    :type ttl: float
+    :param negative_ttl: number of seconds failed lookups are cached
+    :type negative_ttl: float
+    :param max_entries: maximum number of cached lookups
+    :type max_entries: int
+
+    The system resolver (``getaddrinfo()``) is blocking, so lookups are
+    performed in a dedicated :class:`~kaa.ThreadPool`.  Because the pool is
+    bounded and separate from the default thread pool, a slow or unresponsive
+    name server cannot starve other threaded tasks.
+
+    Concurrent requests for the same lookup are coalesced, so that only one
+    thread performs it.  Because ``getaddrinfo()`` does not expose the TTL of
+    DNS records, results are cached for a fixed period.
+    """
+    def __init__(self, size=4, ttl=60, negative_ttl=5, max_entries=1024):
+        self._pool = kaa.ThreadPool(size)
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # Maps lookup key -> (expiry time, result, exc_info)
+        self._cache = {}
+        # Maps lookup key -> list of InProgress objects waiting on the lookup
+        self._inflight = {}
+        # Service name -> port number.  Services don't change, so are cached
+        # indefinitely.
+        self._services = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+
+    @property
+    def ttl(self):
+        """
+        Number of seconds successful lookups are cached.
+        """
+        return self._ttl
+
+
+    @ttl.setter
+    def ttl(self, value):
+        self._ttl = value
+
+
+    @property
+    def negative_ttl(self):
+        """
+        Number of seconds failed lookups are cached.
+        """
+        return self._negative_ttl
+
+
+    @negative_ttl.setter
+    def negative_ttl(self, value):
+        self._negative_ttl = value
+
+
+    @property
+    def stats(self):
+        """
+        A dict of counters: *hits* (lookups served from the cache), *misses*
+        (lookups performed) and *coalesced* (lookups that joined one already
+        in progress).
+        """
+        return self._stats.copy()
+
+
+    def flush(self):
+        """
+        Removes all cached lookups.
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+    def _lookup(self, key):
+        """
+        Returns the cache entry for the given key if it exists and hasn't
+        expired, or None otherwise.  Must be called with the lock held.
+        """
+        entry = self._cache.get(key)
+        if entry:
+            if entry[0] > time.time():
+                self._stats['hits'] += 1
+                return entry
+            del self._cache[key]
+
+
+    def _store(self, key, result, exc_info):
+        """
+        Adds a lookup result to the cache, evicting expired entries (or those
+        soonest to expire) if the cache is full.  Must be called with the lock
+        held.
+        """
+        ttl = self._negative_ttl if exc_info else self._ttl
+        if not ttl:
+            return
+        if len(self._cache) >= self._max_entries:
+            now = time.time()
+            for k in [k for k, entry in self._cache.items() if entry[0] <= now]:
+                del self._cache[k]
+            if len(self._cache) >= self._max_entries:
+                del self._cache[min(self._cache, key=lambda k: self._cache[k][0])]
+        if exc_info:
+            # Don't hold a reference to the traceback.
+            exc_info = exc_info[:2] + (None,)
+        self._cache[key] = (time.time() + ttl, result, exc_info)
+
+
+    def _finished(self, key, result, exc_info=None):
+        """
+        Invoked in the main thread when a lookup performed in the pool
+        completes.
+        """
+        with self._lock:
+            self._store(key, result, exc_info)
+            waiting = self._inflight.pop(key, [])
+        for ip in waiting:
+            if ip.finished:
+                # Aborted by the caller.
+                continue
+            if exc_info:
+                ip.throw(*exc_info)
+            else:
+                ip.finish(list(result))
+
+
+    def resolve(self, host, port=0, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM, proto=0, flags=0):
+        """
+        Resolves the given host and port.
+
+        The arguments are the same as for ``socket.getaddrinfo()``.
+
+        :returns: an :class:`~kaa.InProgress` finished with the list of
+                  5-tuples returned by ``socket.getaddrinfo()``, or which
+                  raises ``socket.gaierror`` if the lookup fails.
+        """
+        key = (host, port, family, type, proto, flags)
+        with self._lock:
+            entry = self._lookup(key)
+            if not entry:
+                ip = kaa.InProgress()
+                if key in self._inflight:
+                    self._stats['coalesced'] += 1
+                    self._inflight[key].append(ip)
+                    return ip
+                self._stats['misses'] += 1
+                self._inflight[key] = [ip]
+
+        if entry:
+            expiry, result, exc_info = entry
+            ip = kaa.InProgress()
+            if exc_info:
+                ip.throw(*exc_info)
+                return ip
+            return ip.finish(list(result))
+
+        # Connect to the job before it's enqueued, so that it can't finish
+        # before we're connected.
+        job = kaa.ThreadInProgress(socket.getaddrinfo, *key)
+        job.connect_both(lambda result: self._finished(key, result),
+                         lambda *exc_info: self._finished(key, None, exc_info))
+        self._pool.enqueue(job)
+        return ip
+
+
+    def getaddrinfo(self, host, port=0, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM, proto=0, flags=0):
+        """
+        Synchronous variant of :meth:`resolve`, for use in threads.
+
+        Returns a cached result if available, otherwise the lookup is
+        performed in the calling thread and the result is cached.
+        """
+        key = (host, port, family, type, proto, flags)
+        with self._lock:
+            entry = self._lookup(key)
+        if entry:
+            expiry, result, exc_info = entry
+            if exc_info:
+                raise exc_info[0], exc_info[1]
+            return list(result)
+
+        with self._lock:
+            self._stats['misses'] += 1
+        try:
+            result = socket.getaddrinfo(*key)
+        except socket.gaierror:
+            with self._lock:
+                self._store(key, None, sys.exc_info())
+            raise
+        with self._lock:
+            self._store(key, result, None)
+        return list(result)
+
+
+    def getservbyname(self, name, proto=None):
+        """
+        Returns the port number for the given service name (e.g. ``http``),
+        caching the result.
+
+        :raises: socket.error if the service is unknown
+        """
+        try:
+            return self._services[name, proto]
+        except KeyError:
+            port = socket.getservbyname(name, proto) if proto else socket.getservbyname(name)
+            self._services[name, proto] = port
+            return port
+
+
+
+# The default resolver.  Its thread pool doesn't start any threads until
+# the first lookup.
+_resolver = Resolver()
+
+def get_resolver():
+    """
+    Returns the default :class:`~kaa.net.resolver.Resolver`, which is used by
+    :meth:`kaa.Socket.connect`.
+    """
+    return _resolver
+
+
+def resolve(host, port=0, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM, proto=0, flags=0):
+    """
+    Resolves the given host and port asynchronously, using the default
+    caching resolver.
+
+    The arguments are the same as for ``socket.getaddrinfo()``.
+
+    :returns: an :class:`~kaa.InProgress` finished with the list of 5-tuples
+              returned by ``socket.getaddrinfo()``.
+
+    See :class:`~kaa.net.resolver.Resolver` for more details.
+    """
+    return get_resolver().resolve(host, port, family, type, proto, flags)
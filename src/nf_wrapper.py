@@ -117,6 +117,20 @@ def shutdown():
     # prefered way to shut down the system
     sys.exit(0)
 
+nf_reset = None
+def reset():
+    """
+    Removes everything registered with the notifier.  Returns False if the
+    notifier doesn't support it.
+    """
+    if loaded is None:
+        # Nothing registered yet.
+        return True
+    if not nf_reset:
+        return False
+    nf_reset()
+    return True
+
 # socket wrapper
 
 nf_conditions = []
@@ -139,6 +153,7 @@ def init( module = None, force_internal=False, **options ):
     global nf_socket_remove
     global nf_socket_add
     global nf_conditions
+    global nf_reset
     global shutdown
     global loaded
 
@@ -196,6 +211,7 @@ def init( module = None, force_internal=False, **options ):
     dispatcher_remove = notifier.dispatcher_remove
 
     step = notifier.step
+    nf_reset = getattr(notifier, 'reset', None)
 
     if module == 'twisted':
         # special stop handling for twisted
@@ -22,16 +22,23 @@
 # -----------------------------------------------------------------------------
 from __future__ import absolute_import
 
-__all__ = [ 'Process', 'supervisor' ]
+__all__ = [ 'Process', 'Pipeline', 'ProcessQueue', 'supervisor' ]
 
 import subprocess
 import os
 import sys
+import time
 import shlex
+import shutil
+import collections
 import errno
 import logging
 import weakref
 import signal
+import fcntl
+import stat
+import select
+import ctypes
 try:
     from io import BytesIO
 except ImportError:
@@ -42,21 +49,105 @@ from .errors import InProgressAborted
 from .utils import property
 from .callable import Callable, WeakCallable, CallableError
 from .core import Object, Signals
-from .timer import delay, timed, Timer, OneShotTimer, POLICY_ONCE
+from .timer import delay, timed, Timer, WeakTimer, OneShotTimer, POLICY_ONCE
 from .thread import MainThreadCallable, threaded, MAINTHREAD
 from .async import InProgress, InProgressAny, InProgressAll, inprogress, FINISH_RESULT
 from .coroutine import coroutine, POLICY_SINGLETON
-from .io import IOChannel, IO_WRITE, IO_READ
+from .io import IOChannel, IOMonitor, IO_WRITE, IO_READ
+from .sockets import _libc
 from . import main
 
 # get logging object
 log = logging.getLogger('kaa.base.process')
 
+def _pidfd_open(pid):
+    """
+    Returns a pidfd for the given child, which becomes readable when it
+    exits, or None if pidfds are not supported (Linux 5.3+).
+    """
+    if _pidfd_open.supported is False:
+        return None
+    try:
+        if hasattr(os, 'pidfd_open'):
+            # Python 3.9+
+            fd = os.pidfd_open(pid)
+        else:
+            if not sys.platform.startswith('linux') or not _libc():
+                _pidfd_open.supported = False
+                return None
+            # pidfd_open is syscall 434 on all architectures.
+            fd = _libc().syscall(434, pid, 0)
+            if fd < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+    except OSError, e:
+        if e.errno in (errno.ENOSYS, errno.EPERM):
+            _pidfd_open.supported = False
+        elif e.errno != errno.ESRCH:
+            raise
+        return None
+    _pidfd_open.supported = True
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    return fd
+
+_pidfd_open.supported = None
+
+
+# ru_maxrss is in kilobytes on Linux and bytes on OS X.
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+def _sample(pid):
+    """
+    Returns a dict describing the current resource usage of the given process
+    read from /proc, or None if it is not available (no such process, or no
+    /proc).
+    """
+    try:
+        # The command name may contain spaces and parens, so split after it.
+        fields = open('/proc/%d/stat' % pid).read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+        return None
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    usage = {
+        'utime': int(fields[11]) / ticks,
+        'stime': int(fields[12]) / ticks,
+        'threads': int(fields[17]),
+        'vms': int(fields[20]),
+        'rss': int(fields[21]) * os.sysconf('SC_PAGE_SIZE'),
+        'read_bytes': None,
+        'write_bytes': None
+    }
+    try:
+        for line in open('/proc/%d/io' % pid):
+            key, value = line.split(':')
+            if key in ('read_bytes', 'write_bytes'):
+                usage[key] = int(value)
+    except (IOError, ValueError):
+        # Not available without CONFIG_TASK_IO_ACCOUNTING, or not permitted.
+        pass
+    return usage
+
+
+
 class _Supervisor(object):
     """
     Supervisor class with which all Process objects register themselves.  The
-    Supervisor handles SIGCHLD signals and invokes Process._check_dead of all
-    alive Process objects.
+    Supervisor reaps children and notifies the Process objects they belong to
+    via Process._check_dead (or _reaped, if the Supervisor reaped the child).
+
+    Where supported (Linux 5.3+), each child is monitored with a pidfd, which
+    the main loop reports as readable once the child exits, so only the
+    Process whose child exited is checked.  Otherwise, upon SIGCHLD, children
+    are reaped with waitpid(-1) and dispatched by pid.  Both are independent
+    of the number of supervised processes.
+
+    Reaping with waitpid(-1) also collects children not started through
+    kaa, so their exit status is lost to whoever started them.  Set
+    :attr:`reap_all` to False if that's a problem (which is done
+    automatically for Twisted), to check each process individually instead.
+
+    Children are reaped with wait4(), and the resource usage of each is
+    added to the totals returned by :meth:`usage`.
 
     References to all alive Process objects are held by the Supervisor,
     therefore Process objects live as long as the child process remains
@@ -64,6 +155,19 @@ class _Supervisor(object):
     """
     def __init__(self):
         self.processes = {}
+        # Maps pid -> process object, and process object -> pid for
+        # processes whose pid is known.
+        self._pids = {}
+        self._indexed = {}
+        # Maps process object -> (pidfd, IOMonitor)
+        self._pidfds = {}
+        # Exit statuses of children reaped with waitpid(-1) that aren't (yet)
+        # known to us, by pid.
+        self._unclaimed = {}
+        self.reap_all = True
+        # Resource usage totals of reaped children.
+        self._totals = {'exited': 0, 'utime': 0.0, 'stime': 0.0, 'maxrss': 0,
+                        'inblock': 0, 'oublock': 0}
 
         # Stop all processes as last part of mainloop termination.
         main.signals['shutdown-after'].connect(self.stopall)
@@ -91,20 +195,133 @@ class _Supervisor(object):
 
         This must be called _before_ the child process is created to avoid a
         race condition with short lived children where SIGCHLD is received
-        before the process is registered.
+        before the process is registered.  It should be called again once the
+        child is created, so that it can be monitored by pid.
+        """
+        if process not in self.processes:
+            log.debug('Supervisor now monitoring %s', process)
+            self.processes[process] = True
+        pid = getattr(process, 'pid', None)
+        if pid and self._indexed.get(process) != pid:
+            self._index(process, pid)
+
+
+    def _index(self, process, pid):
+        self._unwatch(process)
+        self._pids[pid] = process
+        self._indexed[process] = pid
+        if pid in self._unclaimed:
+            # Already reaped by waitpid(-1) before we knew the pid.
+            return self._dispatch(process, *self._unclaimed.pop(pid))
+        fd = _pidfd_open(pid)
+        if fd is not None:
+            monitor = IOMonitor(self._pidfd_ready, process)
+            monitor.register(fd, IO_READ)
+            self._pidfds[process] = fd, monitor
+
+
+    def _unwatch(self, process):
         """
-        log.debug('Supervisor now monitoring %s', process)
-        self.processes[process] = True
+        Removes the given process from the pid index and closes its pidfd.
+        """
+        pid = self._indexed.pop(process, None)
+        if pid and self._pids.get(pid) is process:
+            del self._pids[pid]
+        fd, monitor = self._pidfds.pop(process, (None, None))
+        if monitor:
+            monitor.unregister()
+            os.close(fd)
 
 
     def unregister(self, process):
         log.debug('Supervisor no longer monitoring %s', process)
+        self._unwatch(process)
         try:
             del self.processes[process]
         except KeyError:
             pass
 
 
+    def _pidfd_ready(self, process):
+        """
+        Invoked by the main loop when the pidfd of the given process's child
+        becomes readable, which means it has exited.
+        """
+        process._check_dead()
+        if process in self._pidfds:
+            # Not reaped after all (e.g. process object is stopping), which
+            # it will be upon the next SIGCHLD.  Stop monitoring the pidfd so
+            # the main loop doesn't spin.
+            fd, monitor = self._pidfds.pop(process)
+            monitor.unregister()
+            os.close(fd)
+
+
+    def _dispatch(self, process, status, rusage):
+        """
+        Hands the exit status of a child reaped by us to its process object.
+        """
+        self._unwatch(process)
+        self._account(rusage)
+        if hasattr(process, '_reaped'):
+            process._reaped(status, rusage)
+        else:
+            process._check_dead()
+
+
+    def _account(self, rusage):
+        """
+        Adds the resource usage of a reaped child to the totals.
+        """
+        totals = self._totals
+        totals['exited'] += 1
+        totals['utime'] += rusage.ru_utime
+        totals['stime'] += rusage.ru_stime
+        totals['maxrss'] = max(totals['maxrss'], rusage.ru_maxrss * _MAXRSS_UNIT)
+        totals['inblock'] += rusage.ru_inblock
+        totals['oublock'] += rusage.ru_oublock
+
+
+    def usage(self, sample=True):
+        """
+        Returns the aggregate resource usage of all children.
+
+        :param sample: if True, running children are sampled from /proc
+                       (where available) for the *running_\** values.
+        :type sample: bool
+        :returns: a dict with the following keys:
+
+            * *exited*: number of children reaped
+            * *utime*, *stime*: total user and system CPU seconds of
+              reaped children
+            * *maxrss*: the largest peak resident size of any reaped child,
+              in bytes
+            * *inblock*, *oublock*: total block input and output operations
+              of reaped children
+            * *running*: number of supervised children still running
+            * *running_utime*, *running_stime*: user and system CPU seconds
+              used so far by running children
+            * *running_rss*: total resident size of running children in
+              bytes
+
+        Children reaped by someone else (e.g. by Process objects when using
+        Twisted) are included only if their Process object reaped them.
+        """
+        usage = self._totals.copy()
+        usage.update(running=0, running_utime=0.0, running_stime=0.0, running_rss=0)
+        for process in self.processes.keys():
+            pid = getattr(process, 'pid', None)
+            if not pid:
+                continue
+            usage['running'] += 1
+            current = _sample(pid) if sample else None
+            if current:
+                usage['running_utime'] += current['utime']
+                usage['running_stime'] += current['stime']
+                usage['running_rss'] += current['rss']
+        return usage
+
+
     def _sigchld_handler(self):
         """
         Handler for SIGCHLD, via the ``sigchld`` signal which is emitted by
@@ -157,7 +374,43 @@ class _Supervisor(object):
 
 
     def reapall(self):
-        for process in self.processes.keys():
+        """
+        Reaps all terminated children.
+        """
+        if not self.reap_all:
+            for process in self.processes.keys():
+                process._check_dead()
+            return
+
+        if _pidfd_open.supported:
+            # Indexed processes are notified through their pidfd, so only
+            # check those we couldn't open one for.
+            for process in self.processes.keys():
+                if process not in self._pidfds:
+                    process._check_dead()
+            return
+
+        while self.processes:
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                # ECHILD: no children left.
+                break
+            if not pid:
+                break
+            process = self._pids.get(pid)
+            if process:
+                self._dispatch(process, status, rusage)
+            else:
+                log.debug('Supervisor reaped unknown child %d', pid)
+                if len(self._unclaimed) >= 1024:
+                    self._unclaimed.clear()
+                self._unclaimed[pid] = status, rusage
+
+        # Processes whose child was created but whose pid isn't indexed yet.
+        for process in [p for p in self.processes.keys() if p not in self._indexed]:
             process._check_dead()
 
 
@@ -222,7 +475,505 @@ class IOSubChannel(IOChannel):
     def _is_readline_connected(self):
         n = 2 if self._logger else 1
         return len(self._readline_signal) > 0 or len(self.signals['readline']) > n or \
-               (self._process() and len(self._process().signals['readline']) > 0)
+               len(self._readlines_signal) > 0 or len(self.signals['readlines']) > 1 or \
+               (self._process() and (len(self._process().signals['readline']) > 0 or
+                                     len(self._process().signals['readlines']) > 0))
+
+
+
+class _PipeLink(object):
+    """
+    A pipe connecting the stdout of one Process to the stdin of another.  Each
+    Process takes its end of the pipe when it starts, so the two may be started
+    in any order.
+    """
+    def __init__(self):
+        # [read end, write end]; an end is None once taken.
+        self.fds = [None, None]
+
+
+    def take(self, end):
+        """
+        Returns the given end (0 for read, 1 for write) of the pipe, creating
+        a new pipe if that end was already taken by a previous start.  The
+        caller owns the returned fd.
+        """
+        if self.fds[end] is None:
+            self.close()
+            self.fds = list(os.pipe())
+            for fd in self.fds:
+                # Only the child the end is passed to may inherit it, or
+                # the reader won't see EOF when the writer exits.
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        fd, self.fds[end] = self.fds[end], None
+        return fd
+
+
+    def close(self):
+        for fd in self.fds:
+            if fd is not None:
+                os.close(fd)
+        self.fds = [None, None]
+
+
+    def __del__(self):
+        self.close()
+
+
+
+def _splice(fd_in, fd_out, size):
+    """
+    Moves up to size bytes from the pipe fd_in to fd_out within the kernel,
+    without blocking.  Returns the number of bytes moved, or None if splice()
+    is not supported.
+    """
+    if hasattr(os, 'splice'):
+        # Python 3.10+
+        return os.splice(fd_in, fd_out, size, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+    try:
+        func = _splice.func
+    except AttributeError:
+        func = _splice.func = getattr(_libc(), 'splice', None) if sys.platform.startswith('linux') else None
+        if func:
+            func.restype = ctypes.c_ssize_t
+            func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                             ctypes.c_size_t, ctypes.c_uint]
+    if not func:
+        return None
+    # SPLICE_F_MOVE | SPLICE_F_NONBLOCK
+    n = func(fd_in, None, fd_out, None, size, 1 | 2)
+    if n < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return n
+
+
+
+# Flags for posix_spawnattr_setflags(), the same on Linux and BSDs.
+_POSIX_SPAWN_SETSIGDEF = 0x04
+_POSIX_SPAWN_SETSIGMASK = 0x08
+
+def _spawn_lib():
+    """
+    Returns libc if it provides posix_spawn(), which is then set up for use
+    by _posix_spawn(), or None otherwise.
+    """
+    try:
+        return _spawn_lib.lib
+    except AttributeError:
+        pass
+    lib = _spawn_lib.lib = _libc()
+    if not lib or not hasattr(lib, 'posix_spawnp'):
+        _spawn_lib.lib = None
+    return _spawn_lib.lib
+
+
+def _posix_spawn_available():
+    """
+    True if children can be spawned with posix_spawn() while still closing
+    all inherited file descriptors, as close_fds does for the fork path.
+    """
+    if hasattr(os, 'posix_spawnp'):
+        # Python 3.8+, where file descriptors are non-inheritable by default.
+        return True
+    lib = _spawn_lib()
+    return bool(lib and hasattr(lib, 'posix_spawn_file_actions_addclosefrom_np'))
+
+
+def _posix_spawn(argv, fds, sigdef):
+    """
+    Spawns a child with posix_spawnp(), which on modern systems uses vfork()
+    or clone(CLONE_VFORK), so that no Python code runs in the child and the
+    parent's memory need not be copied.
+
+    :param argv: list of arguments; the program is looked up in PATH
+    :param fds: the file descriptors for the child's stdin, stdout and stderr
+    :param sigdef: signals to reset to their default disposition
+    :returns: the child's pid
+    """
+    if hasattr(os, 'posix_spawnp'):
+        actions = [(os.POSIX_SPAWN_DUP2, fd, i) for i, fd in enumerate(fds)]
+        return os.posix_spawnp(argv[0], argv, dict(os.environ), file_actions=actions,
+                               setsigdef=sigdef, setsigmask=())
+
+    lib = _spawn_lib()
+    enc = sys.getfilesystemencoding()
+    argv = [a.encode(enc) if isinstance(a, unicode) else a for a in argv]
+    env = ['%s=%s' % item for item in os.environ.items()]
+    # The opaque structures are 80 (file actions) and 336 (attributes) bytes
+    # on 64-bit glibc; allocate enough for any platform.
+    actions = ctypes.create_string_buffer(1024)
+    attr = ctypes.create_string_buffer(1024)
+    sigset = ctypes.create_string_buffer(1024)
+    pid = ctypes.c_int()
+    lib.posix_spawn_file_actions_init(actions)
+    lib.posix_spawnattr_init(attr)
+    try:
+        for i, fd in enumerate(fds):
+            lib.posix_spawn_file_actions_adddup2(actions, fd, i)
+        lib.posix_spawn_file_actions_addclosefrom_np(actions, 3)
+        lib.sigemptyset(sigset)
+        for sig in sigdef:
+            lib.sigaddset(sigset, sig)
+        lib.posix_spawnattr_setsigdefault(attr, sigset)
+        lib.sigemptyset(sigset)
+        lib.posix_spawnattr_setsigmask(attr, sigset)
+        lib.posix_spawnattr_setflags(attr, ctypes.c_short(_POSIX_SPAWN_SETSIGDEF | _POSIX_SPAWN_SETSIGMASK))
+        c_argv = (ctypes.c_char_p * (len(argv) + 1))(*(argv + [None]))
+        c_env = (ctypes.c_char_p * (len(env) + 1))(*(env + [None]))
+        # posix_spawn() returns an error number rather than setting errno.
+        err = lib.posix_spawnp(ctypes.byref(pid), argv[0], actions, attr, c_argv, c_env)
+    finally:
+        lib.posix_spawn_file_actions_destroy(actions)
+        lib.posix_spawnattr_destroy(attr)
+    if err:
+        raise OSError(err, '%s: %s' % (os.strerror(err), argv[0]))
+    return pid.value
+
+
+
+class _SpawnedChild(object):
+    """
+    Child created with posix_spawn(), providing the subset of the
+    subprocess.Popen interface used by Process.
+    """
+    def __init__(self, argv, stdin, stdout, stderr, sigdef):
+        self.returncode = None
+        self.stdin = self.stdout = self.stderr = None
+        # Our ends of pipes created for stdin, stdout and stderr.
+        ours = [None, None, None]
+        # Descriptors passed to the child, and those of them to close once
+        # it's spawned.
+        child, close = [], []
+        try:
+            for i, fd in enumerate((stdin, stdout, stderr)):
+                if fd == subprocess.PIPE:
+                    r, w = os.pipe()
+                    for end in r, w:
+                        fcntl.fcntl(end, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                    fd, ours[i] = (r, w) if i == 0 else (w, r)
+                    close.append(fd)
+                if fd < 3:
+                    # The dup2() file action is a no-op if the descriptor is
+                    # already in place, and wouldn't clear FD_CLOEXEC.
+                    fd = fcntl.fcntl(fd, fcntl.F_DUPFD, 3)
+                    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                    close.append(fd)
+                child.append(fd)
+            self.pid = _posix_spawn(argv, child, sigdef)
+        except:
+            for fd in ours:
+                if fd is not None:
+                    os.close(fd)
+            raise
+        finally:
+            for fd in close:
+                os.close(fd)
+
+        if ours[0] is not None:
+            self.stdin = os.fdopen(ours[0], 'wb', 0)
+        if ours[1] is not None:
+            self.stdout = os.fdopen(ours[1], 'rb', 0)
+        if ours[2] is not None:
+            self.stderr = os.fdopen(ours[2], 'rb', 0)
+
+
+    def _handle_exitstatus(self, status):
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        elif os.WIFEXITED(status):
+            self.returncode = os.WEXITSTATUS(status)
+
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # Reaped by someone else; the exit status is lost.
+                self.returncode = 0
+            else:
+                if pid == self.pid:
+                    self._handle_exitstatus(status)
+        return self.returncode
+
+
+    def wait(self):
+        while self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                self.returncode = 0
+            else:
+                self._handle_exitstatus(status)
+        return self.returncode
+
+
+
+class _Splicer(object):
+    """
+    Copies a child's stdout to an IOChannel from the main loop.
+
+    Used when the destination must remain under control of the main loop
+    (such as a non-blocking socket), so it can't be passed to the child
+    directly.  Where possible (Linux), data is moved with splice() and never
+    enters the Python heap.
+    """
+    # Maximum number of bytes moved per main loop iteration.
+    chunk = 65536
+
+    def __init__(self, src, dst):
+        self._src = src
+        self._dst = dst
+        self._pending = None
+        self._rmon = IOMonitor(self._handle_read)
+        self._wmon = IOMonitor(self._handle_write)
+        self.bytes = 0
+        self.finished = InProgress()
+        fd = src.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        # The notifier allows only one monitor per fd and condition, so we
+        # wait for the destination to become writable on a duplicate, rather
+        # than replacing the channel's own monitor.
+        self._dst_fd = os.dup(dst.fileno)
+        if dst._write_queue:
+            # Let data already queued for the destination go first.
+            dst._write_queue[-1][1].connect_both(self._start, self._start)
+        else:
+            self._start()
+
+
+    def _start(self, *args):
+        self._rmon.register(self._src.fileno(), IO_READ)
+
+
+    def _handle_read(self):
+        if not self._dst.alive:
+            return self._close()
+        try:
+            for i in range(16):
+                n = _splice(self._src.fileno(), self._dst_fd, self.chunk)
+                if n is None:
+                    # splice() not available: copy through userspace.
+                    return self._copy()
+                if n == 0:
+                    return self._close()
+                self.bytes += n
+        except (OSError, IOError), (err, msg):
+            if err != errno.EAGAIN:
+                log.error('Unable to splice child output to %s: %s', self._dst, msg)
+                return self._close()
+            # EAGAIN from either end.  If the destination is full, wait for
+            # it to drain; otherwise the pipe is empty.
+            if not select.select([], [self._dst_fd], [], 0)[1]:
+                self._rmon.unregister()
+                self._wmon.register(self._dst_fd, IO_WRITE)
+
+
+    def _copy(self):
+        data = os.read(self._src.fileno(), self.chunk)
+        if not data:
+            return self._close()
+        self._pending = data
+        self._handle_write()
+
+
+    def _handle_write(self):
+        if not self._dst.alive:
+            return self._close()
+        if self._pending:
+            try:
+                n = os.write(self._dst_fd, self._pending)
+            except OSError, (err, msg):
+                if err != errno.EAGAIN:
+                    log.error('Unable to copy child output to %s: %s', self._dst, msg)
+                    return self._close()
+                n = 0
+            self.bytes += n
+            self._pending = self._pending[n:]
+        if self._pending:
+            self._rmon.unregister()
+            self._wmon.register(self._dst_fd, IO_WRITE)
+        else:
+            self._wmon.unregister()
+            self._rmon.register(self._src.fileno(), IO_READ)
+
+
+    def _close(self):
+        self._rmon.unregister()
+        self._wmon.unregister()
+        self._src.close()
+        if self._dst_fd is not None:
+            os.close(self._dst_fd)
+            self._dst_fd = None
+        if not self.finished.finished:
+            self.finished.finish(self.bytes)
+
+
+
+# Weakrefs to Process objects with redirected output, see Process.redirect().
+_redirect_weakrefs = set()
+
+class _Redirect(object):
+    """
+    A file to which a child's stdout and/or stderr is written directly.
+
+    The child is given its own descriptor for the file, so its output never
+    passes through the main loop.  Consequently, size based rotation is done
+    logrotate copytruncate style: the file is copied to a backup (in a
+    thread) and truncated, and the child, whose descriptor is opened with
+    O_APPEND, carries on writing at the start of the file.  Output written
+    between the copy and the truncate is lost.
+
+    If a tail buffer is given, lines appended to the file are read back
+    periodically, stored in it and emitted through the readline and readlines
+    signals of the given channel.  Only the last lines of a large burst of
+    output are read, and lines longer than tail_window are cut to their last
+    tail_window bytes.  Tailing requires a regular file.
+    """
+    # Seconds between checks for rotation and new lines to tail.
+    interval = 0.25
+    # Most bytes read back from the end of the file per interval for the tail.
+    tail_window = 65536
+
+    def __init__(self, target, max_size=None, backups=1, tail=None, channel=None):
+        self.path = None
+        if isinstance(target, basestring):
+            self.path = target
+            self.fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0666)
+        else:
+            self.fd = os.dup(target if isinstance(target, (int, long)) else target.fileno())
+        fcntl.fcntl(self.fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        if tail is not None and not stat.S_ISREG(os.fstat(self.fd).st_mode):
+            # Reading back a pipe would consume the child's output.
+            os.close(self.fd)
+            raise ValueError('Output can only be tailed from a regular file')
+        self.max_size = max_size
+        self.backups = backups
+        self.tail = tail
+        self.channel = channel
+        self._rfd = None
+        self._partial = ''
+        self._rotating = False
+        self._timer = WeakTimer(self._poll)
+
+
+    def start(self):
+        """
+        Returns a descriptor for the child, owned by the caller.
+        """
+        if self.tail is not None and self._rfd is None:
+            # A new open file description, with its own offset.
+            self._rfd = os.open(self.path or '/proc/self/fd/%d' % self.fd, os.O_RDONLY)
+            fcntl.fcntl(self._rfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            os.lseek(self._rfd, 0, os.SEEK_END)
+            self._partial = ''
+        if (self.max_size or self.tail is not None) and not self._timer.active:
+            self._timer.start(self.interval)
+        return os.dup(self.fd)
+
+
+    def stop(self):
+        """
+        Called once the child has exited, to collect its last lines.
+        """
+        self._timer.stop()
+        if self._rfd is not None:
+            self._read_tail()
+            if self._partial:
+                self._emit([self._partial])
+                self._partial = ''
+            os.close(self._rfd)
+            self._rfd = None
+
+
+    def close(self):
+        self.stop()
+        self.release()
+
+
+    def release(self):
+        """
+        Closes the descriptors without collecting the last lines, once the
+        Process is gone.
+        """
+        self._timer.stop()
+        for fd in self.fd, self._rfd:
+            if fd is not None:
+                os.close(fd)
+        self.fd = self._rfd = None
+
+
+    def _poll(self):
+        if self._rfd is not None:
+            self._read_tail()
+        if self.max_size and self.path and not self._rotating and \
+           os.fstat(self.fd).st_size >= self.max_size:
+            self._rotating = True
+            self._rotate().connect_both(self._rotated, self._rotated)
+
+
+    def _read_tail(self):
+        pos = os.lseek(self._rfd, 0, os.SEEK_CUR)
+        size = os.fstat(self._rfd).st_size
+        if size < pos:
+            # Truncated by rotation.
+            pos = os.lseek(self._rfd, 0, os.SEEK_SET)
+            self._partial = ''
+        if size - pos > self.tail_window:
+            # Skip ahead rather than reading it all from the main loop.
+            os.lseek(self._rfd, size - self.tail_window, os.SEEK_SET)
+            self._partial = None
+        data = os.read(self._rfd, self.tail_window)
+        if not data:
+            return
+        lines = data.split('\n')
+        if self._partial is None:
+            # Skipped into the middle of a line.
+            if len(lines) == 1:
+                # And it doesn't end in the window.
+                self._partial = data
+                return
+            lines.pop(0)
+        else:
+            lines[0] = self._partial + lines[0]
+        self._partial = lines.pop()
+        if len(self._partial) > self.tail_window:
+            # Output without line ends mustn't grow the buffer indefinitely.
+            self._partial = self._partial[-self.tail_window:]
+        if lines:
+            self._emit([line + '\n' for line in lines])
+
+
+    def _emit(self, lines):
+        self.tail.extend(lines)
+        if self.channel:
+            for line in lines:
+                self.channel.signals['readline'].emit(line)
+            self.channel.signals['readlines'].emit(lines)
+
+
+    @threaded()
+    def _rotate(self):
+        for n in range(self.backups - 1, 0, -1):
+            backup = '%s.%d' % (self.path, n)
+            if os.path.exists(backup):
+                os.rename(backup, '%s.%d' % (self.path, n + 1))
+        if self.backups:
+            shutil.copyfile(self.path, self.path + '.1')
+        os.ftruncate(self.fd, 0)
+
+
+    def _rotated(self, *args):
+        self._rotating = False
+        if len(args) == 3:
+            log.error('Unable to rotate %s: %s', self.path, args[1])
 
 
 
@@ -269,6 +1020,20 @@ class Process(Object):
             Refer to :meth:`readline` for more details.
             """,
 
+        'readlines':
+            """
+            Emitted with all complete lines read from a chunk of either stdout
+            or stderr of the child process.
+
+            .. describe:: def callback(lines, ...)
+
+               :param lines: lines read from the child's stdout or stderr.
+               :type lines: list of str
+
+            This is a batched alternative to the *readline* signal.  Refer to
+            :meth:`readlines` for more details.
+            """,
+
         'finished':
             """
             Emitted when the child is dead and all data from stdout and stderr
@@ -305,7 +1070,7 @@ class Process(Object):
     }
 
     
-    def __init__(self, cmd, shell=False, dumpfile=None):
+    def __init__(self, cmd, shell=False, dumpfile=None, spawn='auto'):
         """
         Create a Process object.  The subprocess is not started until
         :meth:`start` is called.
@@ -317,8 +1082,12 @@ class Process(Object):
                       etc.), but in this case *cmd* must be a string.
         :type shell: bool
         :param dumpfile: File to which all child stdout and stderr will be
-                         dumped, or None to disable output dumping.
+                         dumped, or None to disable output dumping.  The
+                         output is copied by the main loop; see
+                         :meth:`redirect` for children producing a lot of it.
         :type dumpfile: None, string (path to filename), file object, IOChannel
+        :param spawn: how the child is created; see the :attr:`spawn` property.
+        :type spawn: str
 
         Process objects passed to :func:`kaa.inprogress` return a
         :class:`~kaa.InProgress` that corresponds to the
@@ -328,6 +1097,7 @@ class Process(Object):
         super(Process, self).__init__()
         self._cmd = cmd
         self._shell = shell
+        self.spawn = spawn
         self._stop_command = None
         # The subprocess.Popen object.
         self._child = None
@@ -335,6 +1105,8 @@ class Process(Object):
         self._cleanup_weakref = None
         # The exit code returned by the child once it completes.
         self._exitcode = None
+        # Resource usage of the child once it has been reaped.
+        self._rusage = None
 
         if dumpfile:
             # Dumpfile specified, create IOChannel which we'll later pass to
@@ -360,6 +1132,7 @@ class Process(Object):
         for fd in self._stdout, self._stderr:
             fd.signals['read'].connect_weak(self.signals['read'].emit)
             fd.signals['readline'].connect_weak(self.signals['readline'].emit)
+            fd.signals['readlines'].connect_weak(self.signals['readlines'].emit)
             # We need to keep track of the WeakCallables for _cleanup()
             cb = fd.signals['closed'].connect_weak(self._check_dead)
             self._weak_closed_cbs.append(cb)
@@ -375,6 +1148,18 @@ class Process(Object):
         cb = WeakCallable(self._update_read_monitor)
         self.signals['read'].changed_cb = cb
         self.signals['readline'].changed_cb = cb
+        self.signals['readlines'].changed_cb = cb
+
+        # Set by pipe(): the _PipeLink for our stdin (if piped from another
+        # process), and the _PipeLink or IOChannel our stdout goes to.
+        self._stdin_link = None
+        self._stdout_target = None
+        self._splicer = None
+        # Set by redirect(): _Redirect objects for stdout and stderr, and the
+        # buffer of their last lines.
+        self._redirects = {}
+        self._redirects_weakref = None
+        self._output_tail = None
 
         self._state = Process.STATE_STOPPED 
         # InProgress for the whole process.  Is recreated in start() for
@@ -445,6 +1230,21 @@ class Process(Object):
         return self._exitcode
 
 
+    @property
+    def rusage(self):
+        """
+        Resource usage of the child once it has terminated, as a
+        ``resource.struct_rusage`` (see ``os.wait4()``), or None.
+
+        This includes user and system CPU time (*ru_utime*, *ru_stime*),
+        peak resident size (*ru_maxrss*, in kilobytes on Linux) and block
+        I/O operations (*ru_inblock*, *ru_oublock*) of the child and any of
+        its own children it waited for.  It is None while the child is
+        running, or if its exit status was collected by someone else.
+        """
+        return self._rusage
+
+
     @property
     def running(self):
         """
@@ -520,6 +1320,37 @@ class Process(Object):
         self._stop_command = cmd
 
 
+    @property
+    def spawn(self):
+        """
+        How the child process is created: ``'fork'``, ``'posix_spawn'`` or
+        ``'auto'`` (the default).
+
+        With ``'fork'``, the child is created by ``subprocess.Popen``, which
+        forks the interpreter and runs :meth:`_child_preexec` in the child.
+        Forking is slow for processes with a large heap, and not safe if
+        other threads hold locks at the time.
+
+        With ``'posix_spawn'``, the child is created with ``posix_spawn()``,
+        which uses ``vfork()`` or equivalent on most platforms, so the
+        cost is independent of the parent's size and no Python code runs in
+        the child.  The work of :meth:`_child_preexec` is done with spawn
+        attributes instead.  :meth:`start` raises NotImplementedError if the
+        platform doesn't support it.
+
+        ``'auto'`` uses ``'posix_spawn'`` where supported, unless a subclass
+        overrides :meth:`_child_preexec`.
+        """
+        return self._spawn
+
+
+    @spawn.setter
+    def spawn(self, value):
+        if value not in ('auto', 'fork', 'posix_spawn'):
+            raise ValueError('spawn must be one of auto, fork or posix_spawn')
+        self._spawn = value
+
+
     @property
     def delimiter(self):
         """
@@ -563,6 +1394,21 @@ class Process(Object):
                 signal.signal(sig, signal.SIG_DFL)
 
 
+    def _use_posix_spawn(self):
+        """
+        Returns True if the child should be created with posix_spawn().
+        """
+        if self._spawn == 'fork':
+            return False
+        elif self._spawn == 'posix_spawn':
+            if not _posix_spawn_available():
+                raise NotImplementedError('posix_spawn is not supported on this platform')
+            return True
+        # Subclasses may do more in _child_preexec than we can with spawn
+        # attributes, which requires forking.
+        return _posix_spawn_available() and type(self)._child_preexec == Process._child_preexec
+
+
     #@threaded() <-- don't
     def start(self, args=''):
         """
@@ -605,20 +1451,187 @@ class Process(Object):
             self._in_progress = InProgress()
         self._in_progress.signals['abort'].connect_weak(lambda exc: self.stop())
         self._exitcode = None
+        self._rusage = None
         supervisor.register(self)
 
-        log.debug("Spawning: %s", cmd)
-        self._child = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE, preexec_fn=self._child_preexec,
-                                       close_fds=True, shell=self._shell)
+        # Ends of pipes to other processes (see pipe()) are passed to the
+        # child directly, so data between them doesn't pass through us.
+        stdin = stdout = stderr = subprocess.PIPE
+        if self._stdin_link:
+            stdin = self._stdin_link.take(0)
+        if isinstance(self._stdout_target, Process):
+            stdout = self._stdout_target._stdin_link.take(1)
+        # Redirected output goes straight to its file.
+        if 'stdout' in self._redirects:
+            stdout = self._redirects['stdout'].start()
+        if 'stderr' in self._redirects:
+            stderr = self._redirects['stderr'].start()
 
-        self._stdin.wrap(self._child.stdin, IO_WRITE)
-        self._stdout.wrap(self._child.stdout, IO_READ)
-        self._stderr.wrap(self._child.stderr, IO_READ)
+        log.debug("Spawning: %s", cmd)
+        try:
+            if self._use_posix_spawn():
+                # Same as _child_preexec(): reset ignored signals to their
+                # defaults, as children would otherwise inherit them.
+                sigdef = [sig for sig in range(1, signal.NSIG) if signal.getsignal(sig) == signal.SIG_IGN]
+                argv = ['/bin/sh', '-c', cmd] if self._shell else cmd
+                self._child = _SpawnedChild(argv, stdin, stdout, stderr, sigdef)
+            else:
+                self._child = subprocess.Popen(cmd, stdin=stdin, stdout=stdout,
+                                               stderr=stderr, preexec_fn=self._child_preexec,
+                                               close_fds=True, shell=self._shell)
+        except:
+            supervisor.unregister(self)
+            raise
+        else:
+            # Now that the pid is known.
+            supervisor.register(self)
+        finally:
+            # The child has its own copies now.
+            for fd in stdin, stdout, stderr:
+                if fd != subprocess.PIPE:
+                    os.close(fd)
+
+        if self._child.stdin:
+            self._stdin.wrap(self._child.stdin, IO_WRITE)
+        if isinstance(self._stdout_target, IOChannel):
+            self._splicer = _Splicer(self._child.stdout, self._stdout_target)
+            self._splicer.finished.connect_weak(self._check_dead)
+        elif self._child.stdout:
+            self._stdout.wrap(self._child.stdout, IO_READ)
+        if self._child.stderr:
+            self._stderr.wrap(self._child.stderr, IO_READ)
         self._state = Process.STATE_RUNNING
         return self._in_progress
 
 
+    def pipe(self, target):
+        """
+        Connects the child's stdout to another process or channel.
+
+        :param target: the :class:`~kaa.Process` whose stdin receives our
+                       child's stdout, an :class:`~kaa.IOChannel` (such as a
+                       :class:`~kaa.Socket`) to which the output is written,
+                       or None to undo a previous pipe().
+        :returns: *target*, so that calls can be chained::
+
+            decoder.pipe(filter).pipe(encoder)
+
+        When *target* is a Process, the two children are connected by a pipe
+        when they are started (in either order), much like a shell pipeline,
+        so the data never passes through this process.  The :attr:`stdout`
+        of this Process and the :attr:`stdin` of *target* are then not used.
+
+        When *target* is an IOChannel, the main loop copies the child's output
+        to it.  On Linux this is done with ``splice()``, which moves the data
+        within the kernel.  Data already queued for writing to *target* is
+        written first; the caller should not write to *target* itself while
+        the child is running.
+
+        In both cases stderr, exit status and all signals other than output
+        on stdout work as usual.  The pipe must be set up before
+        :meth:`start` is called.
+        """
+        if self.running:
+            raise IOError(errno.EBUSY, 'Cannot pipe a running process')
+        if isinstance(target, Process):
+            if target.running:
+                raise IOError(errno.EBUSY, 'Cannot pipe to a running process')
+            if target._stdin_link:
+                raise ValueError('%s is already piped from another process' % target)
+        elif target is not None and not isinstance(target, IOChannel):
+            raise TypeError('Target must be a Process or IOChannel')
+        if target is not None and 'stdout' in self._redirects:
+            raise ValueError('stdout is redirected to a file')
+
+        if isinstance(self._stdout_target, Process):
+            self._stdout_target._stdin_link = None
+        self._stdout_target = target
+        if isinstance(target, Process):
+            target._stdin_link = _PipeLink()
+        return target
+
+
+    def redirect(self, stdout=None, stderr=None, max_size=None, backups=1, tail=None):
+        """
+        Sends the child's stdout and/or stderr directly to a file.
+
+        :param stdout: path of a file to which the child's stdout is appended,
+                       or a file descriptor or file object; None leaves stdout
+                       connected to us.
+        :type stdout: string, int or file object
+        :param stderr: as *stdout*, for the child's stderr.  If it's the same
+                       as *stdout*, both are written to the same file.
+        :type stderr: string, int or file object
+        :param max_size: if specified, files given by path are rotated once
+                         they reach this many bytes.
+        :type max_size: int
+        :param backups: number of rotated copies to keep (``path.1`` being the
+                        most recent), or 0 to simply truncate the file.
+        :type backups: int
+        :param tail: if specified, the last *tail* lines written to the files
+                     are kept in :attr:`output_tail` and emitted by the
+                     :attr:`~signals.readline` and :attr:`~signals.readlines`
+                     signals.  The files must be regular files.
+        :type tail: int
+
+        Unlike *dumpfile*, the files are passed to the child when it is
+        created, so its output doesn't pass through the main loop at all,
+        which matters for children producing a lot of output.  The
+        :attr:`~signals.read` signal and :meth:`read` do not apply to
+        redirected output.
+
+        The files are rotated copytruncate style: the file is copied to its
+        backup and truncated while the child continues writing to it, so a
+        small amount of output may be lost during rotation.  If *tail* is
+        specified, the files are checked for new lines periodically, and
+        if the child produces output faster than it can be read back, only
+        the most recent lines are seen.
+
+        Redirection must be set up before :meth:`start` is called.  Calling
+        this method without arguments removes any redirection.
+        """
+        if self.running:
+            raise IOError(errno.EBUSY, 'Cannot redirect a running process')
+        if stdout is not None and self._stdout_target is not None:
+            raise ValueError('stdout is already piped')
+
+        for redirect in set(self._redirects.values()):
+            redirect.close()
+        _redirect_weakrefs.discard(self._redirects_weakref)
+        self._redirects = redirects = {}
+        self._redirects_weakref = None
+        self._output_tail = collections.deque(maxlen=tail) if tail else None
+        if stdout is not None:
+            redirects['stdout'] = _Redirect(stdout, max_size, backups, self._output_tail, self._stdout)
+        if stderr is not None:
+            if stderr is stdout or (isinstance(stderr, basestring) and stderr == stdout):
+                redirects['stderr'] = redirects['stdout']
+            else:
+                try:
+                    redirects['stderr'] = _Redirect(stderr, max_size, backups, self._output_tail, self._stderr)
+                except:
+                    self.redirect()
+                    raise
+        if redirects:
+            # Close the files once we are gone.  The weakref is kept outside
+            # of us, as its callback isn't invoked if it is collected along
+            # with us.
+            cb = Callable(self.__class__._release_redirects, set(redirects.values()))
+            self._redirects_weakref = weakref.ref(self, cb)
+            _redirect_weakrefs.add(self._redirects_weakref)
+
+
+    @property
+    def output_tail(self):
+        """
+        List of the last lines written to the files given to :meth:`redirect`,
+        or None if no tail was requested.
+        """
+        if self._output_tail is None:
+            return None
+        return list(self._output_tail)
+
+
     @coroutine(policy=POLICY_SINGLETON)
     def stop(self, cmd=None, wait=3.0):
         """
@@ -720,7 +1733,7 @@ class Process(Object):
         # chunk size, can close the channel.  (What makes this more complicated
         # is knowing which channel to close, given finish=FINISH_RESULT.)
         return InProgressAny(stdout_read(), stderr_read(), finish=FINISH_RESULT,
-                             filter=lambda val: val in (None, ''))
+                             filter=lambda val: val in (None, '', []))
 
 
     def read(self):
@@ -789,6 +1802,21 @@ class Process(Object):
         return self._async_read(self._stdout.readline, self._stderr.readline)
 
 
+    def readlines(self):
+        """
+        Reads all available lines from either stdout or stderr, whichever is
+        available first.
+
+        :returns: A :class:`~kaa.InProgress`, finished with a list of lines.
+                  If it is finished with None or the empty list, it means the
+                  child's stdout and stderr were both closed and no data was
+                  available.
+
+        See :meth:`kaa.IOChannel.readlines` for more details.
+        """
+        return self._async_read(self._stdout.readlines, self._stderr.readlines)
+
+
     def write(self, data):
         """
         Write data to child's stdin.
@@ -843,13 +1871,11 @@ class Process(Object):
                 yield self.write(input)
             self.stdin.close()
 
-            buf_out = BytesIO()
-            while self.stdout.readable:
-                buf_out.write((yield self.stdout.read()))
-
-            buf_err = BytesIO()
-            while self.stderr.readable:
-                buf_err.write((yield self.stderr.read()))
+            # Read both concurrently, otherwise a child filling the stderr
+            # pipe would block before closing stdout.
+            buf_out, buf_err = BytesIO(), BytesIO()
+            yield InProgressAll(self._read_all(self.stdout, buf_out),
+                                self._read_all(self.stderr, buf_err))
         except InProgressAborted, e:
             # If the coroutine is aborted while we're trying to read from the
             # child's stdout/err, then stop the child.  We can't yield stop()
@@ -860,6 +1886,12 @@ class Process(Object):
             yield (buf_out.getvalue(), buf_err.getvalue())
 
 
+    @coroutine()
+    def _read_all(self, channel, buf):
+        while channel.readable:
+            buf.write((yield channel.read()))
+
+
     def _check_dead(self, expected=None):
         """
         Checks to see if the child process has died.
@@ -874,7 +1906,8 @@ class Process(Object):
 
         if not self._child or self._state in (Process.STATE_STOPPED, Process.STATE_DYING):
             # We're already dead or dying.
-            if not self._stdout.alive and not self._stderr.alive and self._cleanup_weakref:
+            if not self._stdout.alive and not self._stderr.alive and not self._splicing() and \
+               self._cleanup_weakref:
                 # Child is dead and all IOChannels are closed.  We no longer need
                 # our weakref cleanup crutch.
                 self._cleanup_weakref = None
@@ -883,10 +1916,78 @@ class Process(Object):
                 self.signals['finished'].emit(self._exitcode)
             return
 
+        if self._child.returncode is None:
+            # Reap it ourselves with wait4() rather than poll() so we get its
+            # resource usage.
+            try:
+                pid, status, rusage = os.wait4(self._child.pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno not in (errno.ECHILD, errno.EINTR):
+                    raise
+                # poll() below handles a child reaped by someone else.
+            else:
+                if pid:
+                    self._child._handle_exitstatus(status)
+                    self._rusage = rusage
+                    supervisor._account(rusage)
+
         if self._child.poll() is not None:
             self._handle_dead()
+
+
+    def _reaped(self, status, rusage=None):
+        """
+        Invoked by the supervisor when it reaped our child, with the exit
+        status and resource usage as returned by os.wait4().
+        """
+        if self._child and self._child.returncode is None:
+            self._child._handle_exitstatus(status)
+            self._rusage = rusage
+        self._check_dead()
+
+
+    def sample(self):
+        """
+        Samples the current resource usage of the running child.
+
+        :returns: a dict, or None if the child is not running or the
+                  information is not available (it is read from /proc).
+
+        The dict has the following keys:
+
+            * *utime*, *stime*: user and system CPU seconds used so far
+            * *rss*: resident size in bytes
+            * *vms*: virtual memory size in bytes
+            * *threads*: number of threads
+            * *read_bytes*, *write_bytes*: bytes read from and written to
+              storage so far, or None if I/O accounting is not available
+
+        Unlike :attr:`rusage`, this does not include the child's own
+        children.
+        """
+        if not self._child or self._child.returncode is not None:
+            return None
+        return _sample(self._child.pid)
+
+
+    def _splicing(self):
+        """
+        True if the child's stdout is still being copied to a pipe() target.
+        """
+        return self._splicer is not None and not self._splicer.finished.finished
  
 
+    @classmethod
+    def _release_redirects(cls, weakref, redirects):
+        """
+        Called when the Process object is destroyed to close the files given
+        to redirect().
+        """
+        _redirect_weakrefs.discard(weakref)
+        for redirect in redirects:
+            redirect.release()
+
+
     @classmethod
     def _cleanup(cls, weakref, channels, callbacks):
         """
@@ -940,6 +2041,8 @@ class Process(Object):
         # user may yet retrieve.
         self._stdin.close(immediate=True)
         self._child = None
+        for redirect in set(self._redirects.values()):
+            redirect.stop()
 
         # We no longer need help from the supervisor.  Any future SIGCHLDs
         # are not caused by us.
@@ -953,7 +2056,7 @@ class Process(Object):
         if not self._in_progress.finished:
             self._in_progress.finish(self._exitcode)
 
-        if self._stdout.alive or self._stderr.alive:
+        if self._stdout.alive or self._stderr.alive or self._splicing():
             # Use weakref finializer callback kludge to invoke Process._cleanup
             # when Process object goes away in order to close stdout
             # and stderr IOChannels.
@@ -962,3 +2065,296 @@ class Process(Object):
         else:
             # Child exit and stdout/stderr closed.  We're finished.
             self.signals['finished'].emit(self._exitcode)
+
+
+
+class Pipeline(object):
+    """
+    A chain of processes, each one's stdout connected to the next one's stdin.
+
+    :param processes: :class:`~kaa.Process` objects, or commands from which
+                      Process objects are created
+
+    This is a convenience around :meth:`Process.pipe`::
+
+        pipeline = kaa.Pipeline('decoder in.flac', 'filter', 'encoder')
+        pipeline.processes[-1].stdout.signals['read'].connect(...)
+        exitcodes = yield pipeline.start()
+
+    Pipeline objects passed to :func:`kaa.inprogress` return an InProgress
+    finished with the list of exit codes when all processes have exited.
+    """
+    def __init__(self, *processes):
+        self._processes = [p if isinstance(p, Process) else Process(p) for p in processes]
+        for src, dst in zip(self._processes, self._processes[1:]):
+            src.pipe(dst)
+        self._in_progress = None
+
+
+    def __inprogress__(self):
+        if not self._in_progress:
+            raise ValueError('Pipeline has not been started')
+        return self._in_progress
+
+
+    @property
+    def processes(self):
+        """
+        List of :class:`~kaa.Process` objects in the pipeline.
+        """
+        return self._processes[:]
+
+
+    @property
+    def stdin(self):
+        """
+        :class:`~kaa.IOChannel` of the first process's stdin.
+        """
+        return self._processes[0].stdin
+
+
+    @property
+    def stdout(self):
+        """
+        :class:`~kaa.IOChannel` of the last process's stdout.
+        """
+        return self._processes[-1].stdout
+
+
+    @property
+    def exitcodes(self):
+        """
+        List of the processes' exit codes (None for those still running).
+        """
+        return [p.exitcode for p in self._processes]
+
+
+    def start(self):
+        """
+        Starts all processes in the pipeline.
+
+        :returns: an :class:`~kaa.InProgress` finished with the list of exit
+                  codes when all processes have exited.
+        """
+        self._in_progress = self._wait([p.start() for p in self._processes])
+        return self._in_progress
+
+
+    @coroutine()
+    def _wait(self, ips):
+        yield InProgressAll(*ips)
+        yield self.exitcodes
+
+
+    def stop(self):
+        """
+        Stops all processes in the pipeline.
+
+        :returns: an :class:`~kaa.InProgress` finished when all processes
+                  have terminated.
+        """
+        return InProgressAll(*[p.stop() for p in self._processes])
+
+
+
+class _QueuedProcess(InProgress):
+    """
+    InProgress for a process submitted to a ProcessQueue.
+    """
+    def __init__(self, process, input, priority):
+        super(_QueuedProcess, self).__init__()
+        self.process = process
+        self.input = input
+        self.priority = priority
+        self.queued = time.time()
+        self.communicating = None
+        # Set when the job is aborted while running.
+        self.aborted = False
+
+
+
+class ProcessQueue(object):
+    """
+    Runs commands with a limit on the number of concurrently running
+    children.
+
+    :param concurrency: maximum number of children running at once; if None,
+                        the number of CPUs.
+    :type concurrency: int
+
+    This is useful for running large numbers of short-lived commands (probes,
+    conversions, etc.) without exhausting file descriptors or overloading the
+    CPU by starting them all at once::
+
+        queue = kaa.ProcessQueue(4)
+        ips = [queue.enqueue(['ffprobe', path]) for path in paths]
+        for ip in ips:
+            exitcode, stdout, stderr = yield ip
+
+    Output is collected with :meth:`Process.communicate`, rather than
+    line-by-line through the Process signals.
+    """
+    def __init__(self, concurrency=None):
+        if concurrency is None:
+            try:
+                concurrency = os.sysconf('SC_NPROCESSORS_ONLN')
+            except (AttributeError, ValueError, OSError):
+                concurrency = 1
+        self._concurrency = concurrency
+        # Queue of _QueuedProcess objects, highest priority first.
+        self._queue = []
+        self._running = []
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0,
+                       'wait_time': 0.0, 'max_wait_time': 0.0}
+
+
+    def __repr__(self):
+        return '<ProcessQueue concurrency=%d running=%d queued=%d at 0x%x>' % \
+               (self._concurrency, len(self._running), len(self._queue), id(self))
+
+
+    @property
+    def concurrency(self):
+        """
+        The maximum number of children running at once.
+
+        If decreased, running children are not stopped, but no new ones are
+        started until fewer than this number are running.
+        """
+        return self._concurrency
+
+
+    @concurrency.setter
+    def concurrency(self, value):
+        self._concurrency = value
+        self._schedule()
+
+
+    @property
+    def running(self):
+        """
+        Number of children currently running.
+        """
+        return len(self._running)
+
+
+    @property
+    def queued(self):
+        """
+        Number of commands waiting for a free slot.
+        """
+        return len(self._queue)
+
+
+    @property
+    def stats(self):
+        """
+        A dict of metrics for the queue:
+
+            * *submitted*: number of commands enqueued
+            * *completed*: number of children that ran to completion
+              (regardless of their exit code)
+            * *failed*: number of commands that couldn't be run, or were
+              aborted while running
+            * *wait_time*: total seconds commands spent queued
+            * *max_wait_time*: longest time a command spent queued
+            * *running*: number of children currently running
+            * *queued*: number of commands waiting for a free slot
+        """
+        stats = self._stats.copy()
+        stats['running'] = len(self._running)
+        stats['queued'] = len(self._queue)
+        return stats
+
+
+    def enqueue(self, cmd, input=None, priority=0):
+        """
+        Queues a command to be run once fewer than :attr:`concurrency`
+        children are running.
+
+        :param cmd: the command to run, or a :class:`~kaa.Process` object
+                    which has not been started
+        :type cmd: string, list of strings or :class:`~kaa.Process`
+        :param input: data written to the child's stdin, which is closed
+                      afterward
+        :type input: str
+        :param priority: determines the relative priority of the command;
+                         higher values are started first.
+        :type priority: int
+        :returns: an :class:`~kaa.InProgress` finished with a 3-tuple
+                  (exitcode, stdoutdata, stderrdata) once the child has
+                  exited.
+
+        If the command is still queued when the returned InProgress is
+        aborted, it is removed from the queue; if it is running, the child
+        is stopped.
+        """
+        process = cmd if isinstance(cmd, Process) else Process(cmd)
+        job = _QueuedProcess(process, input, priority)
+        job.signals['abort'].connect(lambda exc: self._abort(job))
+        self._queue.append(job)
+        self._queue.sort(key=lambda job: job.priority, reverse=True)
+        self._stats['submitted'] += 1
+        self._schedule()
+        return job
+
+
+    def dequeue(self, job):
+        """
+        Removes a command from the queue.
+
+        :param job: the InProgress returned by :meth:`enqueue`
+        :returns: True if the command was queued and was removed, and False
+                  if it was not found (e.g. because it has started).
+        """
+        try:
+            self._queue.remove(job)
+        except ValueError:
+            return False
+        return True
+
+
+    def _abort(self, job):
+        if not self.dequeue(job) and job.communicating:
+            self._stats['failed'] += 1
+            job.aborted = True
+            job.communicating.abort()
+
+
+    def _schedule(self):
+        while self._queue and len(self._running) < self._concurrency:
+            job = self._queue.pop(0)
+            wait = time.time() - job.queued
+            self._stats['wait_time'] += wait
+            self._stats['max_wait_time'] = max(self._stats['max_wait_time'], wait)
+            self._running.append(job)
+            self._run(job)
+
+
+    @coroutine()
+    def _run(self, job):
+        exc_info = None
+        try:
+            job.communicating = job.process.communicate(job.input)
+            stdout, stderr = yield job.communicating
+            if job.process.exitcode is None:
+                # stdout and stderr are closed but the child has not yet been
+                # reaped.
+                yield inprogress(job.process)
+        except (Exception, InProgressAborted):
+            # InProgressAborted is not an Exception, and is raised when the
+            # job (or the child's communicate()) is aborted.
+            exc_info = sys.exc_info()
+
+        # Free the slot before finishing, so callbacks see accurate stats.
+        self._running.remove(job)
+        if job.finished or job.aborted:
+            # Aborted, so the job is thrown its own abort exception.
+            pass
+        elif exc_info:
+            self._stats['failed'] += 1
+            job.throw(*exc_info)
+        else:
+            self._stats['completed'] += 1
+            job.finish((job.process.exitcode, stdout, stderr))
+        self._schedule()
@@ -0,0 +1,629 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# procpool.py - Pool of forked worker processes
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+__all__ = [ 'ProcessPool', 'ProcessPoolError', 'processed' ]
+
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import struct
+import logging
+import cPickle
+import traceback
+
+from .utils import property, wraps
+from .strutils import bl
+from .io import IOChannel, IO_READ, IO_WRITE
+from .async import InProgress
+from .timer import OneShotTimer
+from .process import supervisor
+from .rpc import RemoteException, PICKLE_PROTOCOL
+from . import main
+
+# get logging object
+log = logging.getLogger('kaa.base.procpool')
+
+# Same framing as kaa.rpc: sequence number, packet type, payload length.
+_HEADER = 'I4sI'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+# Functions decorated with @processed, by (module, name).  Workers look up
+# functions here, rather than unpickling them, as the module attribute of
+# that name is the decorated function rather than the function itself.
+_registry = {}
+
+
+class ProcessPoolError(Exception):
+    """
+    Raised to the InProgress of a job whose worker process died while
+    executing it, or which was queued when the pool was closed.
+    """
+    pass
+
+
+def _cpu_count():
+    try:
+        return os.sysconf('SC_NPROCESSORS_ONLN')
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+
+def _rss():
+    """
+    Returns the current resident set size of this process in bytes.
+    """
+    try:
+        return int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current RSS, in kilobytes on Linux (where we
+        # shouldn't get here) and bytes on OS X.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        try:
+            data = sock.recv(size)
+        except socket.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if not data:
+            return None
+        chunks.append(data)
+        size -= len(data)
+    return bl('').join(chunks)
+
+
+def _worker_main(sock):
+    """
+    Main loop of a worker process: executes jobs received over the socket
+    until it is closed.  The kaa main loop is not used in workers.
+    """
+    # Ctrl-C is handled by the parent, which stops us by closing the socket.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    if hasattr(signal, 'set_wakeup_fd'):
+        # Don't wake our parent's copy of the main loop.
+        signal.set_wakeup_fd(-1)
+
+    while True:
+        header = _recv_exactly(sock, _HEADER_SIZE)
+        if not header:
+            break
+        seq, packet_type, size = struct.unpack(_HEADER, header)
+        payload = _recv_exactly(sock, size)
+        if payload is None:
+            break
+        try:
+            func, args, kwargs = cPickle.loads(payload)
+            if isinstance(func, tuple):
+                if func not in _registry:
+                    # Decorated after we were forked; importing the module
+                    # decorates it again.
+                    __import__(func[0])
+                func = _registry[func]
+            result = func(*args, **kwargs)
+            packet_type, payload = 'RETN', cPickle.dumps((result, _rss()), PICKLE_PROTOCOL)
+        except Exception, e:
+            stack = traceback.extract_tb(sys.exc_info()[2])
+            try:
+                payload = cPickle.dumps((e, stack, _rss()), PICKLE_PROTOCOL)
+            except Exception:
+                payload = cPickle.dumps((Exception(str(e)), stack, _rss()), PICKLE_PROTOCOL)
+            packet_type = 'EXCP'
+        sock.sendall(struct.pack(_HEADER, seq, packet_type, len(payload)) + payload)
+
+
+
+class _Job(InProgress):
+    """
+    InProgress for a job submitted to a ProcessPool.
+    """
+    def __init__(self, func, args, kwargs, priority):
+        super(_Job, self).__init__()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.queued = time.time()
+
+
+
+class _PoolWorker(object):
+    """
+    A worker process of a ProcessPool, monitored by the process supervisor
+    (see net.prefork._Worker for the protocol).
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.pid = None
+        self.channel = None
+        self.job = None
+        self.jobs = 0
+        self.rss = 0
+        self.exitcode = None
+        self._seq = 0
+        self._buffer = []
+        self._buffered = 0
+        self._dead = InProgress()
+        self._kill_timer = OneShotTimer(self._kill)
+
+
+    def __inprogress__(self):
+        return self._dead
+
+
+    def __repr__(self):
+        return '<ProcessPool worker pid=%s>' % self.pid
+
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+
+    def start(self, others):
+        parent, child = socket.socketpair()
+        supervisor.register(self)
+        try:
+            pid = os.fork()
+        except OSError:
+            supervisor.unregister(self)
+            parent.close()
+            child.close()
+            raise
+
+        if not pid:
+            # Worker process.  Close our parent's ends of other workers'
+            # sockets, so they see EOF when the parent closes them.
+            parent.close()
+            for w in others:
+                if w.channel and w.channel.fileno is not None:
+                    os.close(w.channel.fileno)
+            try:
+                _worker_main(child)
+            except:
+                os._exit(1)
+            os._exit(0)
+
+        child.close()
+        self.pid = pid
+        # Now that the pid is known.
+        supervisor.register(self)
+        self._sock = parent
+        self.channel = IOChannel(parent, mode=IO_READ | IO_WRITE)
+        self.channel.signals['read'].connect(self._handle_read)
+        self.channel.signals['closed'].connect(self._handle_closed)
+        # In case it has already exited.
+        self._check_dead()
+
+
+    def run(self, job):
+        """
+        Sends the given job to the worker.
+        """
+        self.job = job
+        self._seq += 1
+        try:
+            payload = cPickle.dumps((job.func, job.args, job.kwargs), PICKLE_PROTOCOL)
+        except Exception:
+            self.job = None
+            job.throw(*sys.exc_info())
+            return False
+        data = struct.pack(_HEADER, self._seq, 'CALL', len(payload)) + payload
+        self.channel.queue_size = max(self.channel.queue_size, len(data))
+        self.channel.write(data)
+        return True
+
+
+    def _handle_read(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        while self._buffered >= _HEADER_SIZE:
+            data = bl('').join(self._buffer)
+            seq, packet_type, size = struct.unpack(_HEADER, data[:_HEADER_SIZE])
+            if len(data) < _HEADER_SIZE + size:
+                self._buffer = [data]
+                return
+            payload = data[_HEADER_SIZE:_HEADER_SIZE + size]
+            data = data[_HEADER_SIZE + size:]
+            self._buffer = [data]
+            self._buffered = len(data)
+            self._handle_packet(packet_type, payload)
+
+
+    def _handle_packet(self, packet_type, payload):
+        job, self.job = self.job, None
+        self.jobs += 1
+        if packet_type == bl('RETN'):
+            result, self.rss = cPickle.loads(payload)
+            self.pool._job_done(self, job, False)
+            job.finish(result)
+        else:
+            try:
+                exc_value, stack, self.rss = cPickle.loads(payload)
+            except Exception, e:
+                exc_value, stack = e, ''
+            self.pool._job_done(self, job, True)
+            name = job.func[1] if isinstance(job.func, tuple) else getattr(job.func, '__name__', job.func)
+            remote_exc = RemoteException(exc_value, stack, name)
+            job.throw(remote_exc.__class__, remote_exc, None)
+
+
+    def _handle_closed(self, expected):
+        if not expected:
+            # The worker died (or closed its socket).  We'll know why once
+            # it's reaped.
+            log.debug('%s closed its channel', self)
+
+
+    def _check_dead(self, expected=None):
+        if not self.pid or self._dead.finished:
+            return
+        try:
+            pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        except OSError, e:
+            if e.errno != errno.ECHILD:
+                raise
+            pid, status, rusage = self.pid, None, None
+        if pid:
+            if rusage:
+                # Reaped by us rather than the supervisor, so count it in
+                # the supervisor's usage() ourselves.
+                supervisor._account(rusage)
+            self._reaped(status, rusage)
+
+
+    def _reaped(self, status, rusage=None):
+        if self._dead.finished:
+            return
+        supervisor.unregister(self)
+        self._kill_timer.stop()
+        if status is None:
+            self.exitcode = None
+        elif os.WIFSIGNALED(status):
+            self.exitcode = -os.WTERMSIG(status)
+        else:
+            self.exitcode = os.WEXITSTATUS(status)
+        if self.channel:
+            self.channel.close(immediate=True)
+        self._dead.finish(self.exitcode)
+        self.pool._worker_exited(self)
+
+
+    def _kill(self):
+        log.warning('%s did not exit, killing', self)
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+    def stop(self, wait=5):
+        """
+        Stops the worker once its current job is done, killing it if it
+        hasn't exited after *wait* seconds.
+        """
+        if self.pid and not self._dead.finished and not self._kill_timer.active:
+            # The worker exits when it sees EOF.
+            self._sock.shutdown(socket.SHUT_WR)
+            self._kill_timer.start(wait)
+        return self._dead
+
+
+
+class ProcessPool(object):
+    """
+    Manages a pool of persistent worker processes for executing CPU-bound
+    functions, for use with the :func:`@kaa.processed() <kaa.processed>`
+    decorator, or :meth:`enqueue`.
+
+    :param size: maximum number of worker processes; if None, the number of
+                 CPUs.
+    :type size: int
+    :param max_jobs: number of jobs after which a worker is replaced by a new
+                     one, or None for no limit.
+    :type max_jobs: int
+    :param max_rss: resident memory size in bytes above which a worker is
+                    replaced after its current job, or None for no limit.
+    :type max_rss: int
+
+    Unlike threads, worker processes are not limited by the GIL.  Workers are
+    forked from the current process as needed (or all at once with
+    :meth:`start`), and receive jobs and send back results over a socket, so
+    functions must be defined at module level, and arguments and return
+    values must be picklable.  Exceptions raised by the function are raised
+    to the caller as :class:`~kaa.rpc.RemoteException`.
+
+    Workers inherit the state of the process at the time they are forked, so
+    the pool is best created (and started) early.  The kaa main loop is not
+    available in workers.
+
+    If a worker dies while executing a job, a :class:`~kaa.ProcessPoolError`
+    is raised to the job's InProgress and a new worker is forked for
+    subsequent jobs.
+    """
+    def __init__(self, size=None, max_jobs=None, max_rss=None):
+        self._size = size or _cpu_count()
+        self._max_jobs = max_jobs
+        self._max_rss = max_rss
+        self._workers = []
+        # Queue of _Job objects, highest priority first.
+        self._queue = []
+        self._closed = False
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'crashed': 0,
+                       'recycled': 0, 'wait_time': 0.0}
+        main.signals['shutdown'].connect_weak(self.close)
+
+
+    def __repr__(self):
+        return '<ProcessPool size=%d workers=%d at 0x%x>' % (self._size, len(self._workers), id(self))
+
+
+    @property
+    def size(self):
+        """
+        The maximum number of worker processes.
+
+        If decreased, idle workers beyond the new size are stopped, and busy
+        ones once their job is done.
+        """
+        return self._size
+
+
+    @size.setter
+    def size(self, value):
+        self._size = value
+        self._schedule()
+
+
+    @property
+    def max_jobs(self):
+        """
+        Number of jobs after which a worker is replaced, or None.
+        """
+        return self._max_jobs
+
+
+    @max_jobs.setter
+    def max_jobs(self, value):
+        self._max_jobs = value
+
+
+    @property
+    def max_rss(self):
+        """
+        Resident memory size in bytes above which a worker is replaced, or
+        None.
+        """
+        return self._max_rss
+
+
+    @max_rss.setter
+    def max_rss(self, value):
+        self._max_rss = value
+
+
+    @property
+    def stats(self):
+        """
+        A dict of metrics for the pool:
+
+            * *submitted*: number of jobs enqueued
+            * *completed*: number of jobs that returned a result
+            * *failed*: number of jobs that raised an exception
+            * *crashed*: number of jobs whose worker died
+            * *recycled*: number of workers replaced due to *max_jobs* or
+              *max_rss*
+            * *wait_time*: total seconds jobs spent queued
+            * *queued*: number of jobs waiting for a worker
+            * *workers*: number of worker processes
+            * *busy*: number of workers executing a job
+        """
+        stats = self._stats.copy()
+        stats['queued'] = len(self._queue)
+        stats['workers'] = len(self._workers)
+        stats['busy'] = len([w for w in self._workers if w.busy])
+        return stats
+
+
+    def start(self):
+        """
+        Forks all worker processes now, rather than as jobs are enqueued.
+        """
+        if self._closed:
+            raise ProcessPoolError('Process pool is closed')
+        while len(self._workers) < self._size:
+            self._spawn()
+
+
+    def _spawn(self):
+        worker = _PoolWorker(self)
+        worker.start(self._workers)
+        self._workers.append(worker)
+        return worker
+
+
+    def enqueue(self, func, args=(), kwargs=None, priority=0):
+        """
+        Adds a job to the pool's work queue.
+
+        :param func: a module-level function, or a function decorated with
+                     :func:`@kaa.processed() <kaa.processed>`
+        :param args: positional arguments for *func*
+        :param kwargs: keyword arguments for *func*
+        :param priority: determines the relative priority of the job; higher
+                         values are higher priority.
+        :type priority: int
+        :returns: an :class:`~kaa.InProgress` finished with the function's
+                  return value.
+
+        Jobs can be removed from the queue before they are started with
+        :meth:`dequeue`, or by aborting the returned InProgress.
+        """
+        if self._closed:
+            raise ProcessPoolError('Process pool is closed')
+        func = getattr(func, '_kaa_processed_key', func)
+        job = _Job(func, args, kwargs or {}, priority)
+        job.signals['abort'].connect(lambda exc: self.dequeue(job))
+        self._queue.append(job)
+        self._queue.sort(key=lambda job: job.priority, reverse=True)
+        self._stats['submitted'] += 1
+        self._schedule()
+        return job
+
+
+    def dequeue(self, job):
+        """
+        Removes the given job from the queue.
+
+        :param job: the InProgress returned by :meth:`enqueue`
+        :returns: True if the job was queued and was removed, and False if
+                  the job was not found (e.g. because it has started).
+        """
+        try:
+            self._queue.remove(job)
+        except ValueError:
+            return False
+        return True
+
+
+    def _schedule(self):
+        """
+        Hands queued jobs to idle workers, forking new ones as needed, and
+        stops workers beyond the pool size.
+        """
+        while self._queue:
+            worker = None
+            for w in self._workers:
+                if not w.busy and not w.channel.write_queue_used and not w._kill_timer.active:
+                    worker = w
+                    break
+            if not worker:
+                if len(self._workers) >= self._size:
+                    break
+                worker = self._spawn()
+            job = self._queue.pop(0)
+            self._stats['wait_time'] += time.time() - job.queued
+            worker.run(job)
+
+        idle = [w for w in self._workers if not w.busy]
+        while len(self._workers) > self._size and idle:
+            worker = idle.pop()
+            self._workers.remove(worker)
+            worker.stop()
+
+
+    def _job_done(self, worker, job, failed):
+        self._stats['failed' if failed else 'completed'] += 1
+        if (self._max_jobs and worker.jobs >= self._max_jobs) or \
+           (self._max_rss and worker.rss > self._max_rss):
+            log.debug('Recycling %s after %d jobs (rss=%d)', worker, worker.jobs, worker.rss)
+            self._stats['recycled'] += 1
+            self._workers.remove(worker)
+            worker.stop()
+        self._schedule()
+
+
+    def _worker_exited(self, worker):
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if worker.job:
+            job, worker.job = worker.job, None
+            self._stats['crashed'] += 1
+            exc = ProcessPoolError('Worker process %d died (exit code %s) while executing job' %
+                                   (worker.pid, worker.exitcode))
+            job.throw(ProcessPoolError, exc, None)
+        if not self._closed:
+            self._schedule()
+
+
+    def close(self):
+        """
+        Stops all worker processes once their current jobs are done.  Queued
+        jobs are failed with :class:`~kaa.ProcessPoolError`.
+        """
+        self._closed = True
+        queue, self._queue = self._queue, []
+        for job in queue:
+            job.throw(ProcessPoolError, ProcessPoolError('Process pool is closed'), None)
+        for worker in self._workers:
+            worker.stop()
+
+
+
+# The default pool, created on first use.
+_default_pool = None
+
+def _get_default_pool():
+    global _default_pool
+    if not _default_pool:
+        _default_pool = ProcessPool()
+    return _default_pool
+
+
+def processed(pool=None, priority=0):
+    """
+    Decorator causing the decorated function to be executed within a worker
+    process of a :class:`~kaa.ProcessPool` when invoked.
+
+    :param pool: the pool to execute the function in; if None, a default
+                 pool with one worker per CPU is used.
+    :type pool: :class:`~kaa.ProcessPool`
+    :param priority: priority for the job in the pool
+    :type priority: int
+    :returns: an :class:`~kaa.InProgress` finished with the return value of
+              the decorated function.
+
+    The decorated function must be defined at module level, and its
+    arguments and return value must be picklable::
+
+        @kaa.processed()
+        def checksum(path):
+            return hashlib.sha1(open(path).read()).hexdigest()
+
+        digest = yield checksum('/tmp/file')
+    """
+    def decorator(func):
+        key = (func.__module__, func.__name__)
+        _registry[key] = func
+
+        @wraps(func)
+        def newfunc(*args, **kwargs):
+            return (pool or _get_default_pool()).enqueue(key, args, kwargs, priority)
+
+        newfunc._kaa_processed_key = key
+        return newfunc
+
+    return decorator
@@ -42,6 +42,7 @@ dispatcher_remove = None
 
 loop = None
 step = None
+reset = None
 
 # notifier types
 ( GENERIC, QT, GTK, WX, TWISTED ) = range( 5 )
@@ -58,7 +59,7 @@ def init( model = GENERIC, **kwargs ):
 	global timer_remove
 	global socket_remove
 	global dispatcher_remove
-	global loop, step
+	global loop, step, reset
 	global IO_READ, IO_WRITE, IO_EXCEPT
 
 	if model == GENERIC:
@@ -84,6 +85,7 @@ def init( model = GENERIC, **kwargs ):
 	dispatcher_remove = nf_impl.dispatcher_remove
 	loop = nf_impl.loop
 	step = nf_impl.step
+	reset = getattr( nf_impl, 'reset', None )
 	IO_READ = nf_impl.IO_READ
 	IO_WRITE = nf_impl.IO_WRITE
 	IO_EXCEPT = nf_impl.IO_EXCEPT
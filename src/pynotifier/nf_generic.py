@@ -262,6 +262,19 @@ def step( sleep = True, external = True, simulate = False ):
 		__step_depth -= 1
 		__in_step = False
 
+def reset():
+	"""Removes all sockets, timers and dispatchers. This is useful in a
+	forked child starting its own main loop, possibly from within a callback
+	of the parent's."""
+	global __step_depth, __min_timer
+
+	for sockets in __sockets.values():
+		sockets.clear()
+	__timers.clear()
+	del dispatch.__dispatchers[:]
+	__min_timer = None
+	__step_depth = 0
+
 def loop():
 	"""Executes the 'main loop' forever by calling step in an endless loop"""
 	while 1:
@@ -92,7 +92,7 @@
 # -----------------------------------------------------------------------------
 from __future__ import absolute_import
 
-__all__ = [ 'Server', 'Client', 'expose' ]
+__all__ = [ 'Server', 'Client', 'ClientPool', 'expose', 'register_serializer', 'register_compressor' ]
 
 # python imports
 import types
@@ -100,12 +100,31 @@ import socket
 import logging
 import cPickle
 import pickle
+import marshal
 import struct
 import sys
 import hashlib
 import time
 import traceback
 import os
+import collections
+import zlib
+try:
+    import json
+except ImportError:
+    json = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
 
 # kaa imports
 import kaa
@@ -114,15 +133,112 @@ from .strutils import py3_b, bl
 from .core import Object, CoreThreading
 from .errors import make_exception_class, AsyncExceptionBase
 from .main import is_shutting_down
+from .net.pool import ConnectionPool
 
 # get logging object
 log = logging.getLogger('kaa.base.rpc')
 
 # Global constants
-RPC_PACKET_HEADER_SIZE = struct.calcsize("I4sI")
+# Packet header: sequence number, packet type, payload length.
+RPC_PACKET_HEADER = struct.Struct("I4sI")
+RPC_PACKET_HEADER_SIZE = RPC_PACKET_HEADER.size
+# Set in the payload length of packets whose payload is compressed.
+RPC_PACKET_COMPRESSED = 0x80000000
 # Protocol compatible between Python 2 and 3.  (Well, quasi-compatible, there
 # are some issues due to the str/unicode changes in 3.)
 PICKLE_PROTOCOL = 2
+# Put in the (otherwise unused) salt field of the AUTH packet by servers that
+# can negotiate the serializer; old clients ignore it.
+RPC_SERIALIZER_MARKER = bl('kaa.rpc serializers\x00')
+
+# Serializers for RPC payloads by name, each a (dumps, loads) tuple.
+_serializers = {}
+# Compressors for RPC payloads by name, each a (compress, decompress) tuple.
+_compressors = {}
+# Prefix distinguishing compressors from serializers in the negotiation.
+RPC_COMPRESSOR_PREFIX = 'z:'
+# Put in the negotiation lists by peers supporting rpc_stream().
+RPC_STREAM_FEATURE = '+stream'
+
+def register_serializer(name, dumps, loads):
+    """
+    Registers a serializer for RPC payloads, which can then be named in the
+    *serializers* argument of :class:`Server` and :class:`Client`.
+
+    :param name: name used to negotiate the serializer with the remote end
+    :type name: str
+    :param dumps: function serializing an object to a string
+    :param loads: function deserializing a string
+
+    Serializers need only support the types used in a channel's calls and
+    results: calls are sent as (name, args, kwargs) tuples.  Exceptions are
+    sent as their class name and arguments when a serializer other than
+    pickle is used.  Tuples may be deserialized as lists.
+
+    Built in are *pickle* (the default), *marshal*, *json* and, if the
+    module is available, *msgpack*.
+    """
+    if ',' in name or name.startswith(RPC_COMPRESSOR_PREFIX) or len(name) > 32:
+        raise ValueError('Invalid serializer name %r' % name)
+    _serializers[name] = (dumps, loads)
+
+register_serializer('pickle', lambda obj: cPickle.dumps(obj, PICKLE_PROTOCOL), cPickle.loads)
+register_serializer('marshal', lambda obj: marshal.dumps(obj, 2), marshal.loads)
+if json:
+    register_serializer('json', lambda obj: py3_b(json.dumps(obj)), json.loads)
+if msgpack:
+    register_serializer('msgpack', msgpack.packb, msgpack.unpackb)
+
+
+def register_compressor(name, compress, decompress):
+    """
+    Registers a compressor for RPC payloads, which can then be named in the
+    *compression* argument of :class:`Server` and :class:`Client`.
+
+    :param name: name used to negotiate the compressor with the remote end
+    :type name: str
+    :param compress: function compressing a string, called with the string
+                     and the channel's *compress_level* (None for the
+                     compressor's default)
+    :param decompress: function decompressing a string
+
+    Built in are *zlib* and, if the module is available, *lz4*.
+    """
+    if ',' in name or len(name) > 32:
+        raise ValueError('Invalid compressor name %r' % name)
+    _compressors[name] = (compress, decompress)
+
+register_compressor('zlib', lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress)
+if lz4:
+    register_compressor('lz4', lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+                        lz4.frame.decompress)
+
+
+def _exception_to_primitive(value):
+    """
+    Returns (module, class name, args) for an exception, for serializers that
+    can't represent exception objects.
+    """
+    args = []
+    for arg in getattr(value, 'args', ()):
+        if not isinstance(arg, (basestring, int, long, float, bool, type(None))):
+            arg = str(arg)
+        args.append(arg)
+    return value.__class__.__module__, value.__class__.__name__, args
+
+
+def _exception_from_primitive(module, name, args):
+    """
+    Recreates an exception from _exception_to_primitive(): builtin exceptions
+    are recreated as such, others as Exception.
+    """
+    cls = getattr(builtins, name, None)
+    if module in ('exceptions', 'builtins') and isinstance(cls, type) and issubclass(cls, BaseException):
+        try:
+            return cls(*args)
+        except Exception:
+            pass
+    return Exception('%s.%s: %s' % (module, name, ', '.join(str(arg) for arg in args)))
 
 
 class RemoteException(AsyncExceptionBase):
@@ -155,9 +271,19 @@ class Server(Object):
     however RPC calls can be issued in either direction.
 
     address specifies what address to bind the socket to, and this argument
-    must correspond to the ``bind_info`` argument of :meth:`kaa.Socket.listen`.
+    must correspond to the ``addr`` argument of :meth:`kaa.Socket.listen`.
+    In particular, it may be a bound socket shared between worker processes
+    by :class:`kaa.net.PreforkServer`.
 
     See kaa.Socket.buffer_size docstring for information on buffer_size.
+
+    serializers is the list of serializers (see :func:`register_serializer`)
+    clients may choose from, or None to allow all of them.
+
+    compression is likewise the list of compressors (see
+    :func:`register_compressor`) clients may choose from, or None to allow
+    all of them.  The *compress_level* and *compress_threshold* attributes
+    are applied to channels of clients connecting afterwards.
     """
     __kaasignals__ = {
         'client-connected':
@@ -171,9 +297,13 @@ class Server(Object):
 
             '''
     }
-    def __init__(self, address, auth_secret = '', buffer_size=None):
+    def __init__(self, address, auth_secret = '', buffer_size=None, serializers=None, compression=None):
         super(Server, self).__init__()
         self._auth_secret = py3_b(auth_secret)
+        self._serializers = serializers
+        self._compression = compression
+        self.compress_level = Channel.compress_level
+        self.compress_threshold = Channel.compress_threshold
         self._socket = kaa.Socket(buffer_size=buffer_size)
         self._socket.listen(address)
         self._socket.signals['new-client'].connect_weak(self._new_connection)
@@ -186,7 +316,10 @@ class Server(Object):
         """
         log.debug("New connection %s", client_sock)
         client_sock.buffer_size = self._socket.buffer_size
-        client = Channel(sock = client_sock, auth_secret = self._auth_secret)
+        client = Channel(sock = client_sock, auth_secret = self._auth_secret,
+                         serializers = self._serializers, compression = self._compression)
+        client.compress_level = self.compress_level
+        client.compress_threshold = self.compress_threshold
         for obj in self.objects:
             client.register(obj)
         client._send_auth_challenge()
@@ -223,11 +356,231 @@ class Server(Object):
             pass
 
 
+class _Batch(object):
+    """
+    Context manager returned by :meth:`Channel.batch`.
+    """
+    def __init__(self, channel):
+        self._channel = channel
+        self._calls = []
+        self._in_progress = None
+
+
+    def __enter__(self):
+        self._channel._batches.append(self)
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self._channel._batches.remove(self)
+        if not self._channel._batches:
+            self._channel._flush()
+        return False
+
+
+    def __inprogress__(self):
+        if not self._in_progress:
+            self._in_progress = _gather(self._calls)
+        return self._in_progress
+
+
+    @property
+    def calls(self):
+        """
+        List of InProgress objects for the calls made within the batch.
+        """
+        return self._calls[:]
+
+
+@kaa.coroutine()
+def _gather(calls):
+    """
+    Waits for the given rpc calls, returning the list of their results, or
+    raising the exception of the first failed one.
+    """
+    if calls:
+        yield kaa.InProgressAll(*calls)
+    yield [ip.result for ip in calls]
+
+
+class Stream(object):
+    """
+    Chunks produced by a remote generator, returned by
+    :meth:`Channel.rpc_stream`.
+
+    Iterating over a stream, once it has been waited for, gives InProgress
+    objects finished with each chunk as soon as it arrives::
+
+        stream = client.rpc_stream('query', sql)
+        yield kaa.inprogress(stream)
+        for ip in stream:
+            chunk = yield ip
+            if chunk is kaa.rpc.Stream.END:
+                break
+
+    Each InProgress must be waited for before the next one is taken.  As the
+    end of the stream may only be known after the last chunk was received,
+    the InProgress then waiting is finished with :attr:`Stream.END`, which
+    consumers must check for, and the iteration stops after it.  If the remote function fails before
+    producing any chunk, waiting for the stream raises the exception;
+    otherwise it is raised by the InProgress following the last chunk
+    received.
+
+    The peer only sends as many chunks ahead of the ones consumed as the
+    channel's *stream_window*, so a stream never buffers more than that.
+    """
+    # Result of the InProgress waiting for a chunk when the stream ends,
+    # which consumers must check for.
+    END = object()
+
+    def __init__(self, channel, seq, cmd, window):
+        self._channel = channel
+        self._seq = seq
+        self._cmd = cmd
+        self._window = window
+        # Chunks received and not yet taken by the consumer, and the number
+        # received so far, which is the index the next one must have.
+        self._chunks = collections.deque()
+        self._received = 0
+        # Chunks taken since credit was last granted to the peer.
+        self._consumed = 0
+        # InProgress handed out for the next chunk, not yet received.
+        self._waiting = None
+        self._done = False
+        self._exc_info = None
+        self._populate = kaa.InProgress()
+
+
+    def __inprogress__(self):
+        """
+        Wait until the first chunk arrives or the stream ends before that.
+        """
+        return self._populate
+
+
+    def __iter__(self):
+        if not self._populate.finished:
+            raise RuntimeError('Stream must be waited for before iterating over it')
+        try:
+            while self._chunks or self._exc_info or not self._done:
+                if self._waiting:
+                    raise RuntimeError('Previous chunk of the stream was not waited for')
+                ip = self._waiting = kaa.InProgress()
+                self._wake()
+                yield ip
+        finally:
+            self.close()
+
+
+    @property
+    def finished(self):
+        """
+        True if the peer has sent the whole stream, or the stream was closed.
+        """
+        return self._done
+
+
+    def close(self):
+        """
+        Stops the stream, telling the peer to stop producing chunks.
+        """
+        if self._done:
+            return
+        self._done = True
+        self._chunks.clear()
+        if self._waiting:
+            self._wake()
+        if not self._populate.finished:
+            self._populate.finish(self)
+        if self._channel._streams_in.pop(self._seq, None) and self._channel.connected:
+            self._channel._send_packet(self._seq, 'STOP', bl(''))
+
+
+    def _consume(self):
+        """
+        Counts a chunk taken by the consumer, granting the peer credit for
+        more once half the window has been taken.
+        """
+        self._consumed += 1
+        if self._seq is not None and not self._done and self._consumed >= max(1, self._window // 2):
+            self._channel._send_packet(self._seq, 'CRED', self._channel._dumps(self._consumed))
+            self._consumed = 0
+
+
+    def _feed(self, index, chunk):
+        if index != self._received:
+            raise ValueError('Stream chunk %d received, expected %d' % (index, self._received))
+        self._received += 1
+        self._chunks.append(chunk)
+        self._wake()
+
+
+    def _end(self, exc_info=None):
+        self._done = True
+        self._exc_info = exc_info
+        self._wake()
+
+
+    def _feed_all(self, chunks):
+        """
+        Feeds the result of a plain call, used when the peer can't stream.
+        """
+        for chunk in chunks:
+            self._feed(self._received, chunk)
+        self._end()
+
+
+    def _throw(self, tp, exc, tb):
+        self._end((tp, exc, tb))
+        # Handled by the stream's consumer.
+        return False
+
+
+    def _wake(self):
+        if not self._populate.finished:
+            if self._chunks or not self._exc_info:
+                self._populate.finish(self)
+            else:
+                # Failed without producing anything.
+                exc_info, self._exc_info = self._exc_info, None
+                self._populate.throw(*exc_info)
+        elif self._waiting and (self._chunks or self._done):
+            ip, self._waiting = self._waiting, None
+            if self._chunks:
+                chunk = self._chunks.popleft()
+                self._consume()
+                ip.finish(chunk)
+            elif self._exc_info:
+                exc_info, self._exc_info = self._exc_info, None
+                ip.throw(*exc_info)
+            else:
+                ip.finish(Stream.END)
+
+
+class _OutStream(object):
+    """
+    State of a stream being sent to the peer by Channel._send_stream().
+    """
+    def __init__(self, credit):
+        self.credit = credit
+        self.stopped = False
+        self.wakeup = None
+
+    def wake(self):
+        if self.wakeup:
+            ip, self.wakeup = self.wakeup, None
+            ip.finish(None)
+
+
 class Channel(Object):
     """
     Channel object for two point communication, implementing the kaa.rpc
     protocol. The server creates a Channel object for each incoming client
     connection.  Client itself is also a Channel.
+
+    Packets sent within the same main loop iteration, such as many calls
+    made in a loop, or the replies to many calls received at once, are
+    written to the socket together.
     """
     __kaasignals__ = {
         'closed':
@@ -246,10 +599,27 @@ class Channel(Object):
     }
 
     channel_type = 'server'
-
-    def __init__(self, sock, auth_secret):
+    # Number of chunks of a stream the peer may send ahead of the consumer.
+    stream_window = 16
+    # Level passed to the compressor (None for its default), and the size
+    # from which payloads are compressed.
+    compress_level = None
+    compress_threshold = 4096
+
+    def __init__(self, sock, auth_secret, serializers=None, compression=None):
         super(Channel, self).__init__()
         self._socket = sock
+        # Serializers we accept, in order of preference (None for all), and
+        # the one in use, which is pickle until negotiated otherwise.
+        self._serializers = serializers
+        self._serializer = None
+        self._set_serializer('pickle')
+        # Likewise for compressors, of which none is used unless negotiated.
+        self._compression = compression
+        self._compressor = None
+        self._compress = self._decompress = None
+        self._compress_stats = dict(compressed=0, skipped=0, bytes_compressed=0, bytes_saved=0,
+                                    compress_time=0.0, decompressed=0, decompress_time=0.0)
         self._authenticated = False
         self._connect_inprogress = kaa.InProgress()
         # We start off in an unauthenticated state; set chunk size to something
@@ -257,10 +627,28 @@ class Channel(Object):
         self._socket.chunk_size = 1024
         # Buffer containing packets deferred until after authentication.
         self._write_buffer_deferred = []
+        # Packets to be written together at the end of the main loop
+        # iteration (or batch), and their total size.
+        self._write_pending = []
+        self._write_pending_size = 0
+        self._flush_timer = kaa.WeakOneShotTimer(self._flush)
+        # InProgress of the last socket write, finished once everything
+        # flushed so far has been written.
+        self._flushed = None
+        # Active batch() contexts.
+        self._batches = []
+        # Chunks read from the socket not yet parsed, and their total size.
         self._read_buffer = []
+        self._read_buffered = 0
         self._callbacks = {}
         self._next_seq = 1
         self._rpc_in_progress = {}
+        # Streams we receive (Stream objects) and send (_OutStream objects)
+        # by call sequence number.
+        self._streams_in = {}
+        self._streams_out = {}
+        # Whether the peer supports streams, which is negotiated.
+        self._peer_streams = False
         self._auth_secret = py3_b(auth_secret)
         self._pending_challenge = None
 
@@ -277,6 +665,71 @@ class Channel(Object):
         return self._socket.connected and self._connect_inprogress.finished
 
 
+    @property
+    def serializer(self):
+        """
+        Name of the serializer used for payloads on this channel, which is
+        negotiated during authentication.
+        """
+        return self._serializer
+
+
+    def _set_serializer(self, name):
+        self._serializer = name
+        self._dumps, self._loads = _serializers[name]
+
+
+    def _accepted_serializers(self):
+        """
+        Returns the names of serializers we accept, in order of preference.
+        """
+        if self._serializers is None:
+            return ['pickle'] + sorted(name for name in _serializers if name != 'pickle')
+        return [name for name in self._serializers if name in _serializers]
+
+
+    @property
+    def compressor(self):
+        """
+        Name of the compressor used for large payloads on this channel, or
+        None if the peers didn't agree on one.
+        """
+        return self._compressor
+
+
+    @property
+    def compress_stats(self):
+        """
+        A dict of metrics for payload compression on this channel:
+
+            * *compressed*: number of packets sent compressed
+            * *skipped*: number of packets over the threshold sent as is
+              because compression didn't make them smaller
+            * *bytes_compressed*: total size of the compressed packets'
+              payloads before compression
+            * *bytes_saved*: bytes not sent thanks to compression
+            * *compress_time*: seconds spent compressing, including skipped
+              packets
+            * *decompressed*: number of compressed packets received
+            * *decompress_time*: seconds spent decompressing
+        """
+        return self._compress_stats.copy()
+
+
+    def _set_compressor(self, name):
+        self._compressor = name
+        self._compress, self._decompress = _compressors[name]
+
+
+    def _accepted_compressors(self):
+        """
+        Returns the names of compressors we accept, in order of preference.
+        """
+        if self._compression is None:
+            return sorted(_compressors)
+        return [name for name in self._compression if name in _compressors]
+
+
     def register(self, obj):
         """
         Registers one or more previously exposed callables to the peer
@@ -316,17 +769,106 @@ class Channel(Object):
         self._next_seq += 1
         # create InProgress object
         callback = kwargs.pop('_kaa_rpc_callback', kaa.InProgress())
-        payload = cPickle.dumps((cmd, args, kwargs), PICKLE_PROTOCOL)
+        payload = self._dumps((cmd, args, kwargs))
         self._send_packet(seq, 'CALL', payload)
         # callback with error handler
         self._rpc_in_progress[seq] = (callback, cmd)
+        for batch in self._batches:
+            batch._calls.append(callback)
         return callback
 
 
+    def rpc_stream(self, cmd, *args, **kwargs):
+        """
+        Call the remote command, which returns an iterable such as a
+        generator, and return a :class:`~kaa.rpc.Stream` of the chunks it
+        yields.
+
+        The chunks are sent one per packet as they are produced, so neither
+        side holds the whole result.  The remote command may be a plain
+        generator, which can also yield InProgress objects whose results are
+        sent when finished, or a :func:`kaa.generator`.
+
+        Unlike a :class:`kaa.Generator`, the InProgress waited for when the
+        stream ends is finished with :attr:`Stream.END` rather than a chunk,
+        as chunks are delivered before the end of the stream is known.
+        Consumers must check for it::
+
+            stream = client.rpc_stream('query', sql)
+            yield kaa.inprogress(stream)
+            for ip in stream:
+                chunk = yield ip
+                if chunk is kaa.rpc.Stream.END:
+                    break
+
+        If the peer doesn't support streams, the command is called with
+        :meth:`rpc` and the stream fed with the list it returns.
+        """
+        if not CoreThreading.is_mainthread():
+            return kaa.MainThreadCallable(self.rpc_stream)(cmd, *args, **kwargs).wait()
+
+        if not self.connected:
+            raise NotConnectedError()
+
+        if not self._peer_streams:
+            stream = Stream(self, None, cmd, self.stream_window)
+            ip = self.rpc(cmd, *args, **kwargs)
+            ip.connect(stream._feed_all)
+            ip.exception.connect(stream._throw)
+            return stream
+
+        seq = self._next_seq
+        self._next_seq += 1
+        stream = Stream(self, seq, cmd, self.stream_window)
+        payload = self._dumps((cmd, args, kwargs, self.stream_window))
+        self._send_packet(seq, 'SCAL', payload)
+        self._streams_in[seq] = stream
+        return stream
+
+
+    def rpc_many(self, cmd, calls):
+        """
+        Calls the remote command once for each set of arguments, sending all
+        calls in a single write.
+
+        :param cmd: name of the remote command
+        :param calls: sequence of positional argument tuples, one per call
+        :returns: an InProgress finished with the list of results, in order,
+                  or raising the exception of the first call that failed.
+        """
+        with self.batch() as batch:
+            for args in calls:
+                self.rpc(cmd, *args)
+        return kaa.inprogress(batch)
+
+
+    def batch(self):
+        """
+        Returns a context manager within which calls are queued, and written
+        to the socket together when the outermost batch exits::
+
+            with client.batch() as batch:
+                for item in items:
+                    client.rpc('process', item)
+            results = yield kaa.inprogress(batch)
+
+        The batch passed to :func:`kaa.inprogress` gives an InProgress
+        finished with the list of results of the calls made within it, as
+        :meth:`rpc_many`.  The individual calls' InProgress objects are also
+        returned by :meth:`rpc` as usual, and available from the batch's
+        *calls* attribute.
+
+        Without a batch, calls made during the same main loop iteration are
+        also written together, at the end of it.  Batches avoid the delay.
+        """
+        return _Batch(self)
+
+
     def close(self):
         """
         Forcefully close the RPC channel.
         """
+        self._flush()
         self._socket.close()
 
 
@@ -336,9 +878,34 @@ class Channel(Object):
 
     def _write(self, data):
         """
-        Writes data to the channel.
+        Queues data to be written to the channel by _flush().
+        """
+        if self._socket.write_queue_used + self._write_pending_size + len(data) > self._socket.queue_size:
+            # Raise now, as the socket would when the data is flushed.
+            raise ValueError('Data would exceed write queue limit')
+        self._write_pending.append(data)
+        self._write_pending_size += len(data)
+        if not self._batches and not self._flush_timer.active:
+            self._flush_timer.start(0)
+
+
+    def _flush(self):
         """
-        cb = self._socket.write(data).exception.connect_weak(self._handle_close, False, write_failed=True)
+        Writes all queued data to the channel.
+        """
+        self._flush_timer.stop()
+        if not self._write_pending or not self._socket:
+            return
+        data = bl('').join(self._write_pending)
+        self._write_pending = []
+        self._write_pending_size = 0
+        try:
+            ip = self._socket.write(data)
+        except IOError:
+            # Socket closed meanwhile.
+            return self._handle_close(False, write_failed=True)
+        self._flushed = ip
+        cb = ip.exception.connect_weak(self._handle_close, False, write_failed=True)
         cb.ignore_caller_args = True
 
 
@@ -358,6 +925,9 @@ class Channel(Object):
             log.error('rpc peer closed before authentication completed; probably incorrect shared secret.')
 
         log.debug('close socket for %s', self)
+        self._flush_timer.stop()
+        self._write_pending = []
+        self._write_pending_size = 0
         self.signals['closed'].emit()
         if reset_signals:
             self.signals = {}
@@ -370,6 +940,12 @@ class Channel(Object):
                 # Raise an error if this happens during runtime or if
                 # someone wants to get the result or exception.
                 callback.throw(IOError, IOError('kaa.rpc channel closed'), None)
+        while self._streams_in:
+            self._streams_in.popitem()[1]._end((IOError, IOError('kaa.rpc channel closed'), None))
+        while self._streams_out:
+            stream = self._streams_out.popitem()[1]
+            stream.stopped = True
+            stream.wake()
 
         # Return False for reason explained above.
         return False
@@ -381,11 +957,12 @@ class Channel(Object):
         chunk size is 1k; when authenticated it is 1M.
         """
         self._read_buffer.append(data)
+        self._read_buffered += len(data)
         # Before we start into the loop, make sure we have enough data for
         # a full packet.  For very large packets (if we just received a huge
         # pickled object), this saves the string.join() which can be very
         # expensive.  (This is the reason we use a list for our read buffer.)
-        buflen = sum(len(x) for x in self._read_buffer)
+        buflen = self._read_buffered
         if buflen < RPC_PACKET_HEADER_SIZE:
             return
 
@@ -407,38 +984,49 @@ class Channel(Object):
 
         # Make sure the the buffer holds enough data as indicated by the
         # payload size in the header.
-        header = self._read_buffer[0][:RPC_PACKET_HEADER_SIZE]
-        payload_len = struct.unpack("I4sI", header)[2]
+        payload_len = RPC_PACKET_HEADER.unpack_from(self._read_buffer[0])[2] & ~RPC_PACKET_COMPRESSED
         if buflen < payload_len + RPC_PACKET_HEADER_SIZE:
             return
 
         # At this point we know we have enough data in the buffer for the
-        # packet, so we merge the array into a single buffer.
-        strbuf = bl('').join(self._read_buffer)
+        # packet, so we merge the array into a single buffer.  We take it
+        # over in case a packet handler reenters the main loop and we're
+        # called again.
+        strbuf = self._read_buffer[0] if len(self._read_buffer) == 1 else bl('').join(self._read_buffer)
         self._read_buffer = []
-        while True:
-            if len(strbuf) <= RPC_PACKET_HEADER_SIZE:
-                if len(strbuf) > 0:
-                    self._read_buffer.append(py3_b(strbuf))
-                break
-            header = strbuf[:RPC_PACKET_HEADER_SIZE]
-            seq, packet_type, payload_len = struct.unpack("I4sI", header)
-            if len(strbuf) < payload_len + RPC_PACKET_HEADER_SIZE:
+        self._read_buffered = 0
+        # Walk the buffer by offset rather than slicing off each packet,
+        # which would copy the rest of the buffer every time.
+        offset = 0
+        while buflen - offset >= RPC_PACKET_HEADER_SIZE:
+            seq, packet_type, payload_len = RPC_PACKET_HEADER.unpack_from(strbuf, offset)
+            compressed = payload_len & RPC_PACKET_COMPRESSED
+            payload_len &= ~RPC_PACKET_COMPRESSED
+            start = offset + RPC_PACKET_HEADER_SIZE
+            if buflen - start < payload_len:
                 # We've also received portion of another packet that we
-                # haven't fully received yet.  Put back to the buffer what
-                # we have so far, and we can exit the loop.
-                self._read_buffer.append(strbuf)
+                # haven't fully received yet.
                 break
-
-            # Grab the payload for this packet, and shuffle strbuf to the
-            # next packet.
-            payload = strbuf[RPC_PACKET_HEADER_SIZE:RPC_PACKET_HEADER_SIZE + payload_len]
-            strbuf = strbuf[RPC_PACKET_HEADER_SIZE + payload_len:]
+            offset = start + payload_len
+            payload = strbuf[start:offset]
+            if compressed:
+                try:
+                    payload = self._decompress_payload(payload)
+                except Exception, e:
+                    # Also the case before authentication.
+                    log.error('Undecodable compressed packet from remote (%s); disconnecting', e)
+                    self.close()
+                    return
             if not self._authenticated:
                 self._handle_packet_before_auth(seq, packet_type, payload)
             else:
                 self._handle_packet_after_auth(seq, packet_type, payload)
 
+        if offset < buflen:
+            # Put back what's left, ahead of anything read meanwhile.
+            self._read_buffer.insert(0, py3_b(strbuf[offset:]))
+            self._read_buffered += buflen - offset
+
 
     def _send_packet(self, seq, packet_type, payload):
         """
@@ -446,7 +1034,16 @@ class Channel(Object):
         """
         if not self._socket:
             return
-        header = struct.pack("I4sI", seq, packet_type, len(payload))
+        if len(payload) >= RPC_PACKET_COMPRESSED:
+            # The top bit of the length field flags compressed payloads.
+            raise ValueError('kaa.rpc payload of %d bytes exceeds the maximum of %d' %
+                             (len(payload), RPC_PACKET_COMPRESSED - 1))
+        if self._compress and len(payload) >= self.compress_threshold and bl(packet_type) != bl('RESP'):
+            payload, compressed = self._compress_payload(payload)
+            if compressed:
+                header = RPC_PACKET_HEADER.pack(seq, packet_type, len(payload) | RPC_PACKET_COMPRESSED)
+                return self._write(header + payload)
+        header = RPC_PACKET_HEADER.pack(seq, packet_type, len(payload))
         if not self._authenticated and bl(packet_type) not in (bl('RESP'), bl('AUTH')):
             log.debug('delay packet %s', packet_type)
             self._write_buffer_deferred.append(header + payload)
@@ -454,12 +1051,48 @@ class Channel(Object):
             self._write(header + payload)
 
 
+    def _compress_payload(self, payload):
+        """
+        Compresses the payload, returning it and whether it was compressed,
+        which it isn't if compression doesn't make it smaller.
+        """
+        stats = self._compress_stats
+        t0 = time.time()
+        compressed = self._compress(payload, self.compress_level)
+        stats['compress_time'] += time.time() - t0
+        if len(compressed) >= len(payload):
+            stats['skipped'] += 1
+            return payload, False
+        stats['compressed'] += 1
+        stats['bytes_compressed'] += len(payload)
+        stats['bytes_saved'] += len(payload) - len(compressed)
+        return compressed, True
+
+
+    def _decompress_payload(self, payload):
+        """
+        Decompresses the payload of a packet flagged as compressed.
+        """
+        if not self._decompress:
+            raise ValueError('no compressor negotiated')
+        t0 = time.time()
+        payload = self._decompress(payload)
+        self._compress_stats['decompress_time'] += time.time() - t0
+        self._compress_stats['decompressed'] += 1
+        return payload
+
+
     def _send_answer(self, answer, seq):
         """
         Send delayed answer when callback returns InProgress.
         """
-        payload = cPickle.dumps(answer, PICKLE_PROTOCOL)
-        self._send_packet(seq, 'RETN', payload)
+        try:
+            payload = self._dumps(answer)
+            self._send_packet(seq, 'RETN', payload)
+        except Exception:
+            # Not supported by the serializer, or too large, so tell the
+            # caller.
+            return self._send_exception(*sys.exc_info() + (seq,))
 
 
     def _send_exception(self, type, value, tb, seq):
@@ -467,25 +1100,93 @@ class Channel(Object):
         Send delayed exception when callback returns InProgress.
         """
         stack = traceback.extract_tb(tb)
-        try:
-            payload = cPickle.dumps((value, stack), PICKLE_PROTOCOL)
-        except cPickle.UnpickleableError:
-            payload = cPickle.dumps((Exception(py3_b(value)), stack), PICKLE_PROTOCOL)
+        if self._serializer == 'pickle':
+            try:
+                payload = self._dumps((value, stack))
+            except cPickle.UnpickleableError:
+                payload = self._dumps((Exception(py3_b(value)), stack))
+        else:
+            # Other serializers can't represent exception objects.
+            stack = [list(frame) for frame in stack]
+            try:
+                payload = self._dumps((_exception_to_primitive(value), stack))
+            except Exception:
+                payload = self._dumps((('exceptions', 'Exception', [str(value)]), stack))
         self._send_packet(seq, 'EXCP', payload)
 
 
+    @kaa.coroutine()
+    def _send_stream(self, seq, result, window):
+        """
+        Sends the chunks of an iterable returned by a function called with
+        rpc_stream(), as long as the peer has granted credit for them.
+        """
+        stream = self._streams_out[seq] = _OutStream(window)
+        iterator = None
+        try:
+            if isinstance(result, kaa.InProgress):
+                # Coroutine or kaa.generator()
+                result = yield result
+            if isinstance(result, basestring) or not hasattr(result, '__iter__'):
+                raise TypeError('%s is not iterable' % type(result).__name__)
+            iterator = iter(result)
+            index = 0
+            while True:
+                while stream.credit <= 0 and not stream.stopped:
+                    stream.wakeup = kaa.InProgress()
+                    yield stream.wakeup
+                if stream.stopped:
+                    break
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    self._send_packet(seq, 'SEND', self._dumps(index))
+                    break
+                if isinstance(chunk, kaa.InProgress):
+                    chunk = yield chunk
+                    if stream.stopped:
+                        break
+                payload = self._dumps((index, chunk))
+                size = RPC_PACKET_HEADER_SIZE + len(payload)
+                if self._socket.write_queue_used + self._write_pending_size + size > self._socket.queue_size:
+                    # Large chunks: wait for what is queued to be written
+                    # rather than exceed the write queue limit.
+                    self._flush()
+                    if self._flushed and not self._flushed.finished:
+                        yield self._flushed
+                    if stream.stopped:
+                        break
+                self._send_packet(seq, 'ITEM', payload)
+                stream.credit -= 1
+                index += 1
+        except Exception:
+            if not stream.stopped:
+                self._send_exception(*sys.exc_info() + (seq,))
+        finally:
+            self._streams_out.pop(seq, None)
+            if stream.stopped and hasattr(iterator, 'close'):
+                # Let the generator clean up.
+                iterator.close()
+
+
     def _handle_packet_after_auth(self, seq, packet_type, payload):
         """
         Handle incoming packet (called from _handle_write) after
         authentication has been completed.
         """
-        if packet_type == bl('CALL'):
+        if packet_type in (bl('CALL'), bl('SCAL')):
             # Remote function call, send answer
-            function, args, kwargs = cPickle.loads(payload)
+            if packet_type == bl('CALL'):
+                function, args, kwargs = self._loads(payload)
+            else:
+                function, args, kwargs, window = self._loads(payload)
             try:
                 if self._callbacks[function]._kaa_rpc_param[0]:
                     args = [ self ] + list(args)
                 result = self._callbacks[function](*args, **kwargs)
+                if packet_type == bl('CALL') and isinstance(result, types.GeneratorType):
+                    # Not called with rpc_stream(), so send all chunks at once.
+                    result = list(result)
             except Exception, e:
                 #log.exception('Exception in rpc function "%s"', function)
                 if not function in self._callbacks:
@@ -493,7 +1194,9 @@ class Channel(Object):
                 self._send_exception(*sys.exc_info() + (seq,))
                 return True
 
-            if isinstance(result, kaa.InProgress):
+            if packet_type == bl('SCAL'):
+                self._send_stream(seq, result, window)
+            elif isinstance(result, kaa.InProgress):
                 result.connect(self._send_answer, seq)
                 result.exception.connect(self._send_exception, seq)
             else:
@@ -503,7 +1206,7 @@ class Channel(Object):
 
         if packet_type == bl('RETN'):
             # RPC return
-            payload = cPickle.loads(payload)
+            payload = self._loads(payload)
             callback, cmd = self._rpc_in_progress.get(seq)
             if callback is None:
                 return True
@@ -514,9 +1217,16 @@ class Channel(Object):
         if packet_type == bl('EXCP'):
             # Exception for remote call
             try:
-                exc_value, stack = cPickle.loads(payload)
+                exc_value, stack = self._loads(payload)
+                if self._serializer != 'pickle':
+                    exc_value = _exception_from_primitive(*exc_value)
             except Exception, e:
                 exc_value, stack = e, ''
+            if seq in self._streams_in:
+                stream = self._streams_in.pop(seq)
+                remote_exc = RemoteException(exc_value, stack, stream._cmd)
+                stream._end((remote_exc.__class__, remote_exc, None))
+                return True
             callback, cmd = self._rpc_in_progress.get(seq)
             if callback is None:
                 return True
@@ -525,6 +1235,44 @@ class Channel(Object):
             callback.throw(remote_exc.__class__, remote_exc, None)
             return True
 
+        if packet_type == bl('ITEM'):
+            # Chunk of a stream
+            stream = self._streams_in.get(seq)
+            if stream is None:
+                # Closed by the consumer.
+                return True
+            try:
+                stream._feed(*self._loads(payload))
+            except Exception:
+                # Tell the peer to stop sending, as Stream.close() would.
+                del self._streams_in[seq]
+                stream._end(sys.exc_info())
+                self._send_packet(seq, 'STOP', bl(''))
+            return True
+
+        if packet_type == bl('SEND'):
+            # End of a stream
+            stream = self._streams_in.pop(seq, None)
+            if stream is not None:
+                stream._end()
+            return True
+
+        if packet_type == bl('CRED'):
+            # Credit for more chunks of a stream we send
+            stream = self._streams_out.get(seq)
+            if stream is not None:
+                stream.credit += self._loads(payload)
+                stream.wake()
+            return True
+
+        if packet_type == bl('STOP'):
+            # Stream we send closed by the consumer
+            stream = self._streams_out.get(seq)
+            if stream is not None:
+                stream.stopped = True
+                stream.wake()
+            return True
+
         log.error('unknown packet type %s', packet_type)
         return True
 
@@ -580,6 +1328,17 @@ class Channel(Object):
         Step 1 happens when a new connection is initiated.  Steps 2-4 happen in
         this function.  3 packets are sent in this handshake (steps 1-3).
 
+        The serializer for payloads is negotiated along the way.  In step 1
+        the server puts RPC_SERIALIZER_MARKER in the salt field (which is
+        unused in AUTH packets).  If the client sees it, it appends the names
+        of the serializers it accepts, comma separated and in order of
+        preference, to its RESP packet in step 2, and the server appends its
+        choice to its RESP packet in step 3.  Without negotiation (peers
+        predating it), pickle is used.  The compressor is negotiated the same
+        way, with its names prefixed by RPC_COMPRESSOR_PREFIX in the same
+        lists, which peers unaware of compression ignore.  Support for
+        streams is advertised by RPC_STREAM_FEATURE in both lists.
+
         WARNING: once authentication succeeds, there is implicit full trust.
         There is no security after that point, and it should be assumed that
         the client can invoke arbitrary calls on the server, and vice versa,
@@ -614,8 +1373,10 @@ class Channel(Object):
         try:
             # Payload could safely be longer than 20+20+20 bytes, but if it
             # is, something isn't quite right.  We'll be paranoid and
-            # disconnect unless it's exactly 60 bytes.
-            assert(len(payload) == 60)
+            # disconnect unless it's exactly 60 bytes, plus the serializers
+            # for RESP packets.
+            assert(len(payload) == 60 or (packet_type == bl('RESP') and 60 < len(payload) <= 60 + 1024))
+            payload, serializers = payload[:60], payload[60:]
 
             # Unpack the auth packet payload into three separate 20 byte
             # strings: the challenge, response, and salt.  If challenge is
@@ -624,6 +1385,7 @@ class Channel(Object):
             # be NULL, and the salt is used along with the previously sent
             # challenge to validate the response.
             challenge, response, salt = struct.unpack("20s20s20s", payload)
+            salt_received = salt
         except (AssertionError, struct.error):
             return panic(IOError('Malformed authentication packet from remote; disconnecting.'))
 
@@ -640,10 +1402,17 @@ class Channel(Object):
                 self.close()
                 return
 
-            # Otherwise send the response, plus a challenge of our own.
+            # Otherwise send the response, plus a challenge of our own, plus
+            # the serializers and compressors we accept if the server can
+            # negotiate.
             response, salt = self._get_challenge_response(challenge)
             self._pending_challenge = self._get_rand_value()
             payload = struct.pack("20s20s20s", self._pending_challenge, response, salt)
+            if salt_received == RPC_SERIALIZER_MARKER:
+                offer = self._accepted_serializers()
+                offer.extend(RPC_COMPRESSOR_PREFIX + name for name in self._accepted_compressors())
+                offer.append(RPC_STREAM_FEATURE)
+                payload += py3_b(','.join(offer))
             self._send_packet(seq, 'RESP', payload)
             log.debug('Got initial challenge from server, sending response.')
             return
@@ -669,9 +1438,25 @@ class Channel(Object):
             if response != expected_response:
                 return panic(IOError('Peer failed authentication.'))
 
-            # Challenge response was good, so the remote is considered
-            # authenticated now.  We increase the chunk size on the socket
-            # so we read more at once.
+            # Challenge response was good.  Now settle on the serializer: the
+            # client's (step 3) or server's (step 4) list, or pickle.  The
+            # list may also name compressors, of which we settle on the first
+            # one we accept, if any.
+            accepted = self._accepted_serializers()
+            offered = serializers.decode('ascii', 'replace').split(',') if serializers else ['pickle']
+            common = [name for name in offered if name in accepted]
+            if not common:
+                return panic(IOError('No serializer in common with peer (offered %s); disconnecting.' % offered))
+            self._set_serializer(common[0])
+            self._peer_streams = RPC_STREAM_FEATURE in offered
+            accepted = self._accepted_compressors()
+            offered = [name[len(RPC_COMPRESSOR_PREFIX):] for name in offered if name.startswith(RPC_COMPRESSOR_PREFIX)]
+            common = [name for name in offered if name in accepted]
+            if common:
+                self._set_compressor(common[0])
+
+            # The remote is considered authenticated now.  We increase the
+            # chunk size on the socket so we read more at once.
             self._authenticated = True
             self._socket.chunk_size = 1024*1024
             log.debug('Valid response received, remote authenticated.')
@@ -688,6 +1473,12 @@ class Channel(Object):
             if len(challenge.strip(bl('\x00'))) != 0:
                 response, salt = self._get_challenge_response(challenge)
                 payload = struct.pack("20s20s20s", '', response, salt)
+                if serializers:
+                    payload += py3_b(self._serializer)
+                    if self._compressor:
+                        payload += py3_b(',' + RPC_COMPRESSOR_PREFIX + self._compressor)
+                    if self._peer_streams:
+                        payload += py3_b(',' + RPC_STREAM_FEATURE)
                 self._send_packet(seq, 'RESP', payload)
                 log.debug('Sent response to challenge from client.')
 
@@ -720,7 +1511,7 @@ class Channel(Object):
         Send challenge to remote end to initiate authentication handshake.
         """
         self._pending_challenge = self._get_rand_value()
-        payload = struct.pack("20s20s20s", self._pending_challenge, '', '')
+        payload = struct.pack("20s20s20s", self._pending_challenge, '', RPC_SERIALIZER_MARKER)
         self._send_packet(0, 'AUTH', payload)
 
 
@@ -779,12 +1570,23 @@ CONNECTED = 'CONNECTED'
 class Client(Channel):
     """
     RPC client to be connected to a server.
+
+    serializers is the list of serializers (see :func:`register_serializer`)
+    to use for payloads in order of preference, of which the first one the
+    server accepts is chosen.  The default is pickle only, which is also what
+    servers that can't negotiate use.
+
+    compression is likewise the list of compressors (see
+    :func:`register_compressor`) to use for payloads of at least
+    *compress_threshold* bytes, in order of preference.  The default is
+    none.
     """
 
     channel_type = 'client'
 
-    def __init__(self, address, auth_secret = '', buffer_size = None, retry = None):
-        super(Client, self).__init__(kaa.Socket(buffer_size), auth_secret)
+    def __init__(self, address, auth_secret = '', buffer_size = None, retry = None, serializers = ('pickle',),
+                 compression = ()):
+        super(Client, self).__init__(kaa.Socket(buffer_size), auth_secret, serializers, compression)
         self._socket.connect(address).exception.connect(self._handle_refused)
         self.monitoring = False
         if retry is not None:
@@ -832,7 +1634,12 @@ class Client(Channel):
             # reset variables
             self._authenticated = False
             self._pending_challenge = None
+            self._set_serializer('pickle')
+            self._compressor = None
+            self._compress = self._decompress = None
+            self._peer_streams = False
             self._read_buffer = []
+            self._read_buffered = 0
             self.status = CONNECTING
             self._socket = kaa.Socket(buffer_size)
             self._socket.chunk_size = 1024
@@ -845,6 +1652,31 @@ class Client(Channel):
 connect = Client
 
 
+class ClientPool(ConnectionPool):
+    """
+    Pool of authenticated :class:`Client` channels, keyed by address and
+    auth secret.
+
+    :meth:`~kaa.net.ConnectionPool.checkout` takes the same arguments as
+    :class:`Client` (except *retry*) and returns an InProgress finished once
+    the channel is connected and authenticated, so only the first checkout
+    for a given server pays for the connection and handshake::
+
+        pool = kaa.rpc.ClientPool(max_idle=2)
+        client = yield pool.checkout('/tmp/server.sock', 'secret')
+        try:
+            result = yield client.rpc('do_something', 6)
+        finally:
+            pool.checkin(client)
+
+    Because channels are shared between users, objects registered with a
+    pooled client remain registered after it is checked in.
+    """
+    def _create(self, address, auth_secret='', buffer_size=None, serializers=('pickle',), compression=()):
+        return kaa.inprogress(Client(address, auth_secret, buffer_size, serializers=serializers,
+                                     compression=compression))
+
+
 def expose(command=None, add_client=False, coroutine=False):
     """
     Decorator to expose a function. If add_client is True, the client
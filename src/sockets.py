@@ -24,7 +24,7 @@
 # -----------------------------------------------------------------------------
 from __future__ import absolute_import
 
-__all__ = [ 'Socket', 'SocketError' ]
+__all__ = [ 'Socket', 'DatagramSocket', 'SocketError' ]
 
 import sys
 import errno
@@ -32,14 +32,20 @@ import os
 import re
 import socket
 import logging
+import struct
 import ctypes.util
 import collections
 
 from .errors import SocketError
 from .utils import property, tempfile
+from .strutils import BYTES_TYPE
+from .callable import WeakCallable
+from .core import Object
 from .thread import threaded
+from .timer import OneShotTimer, WeakOneShotTimer
 from .async import InProgress
-from .io import IO_READ, IO_WRITE, IOChannel, WeakIOMonitor
+from .coroutine import coroutine
+from .io import IO_READ, IO_WRITE, IOChannel, IOMonitor, WeakIOMonitor
 
 # get logging object
 log = logging.getLogger('kaa.base.sockets')
@@ -47,6 +53,27 @@ log = logging.getLogger('kaa.base.sockets')
 
 TIMEOUT_SENTINEL = getattr(socket, '_GLOBAL_DEFAULT_TIMEOUT', object())
 
+# Errors from accept() that mean the pending connection was lost (aborted by
+# the peer), or could not be accepted due to resource exhaustion, in which
+# case it stays in the kernel backlog.
+ACCEPT_ABORTED_ERRORS = (errno.ECONNABORTED, errno.EPROTO)
+ACCEPT_RESOURCE_ERRORS = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+# Seconds a listening socket stops accepting after a resource error.
+ACCEPT_RETRY_DELAY = 0.1
+
+# Python 2 doesn't expose SO_REUSEPORT, which Linux has supported since 3.9.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+
+def _resolver():
+    """
+    Returns the default caching resolver (the one used by kaa.net.resolve()).
+
+    It is imported on demand, as kaa.net imports kaa.base modules.
+    """
+    from .net import get_resolver
+    return get_resolver()
+
 
 # Implement functions for converting between interface names and indexes.
 # Unfortunately these functions are not provided by the standard Python
@@ -117,6 +144,258 @@ def if_indextoname(idx):
 
 
 
+# Python 2 doesn't provide sendmsg() and recvmsg(), which are needed to pass
+# file descriptors over unix sockets, so they are also implemented with ctypes.
+# The structures below follow the Linux layout.
+
+SCM_RIGHTS = getattr(socket, 'SCM_RIGHTS', 1)
+SO_DOMAIN = getattr(socket, 'SO_DOMAIN', 39 if sys.platform.startswith('linux') else None)
+SO_ACCEPTCONN = getattr(socket, 'SO_ACCEPTCONN', 30 if sys.platform.startswith('linux') else None)
+MSG_CTRUNC = getattr(socket, 'MSG_CTRUNC', 8)
+MSG_CMSG_CLOEXEC = getattr(socket, 'MSG_CMSG_CLOEXEC', 0x40000000 if sys.platform.startswith('linux') else 0)
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _cmsghdr(ctypes.Structure):
+    _fields_ = [('cmsg_len', ctypes.c_size_t), ('cmsg_level', ctypes.c_int), ('cmsg_type', ctypes.c_int)]
+
+
+def _cmsg_align(n):
+    align = ctypes.sizeof(ctypes.c_size_t)
+    return (n + align - 1) & ~(align - 1)
+
+
+def _cmsg_space(n):
+    return _cmsg_align(ctypes.sizeof(_cmsghdr)) + _cmsg_align(n)
+
+
+def _libc_msg(name):
+    """
+    Returns the sendmsg or recvmsg function from libc.
+    """
+    if not sys.platform.startswith('linux'):
+        raise NotImplementedError('File descriptor passing is only supported on Linux')
+    func = getattr(_libc(), name)
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+def sendmsg_fds(sock, data, fds):
+    """
+    Sends data along with the given file descriptors over a unix socket.
+
+    :param sock: the low-level socket object
+    :param data: the (non-empty) data to send
+    :param fds: list of file descriptors (ints)
+    :returns: the number of bytes of data sent
+    :raises: socket.error if the send failed
+    """
+    if hasattr(sock, 'sendmsg'):
+        # Python 3.3 and later.
+        return sock.sendmsg([data], [(socket.SOL_SOCKET, SCM_RIGHTS, struct.pack('%di' % len(fds), *fds))])
+
+    sendmsg = _libc_msg('sendmsg')
+    buf = ctypes.create_string_buffer(data, len(data))
+    iov = _iovec(ctypes.cast(buf, ctypes.c_void_p), len(data))
+    fdata = struct.pack('%di' % len(fds), *fds)
+    control = ctypes.create_string_buffer(_cmsg_space(len(fdata)))
+    header = _cmsghdr(_cmsg_align(ctypes.sizeof(_cmsghdr)) + len(fdata), socket.SOL_SOCKET, SCM_RIGHTS)
+    ctypes.memmove(control, ctypes.byref(header), ctypes.sizeof(header))
+    ctypes.memmove(ctypes.byref(control, _cmsg_align(ctypes.sizeof(_cmsghdr))), fdata, len(fdata))
+    msg = _msghdr(None, 0, ctypes.pointer(iov), 1, ctypes.cast(control, ctypes.c_void_p), len(control), 0)
+    sent = sendmsg(sock.fileno(), ctypes.byref(msg), 0)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise socket.error(err, os.strerror(err))
+    return sent
+
+
+def recvmsg_fds(sock, size, maxfds=64):
+    """
+    Receives data and any file descriptors passed with it over a unix socket.
+
+    :param sock: the low-level socket object
+    :param size: maximum number of bytes to receive
+    :param maxfds: maximum number of file descriptors to receive
+    :returns: 2-tuple (data, fds)
+    :raises: socket.error if the receive failed
+
+    Received file descriptors have the close-on-exec flag set.
+    """
+    fdsize = struct.calcsize('i')
+    if hasattr(sock, 'recvmsg'):
+        # Python 3.3 and later.
+        data, ancdata, flags, addr = sock.recvmsg(size, socket.CMSG_SPACE(maxfds * fdsize), MSG_CMSG_CLOEXEC)
+        cmsgs = [(level, tp, cdata) for level, tp, cdata in ancdata]
+    else:
+        recvmsg = _libc_msg('recvmsg')
+        buf = ctypes.create_string_buffer(size)
+        iov = _iovec(ctypes.cast(buf, ctypes.c_void_p), size)
+        control = ctypes.create_string_buffer(_cmsg_space(maxfds * fdsize))
+        msg = _msghdr(None, 0, ctypes.pointer(iov), 1, ctypes.cast(control, ctypes.c_void_p), len(control), 0)
+        received = recvmsg(sock.fileno(), ctypes.byref(msg), MSG_CMSG_CLOEXEC)
+        if received < 0:
+            err = ctypes.get_errno()
+            raise socket.error(err, os.strerror(err))
+        data, flags = buf.raw[:received], msg.msg_flags
+
+        cmsgs = []
+        offset, hdrsize = 0, ctypes.sizeof(_cmsghdr)
+        raw = control.raw[:msg.msg_controllen]
+        while offset + hdrsize <= len(raw):
+            header = _cmsghdr.from_buffer_copy(raw[offset:offset + hdrsize])
+            if header.cmsg_len < hdrsize:
+                break
+            start = offset + _cmsg_align(hdrsize)
+            cmsgs.append((header.cmsg_level, header.cmsg_type, raw[start:offset + header.cmsg_len]))
+            offset += _cmsg_align(header.cmsg_len)
+
+    fds = []
+    for level, tp, cdata in cmsgs:
+        if level == socket.SOL_SOCKET and tp == SCM_RIGHTS:
+            count = len(cdata) // fdsize
+            fds.extend(struct.unpack('%di' % count, cdata[:count * fdsize]))
+    if flags & MSG_CTRUNC:
+        log.warning('File descriptors passed over unix socket were truncated (more than %d)', maxfds)
+    return data, fds
+
+
+def _socket_from_fd(fd):
+    """
+    Returns a low-level socket object for the given socket file descriptor,
+    which is then closed (the socket object holds a duplicate).
+    """
+    probe = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # The family is needed to interpret addresses correctly.
+        family = probe.getsockopt(socket.SOL_SOCKET, SO_DOMAIN) if SO_DOMAIN else socket.AF_UNIX
+        tp = probe.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
+    finally:
+        probe.close()
+    sock = socket.fromfd(fd, family, tp)
+    os.close(fd)
+    return sock
+
+
+
+class _FDMessage(BYTES_TYPE):
+    """
+    Data queued for writing by Socket.send_fds(), which is sent along with
+    the file descriptors in the fds attribute.  When only part of the data
+    can be written, the remainder is queued as a plain string, as the
+    descriptors are passed with the first byte.
+    """
+    def __new__(cls, data, fds):
+        obj = super(_FDMessage, cls).__new__(cls, data)
+        obj.fds = fds
+        return obj
+
+    def __getslice__(self, i, j):
+        # A slice from the start (e.g. when a write is rate limited, or
+        # nothing could be sent) still carries the descriptors.
+        data = BYTES_TYPE.__getslice__(self, i, j)
+        return _FDMessage(data, self.fds) if i == 0 and data else data
+
+
+
+class _ConnectAttempts(object):
+    """
+    Staggered parallel connection attempts to a list of addresses, as
+    described in RFC 8305 ("Happy Eyeballs").
+
+    Addresses are interleaved by family (starting with the family of the
+    first, most preferred, address).  A new non-blocking connect is started
+    whenever *delay* seconds pass without a connection or the most recent
+    attempt fails.  The first attempt that succeeds wins and all others are
+    closed.  If all attempts fail, the first error is thrown.
+    """
+    def __init__(self, addrinfo, delay):
+        first = [res for res in addrinfo if res[0] == addrinfo[0][0]]
+        other = [res for res in addrinfo if res[0] != addrinfo[0][0]]
+        self._pending = []
+        while first or other:
+            self._pending.extend(l.pop(0) for l in (first, other) if l)
+        self._delay = delay
+        # Maps socket -> IOMonitor for connects in progress.
+        self._attempts = {}
+        self._errors = []
+        self._timer = OneShotTimer(self._start_next)
+        self.inprogress = InProgress()
+        self.inprogress.signals['abort'].connect(lambda exc: self._cancel())
+
+
+    def start(self):
+        self._start_next()
+        return self.inprogress
+
+
+    def _start_next(self):
+        while self._pending and not self.inprogress.finished:
+            af, socktype, proto, cn, sa = self._pending.pop(0)
+            try:
+                sock = socket.socket(af, socktype, proto)
+                sock.setblocking(False)
+                err = sock.connect_ex(sa)
+            except socket.error:
+                self._errors.append(sys.exc_info())
+                continue
+            if err == 0:
+                return self._finish(sock)
+            elif err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                sock.close()
+                self._errors.append((socket.error, socket.error(err, os.strerror(err)), None))
+                continue
+
+            log.debug('Attempting connection to %s', sa)
+            mon = IOMonitor(self._handle_connect, sock)
+            mon.register(sock.fileno(), IO_WRITE)
+            self._attempts[sock] = mon
+            if self._pending:
+                self._timer.start(self._delay)
+            return
+
+        if not self._attempts and not self.inprogress.finished:
+            # Nothing left to try and nothing in progress.
+            if self._errors:
+                self.inprogress.throw(*self._errors[0])
+            else:
+                self.inprogress.throw(socket.error, socket.error('destination has no addresses'), None)
+
+
+    def _handle_connect(self, sock):
+        self._attempts.pop(sock).unregister()
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err == 0:
+            return self._finish(sock)
+        sock.close()
+        self._errors.append((socket.error, socket.error(err, os.strerror(err)), None))
+        # Don't wait out the delay when an attempt fails.
+        self._timer.stop()
+        self._start_next()
+
+
+    def _cancel(self):
+        self._timer.stop()
+        self._pending = []
+        for sock, mon in self._attempts.items():
+            mon.unregister()
+            sock.close()
+        self._attempts.clear()
+
+
+    def _finish(self, sock):
+        self._cancel()
+        self.inprogress.finish(sock)
+
+
+
 class Socket(IOChannel):
     """
     Communicate over TCP or Unix sockets, implementing fully asynchronous reads
@@ -138,6 +417,11 @@ class Socket(IOChannel):
             can be used to prevent the client connection by returning False from
             the callback. If False, the callback must explicitly call
             :meth:`~kaa.Socket.listen` or the client will not be connected.
+
+            When callbacks are connected to this signal, connections are only
+            accepted in batches (see :attr:`~kaa.Socket.accept_batch`) if the
+            number of pending connections can be determined, so that the
+            signal is only emitted for clients that are actually waiting.
             ''',
 
         'new-client':
@@ -204,7 +488,7 @@ class Socket(IOChannel):
             host = host[1:-1]
         # Resolve service name to port number
         if isinstance(service, basestring):
-            service = int(service) if service.isdigit() else socket.getservbyname(service)
+            service = int(service) if service.isdigit() else _resolver().getservbyname(service)
         # Resolve interface names to index values
         if isinstance(scopeid, basestring):
             scopeid = int(scopeid) if scopeid.isdigit() else if_nametoindex(scopeid)
@@ -215,7 +499,7 @@ class Socket(IOChannel):
 
     @staticmethod
     def create_connection(addr=None, timeout=TIMEOUT_SENTINEL, source_address=None,
-                          overwrite=False, ipv6=True):
+                          overwrite=False, ipv6=True, reuse_port=False):
         addr = Socket.normalize_address(addr) if addr else None
         source_address = Socket.normalize_address(source_address) if source_address else None
 
@@ -260,13 +544,13 @@ class Socket(IOChannel):
             elif source_address[0] == '::' and ipv6:
                 source_addrinfo = [(socket.AF_INET6, socket.SOCK_STREAM, 0, 0, source_address)]
             else:
-                source_addrinfo = socket.getaddrinfo(source_address[0], source_address[1],
-                                                     req_family, socket.SOCK_STREAM)
+                source_addrinfo = _resolver().getaddrinfo(source_address[0], source_address[1],
+                                                          req_family, socket.SOCK_STREAM)
                 if not source_addrinfo:
                     raise socket.error('getaddrinfo returned empty list for source address')
 
         if addr:
-            addr_addrinfo = socket.getaddrinfo(addr[0], addr[1], req_family, socket.SOCK_STREAM)
+            addr_addrinfo = _resolver().getaddrinfo(addr[0], addr[1], req_family, socket.SOCK_STREAM)
             if not addr_addrinfo:
                 raise socket.error('getaddrinfo returned empty list for destination address')
 
@@ -282,6 +566,10 @@ class Socket(IOChannel):
                 try:
                     sock = socket.socket(b_af, b_socktype, b_proto)
                     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if reuse_port:
+                        if SO_REUSEPORT is None:
+                            raise socket.error(errno.ENOPROTOOPT, 'SO_REUSEPORT not supported on this platform')
+                        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
                     b_sa = b_sa[:2] + source_address[2:]
                     sock.bind(b_sa if b_af == socket.AF_INET6 else b_sa[:2])
                 except socket.error:
@@ -327,6 +615,20 @@ class Socket(IOChannel):
         # If an InProgress object then there is an accept() call in progress,
         # otherwise None.
         self._accept_inprogress = None
+        # Maximum connections accepted per read notification on listening
+        # sockets, and counters for accept activity.
+        self._accept_batch = 32
+        self._backlog = None
+        self._accept_stats = {'accepted': 0, 'dropped': 0, 'deferred': 0, 'backlog_full': 0}
+        # Started when accept() runs out of resources, to stop accepting
+        # (and so spinning on the readable listener) for a while.
+        self._accept_retry = WeakOneShotTimer(self._update_read_monitor)
+        self._accept_deferring = False
+        self._connect_delay = 0.25
+        # If True, reads use recvmsg() to receive passed file descriptors,
+        # which are held in _received_fds until collected by recv_fds().
+        self._pass_fds = False
+        self._received_fds = []
 
         super(Socket, self).__init__(chunk_size=chunk_size)
 
@@ -361,6 +663,65 @@ class Socket(IOChannel):
         self._auto_accept = value
 
 
+    @property
+    def accept_batch(self):
+        """
+        Maximum number of connections accepted on a listening socket each
+        time the mainloop reports it readable.
+
+        Accepting a batch of connections per notification, rather than one,
+        lets a listener keep up with connection storms (for example, many
+        clients reconnecting after a server restart) before the kernel's
+        backlog overflows.  The default is 32.
+        """
+        return self._accept_batch
+
+
+    @accept_batch.setter
+    def accept_batch(self, value):
+        self._accept_batch = max(1, value)
+
+
+    @property
+    def connect_delay(self):
+        """
+        Number of seconds :meth:`connect` waits for a connection attempt to
+        succeed before starting an attempt to the next address in parallel.
+
+        The default is 0.25, as recommended by RFC 8305.
+        """
+        return self._connect_delay
+
+
+    @connect_delay.setter
+    def connect_delay(self, value):
+        self._connect_delay = value
+
+
+    @property
+    def accept_stats(self):
+        """
+        A dict of counters for connections on a listening socket.
+
+        The dict contains the following keys:
+
+            * *accepted*: number of connections accepted.
+            * *dropped*: number of pending connections lost because they
+              were aborted by the client before they could be accepted.
+            * *deferred*: number of times a pending connection could not be
+              accepted because of resource exhaustion (e.g. out of file
+              descriptors).  The connection stays in the kernel backlog, and
+              accepting is retried after a short delay.
+            * *backlog_full*: number of read notifications for which the
+              kernel accept queue was found full, meaning further clients may
+              have been refused.  This is only available on Linux TCP sockets,
+              and is otherwise always 0.
+
+        The returned dict is a copy.
+        """
+        return self._accept_stats.copy()
+
+
     @property
     def address(self):
         """
@@ -555,7 +916,7 @@ class Socket(IOChannel):
 
 
 
-    def listen(self, addr, backlog=5, ipv6=True):
+    def listen(self, addr, backlog=None, ipv6=True, reuse_port=False):
         """
         Set the socket to accept incoming connections.
 
@@ -563,15 +924,26 @@ class Socket(IOChannel):
                      specifies a TCP port that is bound on all interfaces; if a
                      str, it is either a Unix socket path or represents a TCP
                      socket when in the form ``[host]:[service][%scope]``.
-                     See below for further details.
-        :type addr: int, str, or 2- or 4-tuple
+                     See below for further details.  It may also be an
+                     already bound low-level socket object, which is used
+                     as is (such as one shared between processes by
+                     :class:`~kaa.net.PreforkServer`).
+        :type addr: int, str, 2- or 4-tuple, or socket.socket
         :param backlog: the maximum length to which the queue of pending
-                        connections for the socket may grow.
+                        connections for the socket may grow.  If None, the
+                        system maximum (``socket.SOMAXCONN``) is used.  The
+                        kernel may impose a lower limit (under Linux, this
+                        can be raised via /proc/sys/net/core/somaxconn).
         :type backlog: int
         :param ipv6: if True, will prefer binding to IPv6 addresses if addr is
                      a hostname that contains both AAAA and A records.  If addr
                      is specified as an IP address, this argument does nothing.
         :type ipv6: bool
+        :param reuse_port: if True, sets ``SO_REUSEPORT`` on the socket, so
+                           that several processes may bind to the same TCP
+                           address and have the kernel distribute incoming
+                           connections between them.
+        :type reuse_port: bool
         :raises: ValueError if *addr* is invalid, or socket.error if the bind fails.
 
         If *addr* is given as a 4-tuple, it is in the form ``(host, service,
@@ -607,24 +979,58 @@ class Socket(IOChannel):
         connection.  Callbacks connecting to the signal will receive a new
         Socket object representing the client connection.
         """
-        sock = Socket.create_connection(source_address=addr, overwrite=True)
-        sock.listen(backlog)
+        if isinstance(addr, socket.socket):
+            sock = addr
+        else:
+            sock = Socket.create_connection(source_address=addr, overwrite=True, reuse_port=reuse_port)
+        self._backlog = backlog or socket.SOMAXCONN
+        sock.listen(self._backlog)
         self._listening = True
         self.wrap(sock, IO_READ | IO_WRITE)
 
 
     @threaded()
     def _connect(self, addr, source_address=None, ipv6=True):
-        sock = Socket.create_connection(addr, source_address=source_address, ipv6=ipv6)
-        # Normalize and store hostname
-        addr = Socket.normalize_address(addr)
-        if type(addr) == str:
-            # Unix socket, just connect.
-            self._reqhost = addr
-        else:
-            self._reqhost = addr[0]
+        try:
+            sock = Socket.create_connection(addr, source_address=source_address, ipv6=ipv6)
+            # Normalize and store hostname
+            addr = Socket.normalize_address(addr)
+            if type(addr) == str:
+                # Unix socket, just connect.
+                self._reqhost = addr
+            else:
+                self._reqhost = addr[0]
+            self.wrap(sock, IO_READ | IO_WRITE)
+        finally:
+            self._connecting = False
 
+
+    @coroutine()
+    def _resolve_and_connect(self, addr, source_address, ipv6):
+        """
+        Resolves the destination hostname with the caching resolver and
+        connects using staggered parallel non-blocking connection attempts
+        from the mainloop.
+
+        Unix sockets and connections from a given source address are
+        handled by create_connection() in a thread.
+        """
         try:
+            norm = Socket.normalize_address(addr)
+            if isinstance(norm, basestring) or source_address:
+                yield self._connect(addr, source_address, ipv6)
+                return
+
+            host, port, flowinfo, scopeid = norm
+            family = socket.AF_UNSPEC if ipv6 else socket.AF_INET
+            addrinfo = yield _resolver().resolve(host, port, family, socket.SOCK_STREAM)
+            if flowinfo or scopeid:
+                # Apply the given flowinfo and scope to IPv6 addresses (needed
+                # for link-local addresses).
+                addrinfo = [res[:4] + (res[4][:2] + (flowinfo, scopeid),)
+                            if res[0] == socket.AF_INET6 else res for res in addrinfo]
+            sock = yield _ConnectAttempts(addrinfo, self._connect_delay).start()
+            self._reqhost = host
             self.wrap(sock, IO_READ | IO_WRITE)
         finally:
             self._connecting = False
@@ -671,25 +1077,50 @@ class Socket(IOChannel):
         specified.  Relative Unix socket names (those not prefixed with ``/``)
         are created via :func:`kaa.tempfile`.
 
-        This function is executed in a thread to avoid blocking.  It therefore
-        returns an InProgress object.  If the socket is connected, the InProgress
-        is finished with no arguments.  If the connection cannot be established,
+        The connection is established asynchronously, so this method returns
+        an InProgress object.  If the socket is connected, the InProgress is
+        finished with no arguments.  If the connection cannot be established,
         an exception is thrown to the InProgress.
+
+        When the hostname resolves to several addresses, connection attempts
+        are made in parallel but staggered by :attr:`connect_delay` seconds,
+        alternating between IPv6 and IPv4 addresses (RFC 8305, "Happy
+        Eyeballs").  The first attempt to succeed is used and the others are
+        abandoned, so an unreachable address (for example, a blackholed IPv6
+        route) only delays the connection by :attr:`connect_delay`.  If all
+        attempts fail, the first error is thrown.  (Unix sockets, and
+        connections with *source_address*, are established from a thread.)
+
+        Hostnames are resolved using the caching resolver from
+        :mod:`kaa.net.resolver` (see :func:`kaa.net.resolve`), so reconnecting
+        to the same host does not repeat the lookup.
         """
         if self._connecting:
             raise SocketError('connection already in progress')
         elif self.connected:
             raise SocketError('socket already connected')
         self._connecting = True
-        return self._connect(addr, source_address, ipv6)
+        return self._resolve_and_connect(addr, source_address, ipv6)
 
 
     def wrap(self, sock, mode=IO_READ|IO_WRITE):
         """
         Wraps an existing low-level socket object.
 
-        addr specifies the 4-tuple address corresponding to the socket.
+        :param sock: the socket object to wrap, or a socket file descriptor
+                     (such as one received from :meth:`recv_fds`), in which
+                     case the Socket takes ownership of the descriptor.
+        :type sock: socket.socket or int
+        :param mode: :attr:`~kaa.IO_READ` and/or :attr:`~kaa.IO_WRITE`
+
+        If a file descriptor of a listening socket is given, the Socket
+        starts accepting connections from it.
         """
+        if isinstance(sock, (int, long)):
+            sock = _socket_from_fd(sock)
+            if SO_ACCEPTCONN and sock.getsockopt(socket.SOL_SOCKET, SO_ACCEPTCONN):
+                self._listening = True
+                self._backlog = socket.SOMAXCONN
         super(Socket, self).wrap(sock, mode)
         if sock and self._buffer_size:
             self._set_buffer_size(sock, self._buffer_size)
@@ -697,7 +1128,9 @@ class Socket(IOChannel):
 
 
     def _is_read_connected(self):
-        return self._listening or super(Socket, self)._is_read_connected()
+        if self._listening:
+            return not self._accept_retry.active
+        return super(Socket, self)._is_read_connected()
 
 
     def _set_non_blocking(self):
@@ -705,18 +1138,86 @@ class Socket(IOChannel):
 
 
     def _read(self, size):
+        if self._pass_fds:
+            data, fds = recvmsg_fds(self._channel, size)
+            self._received_fds.extend(fds)
+            return data
         return self._channel.recv(size)
 
 
     def _write(self, data):
+        if isinstance(data, _FDMessage):
+            return sendmsg_fds(self._channel, data, data.fds)
         return self._channel.send(data)
 
 
+    def _check_unix(self):
+        if not self._channel or self._channel.family != socket.AF_UNIX:
+            raise SocketError('file descriptors can only be passed over connected unix sockets')
+
+
+    def send_fds(self, data, fds):
+        """
+        Writes data to a unix socket along with file descriptors, which the
+        remote end receives with :meth:`recv_fds`.
+
+        :param data: the data to send along with the descriptors; must not be
+                     empty.
+        :type data: bytes
+        :param fds: the file descriptors to pass, as ints or objects with a
+                    ``fileno()`` method (such as sockets or files)
+        :type fds: list
+        :returns: an :class:`~kaa.InProgress` as with :meth:`~kaa.IOChannel.write`,
+                  finished when the data and descriptors have been sent.
+
+        The data is queued along with other writes, so the descriptors are
+        received along with the data in the order it was written.  The
+        descriptors are duplicated into the receiving process when the data
+        is sent, so they must not be closed until the InProgress has
+        finished, but may be closed after.  This can be used to hand accepted
+        connections to another process without copying any data.
+        """
+        self._check_unix()
+        if not data:
+            raise ValueError('At least one byte of data must be sent with file descriptors')
+        fds = [fd if isinstance(fd, (int, long)) else fd.fileno() for fd in fds]
+        return self.write(_FDMessage(data, fds))
+
+
+    @coroutine()
+    def recv_fds(self):
+        """
+        Reads data from a unix socket along with any file descriptors passed
+        by the remote end with :meth:`send_fds`.
+
+        :returns: an :class:`~kaa.InProgress` finished with a 2-tuple
+                  (data, fds), where *fds* is a list of file descriptors (ints)
+                  received with the data, which may be empty.  The caller owns
+                  the descriptors and is responsible for closing them, or
+                  passing them to :meth:`wrap`.
+
+        The first call enables receipt of descriptors on this socket, after
+        which all reads from it (including those for the
+        :attr:`~kaa.IOChannel.signals.read` signal) collect any passed
+        descriptors for the next recv_fds() call.  Descriptors passed before
+        then may be discarded by the kernel, so recv_fds() should be called
+        before the remote end starts sending them.  Descriptors not collected
+        by the time the socket is closed are closed.
+        """
+        self._check_unix()
+        self._pass_fds = True
+        data = yield self.read()
+        fds, self._received_fds = self._received_fds, []
+        yield data, fds
+
+
     def _accept(self):
         """
         Accept a new connection and return a new Socket object.
         """
         sock, addr = self._channel.accept()
+        self._accept_stats['accepted'] += 1
+        self._accept_deferring = False
         # create new Socket from the same class this object is
         client_socket = self._make_new()
         client_socket.wrap(sock, IO_READ | IO_WRITE)
@@ -734,22 +1235,92 @@ class Socket(IOChannel):
         return self._accept_inprogress
 
 
-    def _handle_read(self):
-        if self._listening:
+    def _get_accept_queue(self):
+        """
+        Returns a 2-tuple (pending, max) describing the kernel accept queue of
+        a listening socket, or None if this can't be determined.
+
+        Only Linux TCP sockets are supported, where for listening sockets the
+        tcpi_unacked and tcpi_sacked fields of struct tcp_info hold the current
+        and maximum accept queue lengths.
+        """
+        if not hasattr(socket, 'TCP_INFO') or self._channel.family not in (socket.AF_INET, socket.AF_INET6):
+            return None
+        try:
+            info = self._channel.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 32)
+            return struct.unpack_from('8x4x4x4x4xII', info)
+        except (socket.error, struct.error):
+            return None
+
+
+    def _handle_accept(self):
+        """
+        Accepts up to accept_batch pending connections on a listening socket.
+        """
+        queue = self._get_accept_queue()
+        if queue and queue[0] >= queue[1]:
+            self._accept_stats['backlog_full'] += 1
+            log.warning('Accept queue full on %s (%d pending)', self, queue[0])
+
+        batch = self._accept_batch
+        if len(self.signals['new-client-connecting']):
+            # Don't emit new-client-connecting unless we know a client is
+            # waiting.
+            batch = min(batch, queue[0]) if queue else 1
+
+        for i in xrange(max(batch, 1)):
             # Give callbacks on the new-client-connecting signal the chance to
             # abort the autoaccept (if applicable).  If we have an explicit
             # accept() in progress then it can't be aborted, but we still emit
             # anyway for notification purposes.
             aborted = self.signals['new-client-connecting'].emit() == False
-            if (self._auto_accept and not aborted) or self._accept_inprogress:
-                return self._accept()
+            if not ((self._auto_accept and not aborted) or self._accept_inprogress):
+                return False if i == 0 else True
+            try:
+                self._accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # No more pending connections.
+                    break
+                elif e.args[0] in ACCEPT_ABORTED_ERRORS:
+                    self._accept_stats['dropped'] += 1
+                    continue
+                elif e.args[0] in ACCEPT_RESOURCE_ERRORS:
+                    # The connection remains pending.  Stop monitoring the
+                    # listener for a while rather than spin on it until
+                    # resources are freed.
+                    self._accept_stats['deferred'] += 1
+                    if not self._accept_deferring:
+                        # Only log once until a connection is accepted again.
+                        self._accept_deferring = True
+                        log.error('Unable to accept connection on %s: %s', self, e.args[1])
+                    self._accept_retry.start(ACCEPT_RETRY_DELAY)
+                    self._update_read_monitor()
+                    break
+                raise
+            if not self._listening or not self._channel:
+                # Closed by a callback.
+                break
+        return True
+
 
+    def _handle_read(self):
+        if self._listening and self._handle_accept():
+            return
         return super(Socket, self)._handle_read()
 
 
     def _close(self):
         super(Socket, self)._close()
+        self._accept_retry.stop()
         self._reqhost = None
+        # Close any passed file descriptors no one collected.
+        for fd in self._received_fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._received_fds = []
         if self._listening and isinstance(self.local, basestring) and self.local.startswith('/'):
             # Remove unix socket if it exists.
             try:
@@ -763,4 +1334,475 @@ class Socket(IOChannel):
             raise TypeError('Can only steal from other sockets')
 
         self._buffer_size = socket._buffer_size
+        self._accept_batch = socket._accept_batch
+        self._pass_fds = socket._pass_fds
+        self._received_fds, socket._received_fds = socket._received_fds, []
         return super(Socket, self).steal(socket)
+
+
+
+class DatagramSocket(Object):
+    """
+    Send and receive datagrams over UDP, implementing fully asynchronous
+    sends and receives.
+
+    :param buffer_size: size of the send and receive socket buffers; see
+                        :attr:`~kaa.DatagramSocket.buffer_size`.
+    :type buffer_size: int
+    :param batch_size: maximum number of datagrams received per read
+                       notification; see
+                       :attr:`~kaa.DatagramSocket.batch_size`.
+    :type batch_size: int
+
+    Unlike :class:`~kaa.Socket`, which is stream-based, message boundaries
+    are preserved: each :meth:`sendto` transmits one datagram, and each
+    *datagram* signal emission or :meth:`recvfrom` result corresponds to one
+    received datagram.
+
+    As with :class:`~kaa.IOChannel`, data is only received from the socket
+    when someone is interested in it (a callback is connected to the
+    *datagram* signal or a :meth:`recvfrom` call is in progress).  Otherwise
+    datagrams remain queued in the kernel.
+    """
+    __kaasignals__ = {
+        'datagram':
+            '''
+            Emitted for each datagram received on the socket.
+
+            .. describe:: def callback(data, addr, ...)
+
+               :param data: the payload of the datagram
+               :type data: str
+               :param addr: the address of the sender, as returned by
+                            ``socket.recvfrom()``
+               :type addr: tuple
+            ''',
+
+        'closed':
+            '''
+            Emitted when the socket is closed.
+
+            .. describe:: def callback(...)
+            '''
+    }
+
+    def __init__(self, buffer_size=None, batch_size=64):
+        super(DatagramSocket, self).__init__()
+        self._sock = None
+        self._buffer_size = buffer_size
+        self._batch_size = batch_size
+        self._max_datagram_size = 65535
+        # List of (data, sockaddr, InProgress) waiting for the socket to
+        # become writable.
+        self._send_queue = []
+        # List of InProgress objects for pending recvfrom() calls.
+        self._recv_inprogress = []
+        self._rmon = self._wmon = None
+        self.signals['datagram'].changed_cb = WeakCallable(self._update_read_monitor)
+
+
+    def __repr__(self):
+        if not self._sock:
+            return '<kaa.%s - disconnected>' % self.__class__.__name__
+        return '<kaa.%s fd=%s>' % (self.__class__.__name__, self.fileno)
+
+
+    @property
+    def fileno(self):
+        """
+        The file descriptor of the socket, or None if the socket is closed.
+        """
+        try:
+            return self._sock.fileno()
+        except (AttributeError, socket.error):
+            return None
+
+
+    @property
+    def alive(self):
+        """
+        True if the socket exists and is open.
+        """
+        return self._sock is not None
+
+
+    @property
+    def local(self):
+        """
+        The address the socket is bound to, as returned by
+        ``socket.getsockname()``.
+        """
+        return self._sock.getsockname() if self._sock else None
+
+
+    @property
+    def family(self):
+        """
+        The address family of the socket (``socket.AF_INET`` or
+        ``socket.AF_INET6``), or None if the socket is not yet created.
+        """
+        return self._sock.family if self._sock else None
+
+
+    @property
+    def batch_size(self):
+        """
+        Maximum number of datagrams received per read notification.
+
+        When the socket becomes readable, datagrams are received in a loop
+        until no more are immediately available or this many have been
+        received, rather than going back through the mainloop for each
+        datagram.  The default is 64.
+        """
+        return self._batch_size
+
+
+    @batch_size.setter
+    def batch_size(self, value):
+        self._batch_size = value
+
+
+    @property
+    def max_datagram_size(self):
+        """
+        The maximum size of a received datagram; larger datagrams are
+        truncated.  The default is 65535.
+        """
+        return self._max_datagram_size
+
+
+    @max_datagram_size.setter
+    def max_datagram_size(self, value):
+        self._max_datagram_size = value
+
+
+    @property
+    def buffer_size(self):
+        """
+        Size of the send and receive socket buffers (SO_SNDBUF and SO_RCVBUF)
+        in bytes.
+
+        For high packet rates, a larger receive buffer reduces the chance of
+        datagrams being dropped by the kernel between read notifications.
+        """
+        return self._buffer_size
+
+
+    @buffer_size.setter
+    def buffer_size(self, size):
+        self._buffer_size = size
+        if self._sock and size:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+
+    @property
+    def send_queue_used(self):
+        """
+        The number of datagrams queued in memory to be sent.
+        """
+        return len(self._send_queue)
+
+
+    def _getaddrinfo(self, addr, flags=0):
+        """
+        Resolves the given address (in any form accepted by
+        :meth:`Socket.normalize_address`) to a list of getaddrinfo() results
+        for datagram sockets.
+        """
+        addr = Socket.normalize_address(addr)
+        if isinstance(addr, basestring):
+            raise ValueError('Unix sockets are not supported for DatagramSocket')
+        host, port, flowinfo, scopeid = addr
+        family = self._sock.family if self._sock else socket.AF_UNSPEC
+        info = _resolver().getaddrinfo(host or None, port, family, socket.SOCK_DGRAM, 0, flags)
+        if not info:
+            raise socket.error('getaddrinfo returned empty list for address')
+        if info[0][0] == socket.AF_INET6:
+            info = [res[:4] + (res[4][:2] + (flowinfo, scopeid),) for res in info]
+        return info
+
+
+    def _adopt(self, sock):
+        """
+        Makes the given low-level socket the underlying socket, sets it
+        non-blocking, and creates the IOMonitors.
+        """
+        sock.setblocking(False)
+        self._sock = sock
+        if self._buffer_size:
+            self.buffer_size = self._buffer_size
+        self._rmon = WeakIOMonitor(self._handle_read)
+        self._wmon = WeakIOMonitor(self._handle_write)
+        self._update_read_monitor()
+        if self._send_queue:
+            self._wmon.register(sock.fileno(), IO_WRITE)
+        return sock
+
+
+    def bind(self, addr, reuse=False):
+        """
+        Binds the socket to the given local address.
+
+        :param addr: the address to bind to, in any form accepted by
+                     :meth:`Socket.listen` (except Unix sockets).  If an int,
+                     it specifies a port that is bound on all interfaces.
+        :type addr: int, str, or 2- or 4-tuple
+        :param reuse: if True, sets SO_REUSEADDR (and SO_REUSEPORT where
+                      available) so multiple sockets may bind the same
+                      port, as is typically needed for multicast receivers.
+        :type reuse: bool
+        :returns: self
+        :raises: ValueError if *addr* is invalid, or socket.error if the bind
+                 fails.
+
+        .. warning::
+
+           If *addr* contains a hostname rather than an IP address, this
+           method will block in order to resolve it.
+        """
+        if self._sock:
+            raise SocketError('socket already bound')
+        err = None
+        for af, socktype, proto, cn, sa in self._getaddrinfo(addr, socket.AI_PASSIVE):
+            sock = socket.socket(af, socktype, proto)
+            try:
+                if reuse:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if hasattr(socket, 'SO_REUSEPORT'):
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                sock.bind(sa)
+            except socket.error:
+                err = sys.exc_info() if not err else err
+                sock.close()
+                continue
+            self._adopt(sock)
+            return self
+        raise err[0], err[1], err[2]
+
+
+    def _multicast_request(self, group, interface):
+        """
+        Returns (level, mreq) for use with the (ADD|DROP)_MEMBERSHIP or
+        IPV6_(JOIN|LEAVE)_GROUP socket options.
+        """
+        if not self._sock:
+            raise SocketError('socket must be bound before joining a multicast group')
+        if self._sock.family == socket.AF_INET6:
+            if isinstance(interface, basestring):
+                interface = int(interface) if interface.isdigit() else if_nametoindex(interface)
+            mreq = socket.inet_pton(socket.AF_INET6, group) + struct.pack('@I', interface or 0)
+            return socket.IPPROTO_IPV6, mreq
+        mreq = socket.inet_aton(group) + socket.inet_aton(interface or '0.0.0.0')
+        return socket.IPPROTO_IP, mreq
+
+
+    def join_group(self, group, interface=None):
+        """
+        Joins the given multicast group.
+
+        :param group: the multicast group address (e.g. ``239.255.0.1`` or
+                      ``ff02::fb``)
+        :type group: str
+        :param interface: for IPv4, the IP address of the local interface to
+                          join on; for IPv6, the interface name or index.  If
+                          None, the kernel picks the interface.
+        :type interface: str or int
+
+        The socket must already be bound (usually to the multicast port with
+        ``reuse=True``).
+        """
+        level, mreq = self._multicast_request(group, interface)
+        opt = socket.IPV6_JOIN_GROUP if level == socket.IPPROTO_IPV6 else socket.IP_ADD_MEMBERSHIP
+        self._sock.setsockopt(level, opt, mreq)
+
+
+    def leave_group(self, group, interface=None):
+        """
+        Leaves a multicast group previously joined with :meth:`join_group`.
+        """
+        level, mreq = self._multicast_request(group, interface)
+        opt = socket.IPV6_LEAVE_GROUP if level == socket.IPPROTO_IPV6 else socket.IP_DROP_MEMBERSHIP
+        self._sock.setsockopt(level, opt, mreq)
+
+
+    def set_multicast_options(self, ttl=None, loop=None):
+        """
+        Sets options for outgoing multicast datagrams.
+
+        :param ttl: the time-to-live (hop limit) of outgoing multicast
+                    datagrams; the kernel default is 1.
+        :type ttl: int
+        :param loop: whether outgoing multicast datagrams are looped back
+                     to local receivers.
+        :type loop: bool
+        """
+        if not self._sock:
+            raise SocketError('socket is not bound')
+        if self._sock.family == socket.AF_INET6:
+            level, opt_ttl, opt_loop = socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, socket.IPV6_MULTICAST_LOOP
+        else:
+            level, opt_ttl, opt_loop = socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, socket.IP_MULTICAST_LOOP
+        if ttl is not None:
+            self._sock.setsockopt(level, opt_ttl, ttl)
+        if loop is not None:
+            self._sock.setsockopt(level, opt_loop, int(bool(loop)))
+
+
+    def sendto(self, data, addr):
+        """
+        Sends a datagram to the given address.
+
+        :param data: the payload of the datagram
+        :type data: str
+        :param addr: the destination address, in any form accepted by
+                     :meth:`Socket.connect` (except Unix sockets)
+        :type addr: str, or 2- or 4-tuple
+        :returns: An :class:`~kaa.InProgress` object, finished with the number
+                  of bytes sent once the datagram was handed to the kernel.
+
+        The datagram is sent immediately if possible, otherwise it is queued
+        until the socket becomes writable.  If the socket has not been bound,
+        it is created for the address family of *addr* and bound implicitly
+        by the kernel.
+
+        .. warning::
+
+           If *addr* contains a hostname rather than an IP address, this
+           method will block in order to resolve it.
+        """
+        if not isinstance(data, BYTES_TYPE):
+            raise ValueError('data must be bytes, not unicode')
+        af, socktype, proto, cn, sa = self._getaddrinfo(addr)[0]
+        if not self._sock:
+            self._adopt(socket.socket(af, socktype, proto))
+
+        ip = InProgress()
+        if not self._send_queue:
+            try:
+                return ip.finish(self._sock.sendto(data, sa))
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.ENOBUFS):
+                    raise
+        self._send_queue.append((data, sa, ip))
+        if not self._wmon.active:
+            self._wmon.register(self.fileno, IO_WRITE)
+        return ip
+
+
+    def recvfrom(self):
+        """
+        Receives a datagram from the socket.
+
+        :returns: An :class:`~kaa.InProgress` object, finished with a 2-tuple
+                  (data, addr) when the next datagram is received.
+
+        Multiple recvfrom() calls may be in progress at once, in which case
+        they are finished with successive datagrams, in order.
+        """
+        if not self._sock:
+            raise SocketError('socket is not bound')
+        ip = InProgress()
+        self._recv_inprogress.append(ip)
+        ip.signals['abort'].connect_weak(self._abort_recv_inprogress, ip)
+        self._update_read_monitor()
+        return ip
+
+
+    def _abort_recv_inprogress(self, exc, ip):
+        try:
+            self._recv_inprogress.remove(ip)
+        except ValueError:
+            pass
+        self._update_read_monitor()
+
+
+    def _update_read_monitor(self, signal=None, action=None):
+        """
+        Registers the read IOMonitor only when someone is interested in
+        datagrams, leaving them in the kernel buffer otherwise.
+        """
+        if not self._rmon:
+            return
+        elif not self._recv_inprogress and not len(self.signals['datagram']):
+            self._rmon.unregister()
+        elif not self._rmon.active:
+            self._rmon.register(self.fileno, IO_READ)
+
+
+    def _handle_read(self):
+        """
+        IOMonitor callback when datagrams can be received.  Receives up to
+        batch_size datagrams before returning to the mainloop.
+        """
+        for i in xrange(self._batch_size):
+            if not self._recv_inprogress and not len(self.signals['datagram']):
+                break
+            try:
+                data, addr = self._sock.recvfrom(self._max_datagram_size)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                    break
+                elif self._recv_inprogress:
+                    self._recv_inprogress.pop(0).throw(*sys.exc_info())
+                    continue
+                log.exception('%s._handle_read failed', self.__class__.__name__)
+                break
+            if self._recv_inprogress:
+                self._recv_inprogress.pop(0).finish((data, addr))
+            self.signals['datagram'].emit(data, addr)
+            if not self._sock:
+                # Closed by a callback.
+                return
+        self._update_read_monitor()
+
+
+    def _handle_write(self):
+        """
+        IOMonitor callback when queued datagrams can be sent.
+        """
+        while self._send_queue:
+            data, sa, ip = self._send_queue[0]
+            try:
+                sent = self._sock.sendto(data, sa)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.ENOBUFS):
+                    return
+                self._send_queue.pop(0)
+                ip.throw(*sys.exc_info())
+                continue
+            self._send_queue.pop(0)
+            ip.finish(sent)
+        self._wmon.unregister()
+
+
+    def _close_monitors(self):
+        if self._rmon:
+            self._rmon.unregister()
+        if self._wmon:
+            self._wmon.unregister()
+        self._rmon = self._wmon = None
+
+
+    def close(self):
+        """
+        Closes the socket.
+
+        Any pending :meth:`recvfrom` calls are finished with None, and any
+        queued datagrams not yet sent are discarded, throwing IOError to their
+        InProgress objects.
+        """
+        if not self._sock:
+            return
+        self._close_monitors()
+        sock, self._sock = self._sock, None
+        sock.close()
+
+        recv, self._recv_inprogress = self._recv_inprogress, []
+        for ip in recv:
+            ip.finish(None)
+        queue, self._send_queue = self._send_queue, []
+        for data, sa, ip in queue:
+            if len(ip):
+                ip.throw(IOError, IOError(errno.EBADF, 'Socket closed prematurely'), None)
+        self.signals['closed'].emit()
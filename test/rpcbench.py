@@ -0,0 +1,91 @@
+# Measures how fast kaa.rpc parses incoming packets, for bursts of small and
+# large payloads, and the call throughput with each serializer and compressor.
+# Usage: python rpcbench.py [MB per run] [calls per run]
+#
+# For framing, data is fed to the channel in 1MB chunks, as read from the
+# socket, and packets are counted rather than dispatched.  Calls are made
+# over a unix socket to a server in the same process, with up to 100 calls
+# outstanding.  Compressors are measured with large, repetitive results.
+import os
+import sys
+import time
+import struct
+import kaa
+import kaa.rpc
+
+mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+calls = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+def bench(payload_size):
+    packet = struct.pack('I4sI', 1, 'CALL', payload_size) + 'x' * payload_size
+    count = max(1, mb * 1024 * 1024 / len(packet))
+    data = packet * count
+    chunks = [data[i:i + 1024 * 1024] for i in range(0, len(data), 1024 * 1024)]
+
+    channel = kaa.rpc.Channel(kaa.Socket(), '')
+    channel._authenticated = True
+    received = [0]
+    def handle(seq, packet_type, payload):
+        received[0] += 1
+    channel._handle_packet_after_auth = handle
+
+    t0 = time.time()
+    for chunk in chunks:
+        channel._handle_read(chunk)
+    elapsed = time.time() - t0
+    assert received[0] == count
+    print '%8d byte payloads: %9d packets/s  %7.1f MB/s' % \
+          (payload_size, count / elapsed, len(data) / elapsed / 1024 / 1024)
+
+class Echo(object):
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+@kaa.coroutine()
+def bench_calls(serializer, name, value, compression=(), calls=calls):
+    client = kaa.rpc.Client(path, 'secret', serializers=(serializer,), compression=compression)
+    yield kaa.inprogress(client)
+    t0 = time.time()
+    pending = []
+    for i in range(calls):
+        pending.append(client.rpc('echo', value))
+        if len(pending) == 100:
+            yield kaa.InProgressAll(*pending)
+            pending = []
+    yield kaa.InProgressAll(*pending)
+    elapsed = time.time() - t0
+    if compression:
+        stats = client.compress_stats
+        print '%-8s %-10s %9d calls/s  %5.1f%% saved  %.2fs compressing' % \
+              (client.compressor, name, calls / elapsed,
+               100.0 * stats['bytes_saved'] / max(1, stats['bytes_compressed']), stats['compress_time'])
+    else:
+        print '%-8s %-10s %9d calls/s' % (serializer, name, calls / elapsed)
+    client.close()
+
+@kaa.coroutine()
+def main():
+    small = (42, 'name', 1.5)
+    record = {'id': 1234, 'title': 'x' * 100, 'tags': ['a', 'b', 'c'], 'size': 1 << 40,
+              'items': [{'n': i, 'v': i * 0.5} for i in range(20)]}
+    for serializer in sorted(kaa.rpc._serializers):
+        for name, value in (('small', small), ('record', record)):
+            yield bench_calls(serializer, name, value)
+    blob = [dict(record, id=i) for i in range(500)]
+    yield bench_calls('pickle', 'blob', blob, calls=calls / 100)
+    for compressor in sorted(kaa.rpc._compressors):
+        yield bench_calls('pickle', 'blob', blob, (compressor,), calls / 100)
+    kaa.main.stop()
+
+print 'Framing:'
+for size in (16, 256, 4096, 65536, 4 * 1024 * 1024):
+    bench(size)
+
+print 'Calls:'
+path = '/tmp/rpcbench-%d.sock' % os.getpid()
+server = kaa.rpc.Server(path, 'secret')
+server.register(Echo())
+main()
+kaa.main.run()
+os.unlink(path)
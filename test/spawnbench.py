@@ -0,0 +1,35 @@
+# Compares the latency of spawning short-lived children with fork and
+# posix_spawn.  Usage: python spawnbench.py [count] [heap MB]
+#
+# The heap argument allocates memory in the parent before spawning, which
+# makes fork (and copying the parent's page tables) progressively slower.
+import sys
+import time
+import kaa
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+heap = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+ballast = [' ' * 1024 * 1024 for i in range(heap)]
+
+@kaa.coroutine()
+def bench(mode):
+    spawn = total = 0
+    for i in range(count):
+        t0 = time.time()
+        ip = kaa.Process(['true'], spawn=mode).start()
+        t1 = time.time()
+        yield ip
+        spawn += t1 - t0
+        total += time.time() - t0
+    print '%-12s start: %7.3f ms   start to exit: %7.3f ms' % \
+          (mode, spawn * 1000 / count, total * 1000 / count)
+
+@kaa.coroutine()
+def main():
+    print '%d children, %d MB heap' % (count, heap)
+    for mode in ('fork', 'posix_spawn'):
+        yield bench(mode)
+    kaa.main.stop()
+
+main()
+kaa.main.run()